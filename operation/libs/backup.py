@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Copia incremental de un directorio (reemplazo de copy_tree)
+#
+# Los archivos que ya existen en el destino con el mismo tamaño y fecha de
+# modificacion (y opcionalmente el mismo md5) no se copian. Los demas se
+# enlazan (hardlink, si se pide y el destino esta en el mismo disco) o se
+# copian en el kernel con copy_file_range/sendfile, con varios hilos. Los
+# enlaces simbolicos se conservan como enlaces.
+#
+import logging
+import os
+import shutil
+import time
+from multiprocessing.pool import ThreadPool
+
+from scripts_op.libs.transfer import md5sum
+
+
+def _copy_data(src, dst):
+    """Copiar el contenido en el kernel (copy_file_range, o sendfile en shutil)"""
+    if not hasattr(os, "copy_file_range"):
+        shutil.copyfile(src, dst)
+        return
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            while size > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(size, 1024 ** 3))
+                if copied == 0:
+                    break
+                size -= copied
+        except OSError:
+            # sistemas de archivos sin copy_file_range (p.ej. entre NFS y local)
+            fdst.seek(0)
+            fdst.truncate()
+            fsrc.seek(0)
+            shutil.copyfileobj(fsrc, fdst, 16 * 1024 ** 2)
+
+
+def _same_file(src_stat, dst, checksum, src):
+    """True si dst ya es una copia de src (tamaño y fecha, y md5 si checksum)"""
+    try:
+        dst_stat = os.stat(dst, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    if dst_stat.st_size != src_stat.st_size or int(dst_stat.st_mtime) != int(src_stat.st_mtime):
+        return False
+    return not checksum or md5sum(src) == md5sum(dst)
+
+
+def _backup_file(item, hardlink=False, checksum=False):
+    """Copiar un archivo (o enlace simbolico), retorna el estado y los bytes copiados"""
+    src, dst, src_stat = item
+
+    if os.path.islink(src):
+        link = os.readlink(src)
+        if os.path.islink(dst) and os.readlink(dst) == link:
+            return "skipped", 0
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.symlink(link, dst)
+        return "copied", 0
+
+    if _same_file(src_stat, dst, checksum, src):
+        return "skipped", 0
+
+    tmp = dst + ".backup"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if hardlink and os.stat(os.path.dirname(dst)).st_dev == src_stat.st_dev:
+        os.link(src, tmp)
+        os.replace(tmp, dst)
+        return "linked", 0
+
+    _copy_data(src, tmp)
+    shutil.copystat(src, tmp)
+    os.replace(tmp, dst)
+    return "copied", src_stat.st_size
+
+
+def _scan(src, dst):
+    """Archivos (ruta, destino, stat) de src creando los directorios en dst, con scandir"""
+    os.makedirs(dst, exist_ok=True)
+    files = []
+    with os.scandir(src) as entries:
+        for entry in entries:
+            target = os.path.join(dst, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                files.extend(_scan(entry.path, target))
+            elif entry.is_file(follow_symlinks=False) or entry.is_symlink():
+                files.append((entry.path, target, entry.stat(follow_symlinks=False)))
+    return files
+
+
+def backup_tree(src, dst, workers=4, hardlink=False, checksum=False):
+    """
+    Incremental copy of the directory src to dst (like copy_tree with preserve_symlinks)
+    with workers threads. Return a dict with the files copied, linked, skipped and
+    failed, the bytes copied and the seconds
+    """
+    start_time = time.time()
+    files = _scan(src, dst)
+
+    def backup(item):
+        try:
+            return _backup_file(item, hardlink=hardlink, checksum=checksum)
+        except OSError as err:
+            logging.error(" ↳ Problemas copiando {}: {}".format(item[0], err))
+            return "failed", 0
+
+    with ThreadPool(processes=max(int(workers), 1)) as pool:
+        results = pool.map(backup, files, chunksize=1)
+
+    report = {status: sum(r[0] == status for r in results) for status in ("copied", "linked", "skipped", "failed")}
+    report["bytes"] = sum(r[1] for r in results)
+    report["seconds"] = time.time() - start_time
+    return report
+
+
+def log_report(report):
+    """Reporte del backup: archivos, bytes copiados y rendimiento"""
+    logging.info(" ↳ Backup: {copied} copiados, {linked} enlazados, {skipped} sin cambios, {failed} con problemas"
+                 .format(**report))
+    logging.info(" ↳ {:.2f} GB copiados en {:.1f} s ({:.1f} MB/s)".format(
+        report["bytes"] / 1024 ** 3, report["seconds"], report["bytes"] / 1024 ** 2 / max(report["seconds"], 1e-6)))
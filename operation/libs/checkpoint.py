@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Manifests de los pasos terminados de la corrida (modo --resume de main.py)
+#
+# Al terminar sin errores un paso del grafo (ver libs/dag.py) se guarda en
+# <run_dir>/manifests/<paso>.json la lista de sus archivos de salida con tamaño
+# y md5, el hash de sus entradas (ruta, tamaño y fecha de modificacion de los
+# archivos), el hash de la configuracion (settings sin las banderas y las
+# plantillas de los namelist) y el valor de las banderas del paso. En --resume
+# se omiten los pasos cuyo manifest sigue valido: la misma configuracion, las
+# mismas banderas, las mismas entradas y las salidas sin cambios (un paso que
+# corrio con su bandera apagada se ejecuta si ahora esta encendida).
+#
+import hashlib
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+from scripts_op.libs.transfer import md5sum
+
+# bytes del inicio y del final de cada archivo para el md5 rapido
+QUICK_BYTES = 1024 ** 2
+
+
+def file_md5(path, quick=True):
+    """md5 del archivo completo o rapido (inicio y final del archivo)"""
+    size = os.path.getsize(path)
+    if not quick or size <= 2 * QUICK_BYTES:
+        return md5sum(path)
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        md5.update(f.read(QUICK_BYTES))
+        f.seek(size - QUICK_BYTES)
+        md5.update(f.read(QUICK_BYTES))
+    return md5.hexdigest()
+
+
+def tree_files(paths):
+    """Archivos (y enlaces simbolicos) de las rutas, ordenados, sin seguir enlaces"""
+    files = []
+    for path in paths:
+        if os.path.islink(path) or os.path.isfile(path):
+            files.append(path)
+        elif os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names))
+    return sorted(set(files))
+
+
+def inputs_hash(paths):
+    """Hash de las entradas: ruta, tamaño y fecha de modificacion de cada archivo"""
+    md5 = hashlib.md5()
+    for path in tree_files(paths):
+        try:
+            stat = os.stat(path)
+            md5.update("{} {} {}\n".format(path, stat.st_size, stat.st_mtime_ns).encode())
+        except OSError:
+            md5.update("{} missing\n".format(path).encode())
+    return md5.hexdigest()
+
+
+def outputs_list(paths, quick=True):
+    """Archivos de salida con su tamaño y md5 (los enlaces con su destino)"""
+    outputs = {}
+    for path in tree_files(paths):
+        if os.path.islink(path):
+            outputs[path] = {"link": os.readlink(path)}
+        else:
+            outputs[path] = {"size": os.path.getsize(path), "md5": file_md5(path, quick)}
+    return outputs
+
+
+def config_hash(settings, templates_dir):
+    """Hash de la configuracion de la corrida: settings (sin banderas ni objetos)
+    y las plantillas de los namelist"""
+    md5 = hashlib.md5()
+    config = {section: {key: value for key, value in values.items() if isinstance(value, (str, int, float, bool))}
+              for section, values in settings.items() if section != 'flags'}
+    md5.update(json.dumps(config, sort_keys=True).encode())
+    for path in tree_files([templates_dir]):
+        if not path.endswith(".pyc"):
+            md5.update(path.encode())
+            md5.update(file_md5(path, quick=False).encode())
+    return md5.hexdigest()
+
+
+class ErrorCounter(logging.Handler):
+    """Cantidad de mensajes de error (o criticos) registrados"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class Checkpoint:
+    """
+    Manifests de los pasos en manifest_dir, resume para omitir los pasos con
+    manifest valido, quick para el md5 rapido de las salidas y flags las
+    banderas de la corrida (settings['flags'])
+    """
+
+    def __init__(self, manifest_dir, config, resume=False, quick=True, flags=None):
+        self.manifest_dir = manifest_dir
+        self.config = config
+        self.flags = flags or {}
+        self.resume = resume
+        self.quick = quick
+        self.errors = ErrorCounter()
+        self._lock = Lock()
+        self._start = {}
+        os.makedirs(manifest_dir, exist_ok=True)
+        logging.getLogger().addHandler(self.errors)
+
+    def path(self, name):
+        return os.path.join(self.manifest_dir, name + ".json")
+
+    def step_flags(self, step):
+        """Valor de las banderas del paso en esta corrida"""
+        return {flag: bool(self.flags.get(flag, False)) for flag in step.flags}
+
+    def is_valid(self, step):
+        """Razon por la que el manifest del paso no es valido, None si es valido"""
+        try:
+            with open(self.path(step.name)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return "sin manifest"
+        if manifest.get("config") != self.config:
+            return "cambio la configuracion"
+        if manifest.get("flags", {}) != self.step_flags(step):
+            return "cambiaron las banderas"
+        if manifest.get("inputs") != inputs_hash(step.inputs):
+            return "cambiaron las entradas"
+        outputs = manifest.get("outputs", {})
+        if sorted(outputs) != tree_files(step.outputs):
+            return "cambiaron los archivos de salida"
+        for path, info in outputs.items():
+            if "link" in info:
+                if not os.path.islink(path) or os.readlink(path) != info["link"]:
+                    return "cambio " + path
+            elif os.path.getsize(path) != info["size"] or file_md5(path, manifest.get("quick", True)) != info["md5"]:
+                return "cambio " + path
+        return None
+
+    def skip(self, step):
+        """True si el paso se omite (modo resume y manifest valido), si no se borra
+        el manifest anterior y se inicia el conteo de errores del paso"""
+        if not step.outputs:
+            return False
+        if self.resume:
+            reason = self.is_valid(step)
+            if reason is None:
+                logging.info("Paso {} completo segun su manifest, se omite (--resume)".format(step.name))
+                return True
+            logging.info("Paso {} se ejecuta de nuevo: {}".format(step.name, reason))
+        if os.path.isfile(self.path(step.name)):
+            os.remove(self.path(step.name))
+        with self._lock:
+            self._start[step.name] = self.errors.count
+        return False
+
+    def complete(self, step):
+        """Guardar el manifest del paso terminado, no se guarda si hubo errores
+        mientras corria (de cualquier paso)"""
+        if not step.outputs:
+            return
+        with self._lock:
+            if self.errors.count != self._start.pop(step.name, self.errors.count):
+                logging.warning("Paso {} con errores, no se guarda su manifest".format(step.name))
+                return
+        manifest = {"step": step.name, "time": time.strftime("%Y-%m-%d %H:%M:%S"), "config": self.config,
+                    "flags": self.step_flags(step), "inputs": inputs_hash(step.inputs), "quick": self.quick,
+                    "outputs": outputs_list(step.outputs, self.quick)}
+        tmp_path = self.path(step.name) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, self.path(step.name))
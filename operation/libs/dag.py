@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Ejecucion de los pasos de la corrida como un grafo de dependencias
+#
+# Cada paso declara sus entradas y salidas (rutas), un paso depende de los
+# pasos declarados antes que producen alguna de sus entradas (la misma ruta o
+# una ruta padre/hija) y de los pasos en after. Los pasos cuyas dependencias
+# terminaron se ejecutan con un pool de hilos de workers; con un solo worker
+# se ejecutan en el hilo principal en el orden en que se declararon. Al final se
+# reporta la ruta critica (la cadena de dependencias mas larga en tiempo). Con
+# checkpoint (ver libs/checkpoint.py) se guarda el manifest de cada paso
+# terminado (con el valor de las banderas del paso, flags) y en modo resume se
+# omiten los pasos con manifest valido.
+#
+import logging
+import os
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+Step = namedtuple("Step", ["name", "function", "inputs", "outputs", "after", "flags"])
+
+
+def _related(path_a, path_b):
+    """True si las rutas son la misma o una contiene a la otra"""
+    path_a = os.path.normpath(path_a)
+    path_b = os.path.normpath(path_b)
+    return path_a == path_b or path_a.startswith(path_b + os.sep) or path_b.startswith(path_a + os.sep)
+
+
+class Graph:
+    """Grafo de pasos de la corrida, ver el encabezado del modulo"""
+
+    def __init__(self, checkpoint=None):
+        self.steps = OrderedDict()
+        self.times = {}
+        self.skipped = []
+        self.checkpoint = checkpoint
+
+    def add(self, name, function, inputs=(), outputs=(), after=(), flags=()):
+        """Agregar el paso name que ejecuta function(), flags son las banderas de
+        settings que deciden lo que hace el paso"""
+        self.steps[name] = Step(name, function, tuple(inputs), tuple(outputs), tuple(after), tuple(flags))
+
+    def dependencies(self, name):
+        """Pasos de los que depende name: los de after y los anteriores que producen sus entradas"""
+        step = self.steps[name]
+        deps = list(step.after)
+        for other in self.steps.values():
+            if other.name == name:
+                break
+            if other.name not in deps and any(_related(i, o) for i in step.inputs for o in other.outputs):
+                deps.append(other.name)
+        return deps
+
+    def run(self, workers=1):
+        """Ejecutar todos los pasos, si un paso falla no se inician mas pasos, se
+        esperan los que estan corriendo y se propaga el error"""
+        if max(int(workers), 1) == 1:
+            return self._run_serial()
+
+        deps = {name: set(self.dependencies(name)) for name in self.steps}
+        pending = list(self.steps)
+        running = {}
+        done = set()
+        error = None
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+            while pending or running:
+                # iniciar los pasos listos en el orden declarado
+                if error is None:
+                    for name in [n for n in pending if deps[n] <= done]:
+                        if len(running) >= max(int(workers), 1):
+                            break
+                        pending.remove(name)
+                        running[executor.submit(self._run_step, name)] = name
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        logging.error("Problemas en el paso {}: {}".format(name, future.exception()))
+                        error = error or future.exception()
+                    else:
+                        done.add(name)
+
+        self.log_report(time.time() - start_time)
+        if error is not None:
+            raise error
+
+    def _run_serial(self):
+        """Ejecutar los pasos en el orden declarado en el hilo principal"""
+        start_time = time.time()
+        for name in self.steps:
+            try:
+                self._run_step(name)
+            except Exception as error:
+                logging.error("Problemas en el paso {}: {}".format(name, error))
+                self.log_report(time.time() - start_time)
+                raise
+        self.log_report(time.time() - start_time)
+
+    def _run_step(self, name):
+        if self.checkpoint is not None and self.checkpoint.skip(self.steps[name]):
+            self.skipped.append(name)
+            return
+        start_time = time.time()
+        try:
+            self.steps[name].function()
+        finally:
+            self.times[name] = (start_time, time.time())
+        if self.checkpoint is not None:
+            self.checkpoint.complete(self.steps[name])
+
+    def critical_path(self):
+        """Cadena de pasos (ejecutados) con la mayor suma de duraciones y su duracion"""
+        longest = {}
+        for name in self.steps:
+            if name not in self.times:
+                continue
+            duration = self.times[name][1] - self.times[name][0]
+            prev = max((longest[d] for d in self.dependencies(name) if d in longest),
+                       key=lambda path: path[1], default=([], 0.0))
+            longest[name] = (prev[0] + [name], prev[1] + duration)
+        return max(longest.values(), key=lambda path: path[1], default=([], 0.0))
+
+    def log_report(self, total_time):
+        """Tiempos por paso y ruta critica"""
+        logging.info("Tiempos de los pasos de la corrida:")
+        for name in self.steps:
+            if name in self.times:
+                logging.info(" ↳ {}: {:.1f} min".format(name, (self.times[name][1] - self.times[name][0]) / 60))
+        if self.skipped:
+            logging.info(" ↳ omitidos (--resume): {}".format(", ".join(self.skipped)))
+        path, duration = self.critical_path()
+        serial = sum(end - start for start, end in self.times.values())
+        logging.info("Ruta critica: {} ({:.1f} min)".format(" > ".join(path), duration / 60))
+        logging.info("Tiempo total: {:.1f} min, {:.1f} min en serie".format(total_time / 60, serial / 60))
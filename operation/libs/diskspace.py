@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Planificador para liberar espacio en disco (ver free_spaces_* en utils.py)
+#
+# Se revisan una sola vez los directorios de corridas (nombre YYYYmmdd-HH) con
+# su tamaño (du con scandir), y se escogen las corridas mas antiguas necesarias
+# para llegar al espacio libre pedido (sin las que no liberan espacio en el disco
+# ni las protegidas, como la corrida actual). Luego se eliminan o mueven en
+# paralelo.
+#
+import logging
+import os
+import shutil
+import stat
+from collections import namedtuple
+from datetime import datetime
+from itertools import groupby
+from multiprocessing.pool import ThreadPool
+
+GB = 1024 ** 3
+
+# corrida (o archivo) con fecha en el nombre y su tamaño en disco (bytes)
+Run = namedtuple("Run", ["date", "kind", "path", "size"])
+
+
+def du(path):
+    """Espacio en disco (bytes) usado por path, recorrido con scandir sin seguir enlaces"""
+    try:
+        st = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return 0
+    total = st.st_blocks * 512
+    if not stat.S_ISDIR(st.st_mode):
+        return total
+
+    dirs = [path]
+    while dirs:
+        try:
+            with os.scandir(dirs.pop()) as entries:
+                for entry in entries:
+                    try:
+                        total += entry.stat(follow_symlinks=False).st_blocks * 512
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def scan_runs(base_dir, kinds=("",), only_dirs=True, workers=4):
+    """
+    Indice de las corridas base_dir/<kind>/<YYYYmmdd-HH> con su tamaño, de la
+    mas antigua a la mas nueva (kind "" para las corridas en base_dir)
+    """
+    found = []
+    for kind in kinds:
+        try:
+            with os.scandir(os.path.join(base_dir, kind)) as entries:
+                for entry in entries:
+                    if only_dirs and not entry.is_dir(follow_symlinks=False):
+                        continue
+                    try:
+                        found.append((datetime.strptime(entry.name, "%Y%m%d-%H"), kind, entry.path))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+    with ThreadPool(processes=max(int(workers), 1)) as pool:
+        sizes = pool.map(du, [path for date, kind, path in found])
+
+    return sorted(Run(date, kind, path, size) for (date, kind, path), size in zip(found, sizes))
+
+
+def plan(runs, free, target, frees=None, keep=(), partial=False):
+    """
+    Corridas a liberar (las mas antiguas primero, todas las de una misma fecha
+    juntas) para tener target bytes libres, y los bytes que se liberan. frees(run)
+    indica si la corrida libera espacio en este disco (default: todas), las que no
+    liberan y las de keep (rutas) nunca se escogen. Si con todas las corridas no se
+    llega a target no se escoge ninguna, salvo con partial
+    """
+    keep = set(os.path.normpath(path) for path in keep)
+    candidates = [run for run in runs
+                  if os.path.normpath(run.path) not in keep and (frees is None or frees(run))]
+    selected = []
+    freed = 0
+    for date, group in groupby(candidates, key=lambda run: run.date):
+        if free + freed >= target:
+            break
+        for run in group:
+            selected.append(run)
+            freed += run.size
+    if free + freed < target and not partial:
+        return [], 0
+    return selected, freed
+
+
+def remove(path):
+    """Eliminar el directorio o archivo"""
+    logging.info("Eliminando: " + path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def move(path, dest_dir):
+    """Mover el directorio a dest_dir, reemplazando el que exista con el mismo nombre"""
+    logging.info("Moviendo: " + path)
+    target = os.path.join(dest_dir, os.path.basename(path.rstrip("/")))
+    if os.path.lexists(target):
+        remove(target)
+    os.makedirs(dest_dir, exist_ok=True)
+    shutil.move(path, dest_dir)
+
+
+def run_parallel(function, args_list, workers=4):
+    """Ejecutar function(*args) con workers hilos, los errores se reportan y continua"""
+    def call(args):
+        try:
+            function(*args)
+        except Exception as err:
+            logging.error(" ↳ Problemas liberando espacio en {}: {}".format(args[0], err))
+
+    if args_list:
+        with ThreadPool(processes=max(1, min(int(workers), len(args_list)))) as pool:
+            pool.map(call, args_list, chunksize=1)
+
+
+def log_plan(disk, free, target, selected, freed):
+    """Reporte del plan de un disco"""
+    logging.info("{}: {:.1f} GB libres de {:.1f} GB minimo, se liberan {:.1f} GB con {} corrida(s)".format(
+        disk, free / GB, target / GB, freed / GB, len(selected)))
+    if free + freed < target and selected:
+        logging.warning(" ↳ No hay mas corridas para liberar, no se alcanza el minimo de espacio libre")
+    elif free + freed < target:
+        logging.warning(" ↳ Las corridas que se pueden liberar no alcanzan el minimo de espacio libre, "
+                        "no se libera espacio (ver free_space_partial)")
@@ -14,7 +14,8 @@ import errno
 import os
 import re
 from datetime import date, datetime, timedelta
-from urllib.request import urlopen
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
 
 def checkForFile(pathToFile):
@@ -276,21 +277,82 @@ def create_request_gfs(dateStart, dateEnd, stepList, levelList, grid, extent, pa
         return (URLlist, validChoice, prbParameters)
 
 
-def GFSDownload(pathToFile, pathToOutputFile):
+def checkForGrib2(pathToFile):
+    """
+        Check that the file is a sequence of complete GRIB2 messages: each
+        message starts with 'GRIB', has edition 2 and the total length given
+        in its indicator section, and ends with '7777'.
+    """
+    try:
+        size = os.path.getsize(pathToFile)
+        if size == 0:
+            return False
+        with open(pathToFile, 'rb') as f:
+            offset = 0
+            while offset < size:
+                f.seek(offset)
+                indicator = f.read(16)
+                if len(indicator) < 16 or indicator[0:4] != b'GRIB' or indicator[7] != 2:
+                    return False
+                length = int.from_bytes(indicator[8:16], 'big')
+                if length < 20 or offset + length > size:
+                    return False
+                f.seek(offset + length - 4)
+                if f.read(4) != b'7777':
+                    return False
+                offset += length
+        return True
+    except OSError:
+        return False
+
+
+def GFSDownload(pathToFile, pathToOutputFile, chunkSize=1024*1024, timeout=120):
+    """
+        Download the url pathToFile streaming chunks to pathToOutputFile + '.part',
+        resuming with an HTTP Range request if a partial file exists. The file is
+        renamed to pathToOutputFile only if it contains complete GRIB2 messages.
+    """
+    partFile = pathToOutputFile + '.part'
+    offset = os.path.getsize(partFile) if os.path.isfile(partFile) else 0
+
+    received = 0
+    request = Request(pathToFile)
+    if offset > 0:
+        request.add_header('Range', 'bytes={}-'.format(offset))
 
     try:
-        response = urlopen(pathToFile)
-        html = response.read()
+        with urlopen(request, timeout=timeout) as response:
+            # the server ignored the range request, start from the beginning
+            if offset > 0 and response.status != 206:
+                offset = 0
+            with open(partFile, 'ab' if offset > 0 else 'wb') as f:
+                while True:
+                    chunk = response.read(chunkSize)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+    except HTTPError as err:
+        # the partial file is already complete or was invalid for the range requested
+        if err.code != 416:
+            print("URL problem response while downloading file")
+            print(err)
+            return False
     except Exception as err:
         print("URL problem response while downloading file")
         print(err)
         return False
 
-    if len(html) > 0:
-        f = open(pathToOutputFile, 'wb')
-        f.write(html)
-        f.close()
+    if checkForGrib2(partFile):
+        os.replace(partFile, pathToOutputFile)
         return True
     else:
-        print("Error while downloading file")
+        print("Error while downloading file, incomplete GRIB2 messages")
+        # keep the partial file to resume only if the transfer made progress
+        # and it starts as a GRIB message, otherwise start again next time
+        if os.path.isfile(partFile):
+            with open(partFile, 'rb') as f:
+                header = f.read(4)
+            if received == 0 or header != b'GRIB':
+                os.remove(partFile)
         return False
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Envio de trabajos al planificador (ver slurm_send en utils.py)
+#
+# Los trabajos se envian sin esperar, los que dependen de trabajos anteriores
+# (por nombre) se envian retenidos (hold) con dependencias afterany, asi entran a
+# la cola de Slurm antes de que terminen los anteriores. El estado se consulta por
+# sondeo (poll) y al terminar cada trabajo se ejecuta su funcion de verificacion,
+# que decide si termino bien (no el codigo de salida: varios programas terminan
+# con 1 aunque sus resultados esten bien). Cuando todas sus dependencias terminan
+# bien el trabajo se libera (release), si alguna falla se cancela.
+#
+# Planificadores (SCHEDULERS):
+#   slurm: sbatch, sacct/squeue, scontrol release y scancel
+#   local: ejecuta los scripts con /bin/bash en hilos respetando las
+#          dependencias, como Slurm pero sin cola (y para pruebas)
+#
+import getpass
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+from itertools import count
+from threading import Condition, Event, Lock, Thread
+
+# estados finales de un trabajo (nombres de Slurm)
+FINISHED = ("COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "NODE_FAIL", "OUT_OF_MEMORY",
+            "PREEMPTED", "BOOT_FAIL", "DEADLINE", "UNKNOWN")
+
+# UNKNOWN: el planificador no conoce el trabajo (ni sacct ni squeue) por mas de
+# unknown_timeout segundos, se considera fallido
+
+
+class SlurmScheduler:
+    """Trabajos de Slurm: sbatch con --dependency=afterany, estados con sacct (o squeue)"""
+
+    def submit(self, script, after=(), cwd=None, hold=False):
+        """Enviar el script despues de los trabajos after (ids), retenido si hold (hasta
+        release), retorna el id del trabajo"""
+        command = ["sbatch", "--parsable"]
+        if after:
+            command += ["--dependency=afterany:" + ":".join(after)]
+        if hold:
+            command += ["--hold"]
+        output = subprocess.check_output(command + [script], cwd=cwd, universal_newlines=True)
+        # --parsable: "jobid" o "jobid;cluster"
+        return output.strip().split(";")[0]
+
+    def states(self, job_ids):
+        """Estado y codigo de salida de los trabajos: {id: (estado, codigo)}, los que el
+        planificador no conoce no se incluyen, None si no responde"""
+        states = {}
+        try:
+            output = subprocess.check_output(
+                ["sacct", "-n", "-X", "-P", "-o", "JobID,State,ExitCode", "-j", ",".join(job_ids)],
+                universal_newlines=True, stderr=subprocess.DEVNULL)
+            for line in output.splitlines():
+                job_id, state, exit_code = line.split("|")[:3]
+                # "CANCELLED by 1000" y codigo "2:0" (codigo:señal)
+                states[job_id] = (state.split()[0], int(exit_code.split(":")[0] or 0))
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+
+        # sin contabilidad (o aun sin registrar en sacct): se buscan en squeue, los que
+        # tampoco estan ahi no se conocen (sacct atrasado o registro purgado)
+        missing = [job_id for job_id in job_ids if job_id not in states]
+        if missing:
+            try:
+                output = subprocess.check_output(["squeue", "-h", "-o", "%i %T", "-u", getpass.getuser()],
+                                                 universal_newlines=True, stderr=subprocess.DEVNULL)
+            except (OSError, subprocess.CalledProcessError) as err:
+                # sin respuesta del planificador, se consulta en el siguiente sondeo
+                logging.warning(" ↳ Problemas consultando los trabajos en squeue: {}".format(err))
+                return None
+            queued = dict(line.split()[:2] for line in output.splitlines() if line.strip())
+            for job_id in missing:
+                if job_id in queued:
+                    states[job_id] = (queued[job_id], None)
+        return states
+
+    def release(self, job_ids):
+        subprocess.call(["scontrol", "release"] + list(job_ids))
+
+    def cancel(self, job_ids):
+        subprocess.call(["scancel"] + list(job_ids))
+
+    def accounting(self, job_ids):
+        """Segundos de ejecucion y nodos de los trabajos: {id: (segundos, nodos)}"""
+        accounting = {}
+        try:
+            output = subprocess.check_output(
+                ["sacct", "-n", "-X", "-P", "-o", "JobID,ElapsedRaw,NodeList", "-j", ",".join(job_ids)],
+                universal_newlines=True, stderr=subprocess.DEVNULL)
+            for line in output.splitlines():
+                job_id, elapsed, nodes = line.split("|")[:3]
+                accounting[job_id] = (float(elapsed or 0), nodes)
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+        return accounting
+
+    def sleep(self, seconds):
+        """Esperar hasta el siguiente sondeo"""
+        time.sleep(seconds)
+
+
+class LocalScheduler:
+    """Trabajos locales con /bin/bash en hilos, cada uno inicia cuando terminan sus
+    dependencias y se libera (como afterany y --hold de Slurm)"""
+
+    def __init__(self):
+        self._ids = count(1)
+        self._lock = Lock()
+        self._jobs = {}
+        self._changed = Event()
+
+    def submit(self, script, after=(), cwd=None, hold=False):
+        job_id = str(next(self._ids))
+        # copia del script al enviar (como sbatch), el original se puede reescribir
+        fd, copy = tempfile.mkstemp(prefix="job{}-".format(job_id), suffix=".sh")
+        os.close(fd)
+        shutil.copyfile(script, copy)
+        with self._lock:
+            self._jobs[job_id] = {"state": "PENDING", "code": None, "done": Event(), "released": Event(),
+                                  "process": None, "start": None, "end": None}
+            if not hold:
+                self._jobs[job_id]["released"].set()
+        Thread(target=self._run, args=(job_id, copy, tuple(after), cwd), daemon=True).start()
+        return job_id
+
+    def _finish(self, job_id, state, code):
+        with self._lock:
+            self._jobs[job_id].update(state=state, code=code, end=time.time())
+        self._jobs[job_id]["done"].set()
+        self._changed.set()
+
+    def _run(self, job_id, script, after, cwd):
+        try:
+            for dep in after:
+                self._jobs[dep]["done"].wait()
+            self._jobs[job_id]["released"].wait()
+            with self._lock:
+                if self._jobs[job_id]["state"] == "CANCELLED":
+                    return
+                process = subprocess.Popen(["/bin/bash", script], cwd=cwd)
+                self._jobs[job_id].update(state="RUNNING", process=process, start=time.time())
+            code = process.wait()
+            with self._lock:
+                cancelled = self._jobs[job_id]["state"] == "CANCELLED"
+            if not cancelled:
+                self._finish(job_id, "COMPLETED" if code == 0 else "FAILED", code)
+        finally:
+            os.remove(script)
+
+    def states(self, job_ids):
+        with self._lock:
+            return {job_id: (self._jobs[job_id]["state"], self._jobs[job_id]["code"]) for job_id in job_ids}
+
+    def release(self, job_ids):
+        for job_id in job_ids:
+            self._jobs[job_id]["released"].set()
+
+    def cancel(self, job_ids):
+        for job_id in job_ids:
+            with self._lock:
+                job = self._jobs[job_id]
+                if job["state"] in FINISHED:
+                    continue
+                if job["process"] is not None:
+                    job["process"].terminate()
+            self._finish(job_id, "CANCELLED", None)
+            job["released"].set()
+
+    def accounting(self, job_ids):
+        with self._lock:
+            return {job_id: (self._jobs[job_id]["end"] - self._jobs[job_id]["start"], "local")
+                    for job_id in job_ids if self._jobs[job_id]["start"] and self._jobs[job_id]["end"]}
+
+    def sleep(self, seconds):
+        """Esperar hasta el siguiente sondeo o hasta que termine algun trabajo"""
+        self._changed.wait(seconds)
+        self._changed.clear()
+
+
+SCHEDULERS = {"slurm": SlurmScheduler, "local": LocalScheduler}
+
+
+def _return_code(state, code):
+    """Codigo de salida del trabajo terminado: el del script, 1 si fallo sin codigo y -1
+    si no termino por si mismo (cancelado, tiempo limite, nodo caido, desconocido...)"""
+    if state == "COMPLETED":
+        return code or 0
+    if state == "FAILED":
+        return code or 1
+    return -1
+
+
+class Job:
+    """Trabajo enviado: nombre, id en el planificador, dependencias (nombres) y verificacion"""
+
+    def __init__(self, name, job_id, after, check, held=False):
+        self.name = name
+        self.id = job_id
+        self.after = after
+        self.check = check
+        self.held = held
+        self.state = "PENDING"
+        self.return_code = None
+        # resultado de la verificacion: None hasta verificar, True si termino bien
+        self.ok = None
+        self.submit_time = time.time()
+        self.end_time = None
+        self.unknown_since = None
+
+    @property
+    def finished(self):
+        return self.state in FINISHED
+
+    @property
+    def verified(self):
+        return self.finished and self.ok is not None
+
+
+class Jobs:
+    """
+    Trabajos de la corrida con el planificador scheduler, el estado se consulta
+    cada poll segundos mientras se espera un trabajo. Un trabajo que el planificador
+    no conoce por unknown_timeout segundos se considera fallido.
+
+        jobs = Jobs(SlurmScheduler(), poll=30)
+        jobs.submit("real", "Realm_run.sh", check=check_real)
+        jobs.submit("wrf_obsproc", "Obsproc_run.sh")
+        jobs.submit("wrfda_3dvar_d01", "Da_wrfvar.sh", after=("real", "wrf_obsproc"))
+        jobs.wait("wrfda_3dvar_d01")
+    """
+
+    def __init__(self, scheduler, poll=30, cwd=None, unknown_timeout=600):
+        self.scheduler = scheduler
+        self.poll = poll
+        self.cwd = cwd
+        self.unknown_timeout = unknown_timeout
+        self.jobs = OrderedDict()
+        self._lock = Lock()
+        # se notifica al terminar cada verificacion
+        self._verified = Condition(self._lock)
+
+    def submit(self, name, script, after=(), check=None):
+        """
+        Enviar el script como el trabajo name despues de los trabajos after (nombres,
+        los que no se enviaron o ya terminaron bien se ignoran), check(codigo) se llama
+        al terminar y retorna True si el trabajo termino bien (sin check: codigo 0).
+        Si alguno de los trabajos after fallo no se envia y queda cancelado
+        """
+        with self._lock:
+            after = tuple(n for n in after if n in self.jobs and not self.jobs[n].ok)
+            failed = [n for n in after if self.jobs[n].ok is False]
+            if failed:
+                job = Job(name, None, after, check)
+                job.state, job.return_code, job.end_time = "CANCELLED", -1, time.time()
+            else:
+                # retenido hasta que sus dependencias terminen bien (ver _release)
+                job_id = self.scheduler.submit(script, [self.jobs[n].id for n in after], cwd=self.cwd,
+                                               hold=bool(after))
+                job = Job(name, job_id, after, check, held=bool(after))
+            self.jobs[name] = job
+        if failed:
+            logging.error(" ↳ Trabajo {} no enviado, fallaron los trabajos de los que depende: {}".format(
+                name, ", ".join(failed)))
+            self._verify([job])
+            return None
+        logging.info(" ↳ Trabajo {} enviado con id {}{}".format(
+            name, job.id, " (despues de: {})".format(", ".join(after)) if after else ""))
+        return job.id
+
+    def _dependents(self, name):
+        """Trabajos que dependen (directa o indirectamente) del trabajo name"""
+        found = []
+        for job in self.jobs.values():
+            if any(n == name or n in found for n in job.after):
+                found.append(job.name)
+        return found
+
+    def _release(self):
+        """Liberar los trabajos retenidos cuyas dependencias terminaron bien (con el lock)"""
+        ready = [job for job in self.jobs.values()
+                 if job.held and not job.finished and all(self.jobs[n].ok for n in job.after)]
+        for job in ready:
+            job.held = False
+        if ready:
+            logging.info(" ↳ Liberando los trabajos: {}".format(", ".join(job.name for job in ready)))
+            self.scheduler.release([job.id for job in ready])
+
+    def _verify(self, finished):
+        """Ejecutar la verificacion de los trabajos terminados (sin el lock, puede tardar),
+        los que fallan cancelan sus dependientes y los que terminan bien liberan los suyos"""
+        error = None
+        for job in finished:
+            ok = False
+            try:
+                ok = bool(job.check(job.return_code)) if job.check is not None else job.return_code == 0
+            except BaseException as err:
+                # p.ej. el error critico de la verificacion, se relanza al verificar todos
+                error = error or err
+            finally:
+                with self._lock:
+                    job.ok = ok
+                    if not ok:
+                        dependents = [self.jobs[n] for n in self._dependents(job.name)
+                                      if not self.jobs[n].finished]
+                        if dependents:
+                            logging.error(" ↳ Cancelando los trabajos que dependen de {}: {}".format(
+                                job.name, ", ".join(d.name for d in dependents)))
+                            self.scheduler.cancel([d.id for d in dependents])
+                    self._release()
+                    self._verified.notify_all()
+        if error is not None:
+            raise error
+
+    def update(self):
+        """Consultar los trabajos activos y verificar los que terminaron"""
+        with self._lock:
+            active = [job for job in self.jobs.values() if not job.finished]
+            if not active:
+                return
+            states = self.scheduler.states([job.id for job in active])
+            if states is None:
+                return
+            now = time.time()
+            finished = []
+            for job in active:
+                if job.id in states:
+                    job.state, return_code = states[job.id]
+                    job.unknown_since = None
+                else:
+                    # el planificador no lo conoce: se sigue consultando hasta unknown_timeout
+                    job.unknown_since = job.unknown_since or now
+                    if now - job.unknown_since < self.unknown_timeout:
+                        continue
+                    logging.error(" ↳ El planificador no conoce el trabajo {} ({}) hace {:.1f} min".format(
+                        job.name, job.id, (now - job.unknown_since) / 60))
+                    job.state, return_code = "UNKNOWN", None
+                if job.finished:
+                    job.return_code = _return_code(job.state, return_code)
+                    job.end_time = now
+                    finished.append(job)
+
+            for job in finished:
+                logging.info(" ↳ Trabajo {} ({}) terminado: {}, codigo {} ({:.1f} min desde el envio)".format(
+                    job.name, job.id, job.state, job.return_code, (job.end_time - job.submit_time) / 60))
+        self._verify(finished)
+
+    def succeeded(self, name):
+        """True si el trabajo name termino y su verificacion fue correcta"""
+        return name in self.jobs and bool(self.jobs[name].ok)
+
+    def log_report(self, *names):
+        """Tiempo de ejecucion, espera en cola y nodos de los trabajos terminados"""
+        jobs = [self.jobs[n] for n in names if n in self.jobs and self.jobs[n].finished and self.jobs[n].id]
+        accounting = self.scheduler.accounting([job.id for job in jobs]) if jobs else {}
+        for job in jobs:
+            total = job.end_time - job.submit_time
+            elapsed, nodes = accounting.get(job.id, (total, "?"))
+            logging.info(" ↳ {}: {:.1f} min de ejecucion ({:.1f} min en cola) en los nodos {}".format(
+                job.name, elapsed / 60, max(total - elapsed, 0) / 60, nodes))
+
+    def wait(self, *names):
+        """Esperar a que terminen y se verifiquen los trabajos (todos si no se dan nombres),
+        retorna el codigo de salida del ultimo"""
+        names = [n for n in (names or list(self.jobs)) if n in self.jobs]
+        while True:
+            self.update()
+            with self._lock:
+                if all(self.jobs[n].verified for n in names):
+                    return self.jobs[names[-1]].return_code if names else None
+                if all(self.jobs[n].finished for n in names):
+                    # la verificacion la hace otro hilo
+                    self._verified.wait(self.poll)
+                    continue
+            self.scheduler.sleep(self.poll)
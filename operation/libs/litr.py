@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Escritor de observaciones en formato little_r para los convertidores de p2
+#
+# Especificacion del formato:
+# http://www2.mmm.ucar.edu/wrf/users/wrfda/OnlineTutorial/Help/littler.html
+#
+# Cada registro little_r tiene una linea de encabezado, una linea por nivel,
+# una linea de fin con la cantidad de niveles y una linea con la cantidad de
+# campos validos. Los valores se reciben por columnas (listas o arreglos de
+# NumPy) y se formatean por columna con np.char, el texto de todo el archivo
+# se arma en memoria y se escribe de una vez.
+#
+import os
+
+import numpy as np
+
+# valor de los campos faltantes
+MISSING = -888888.0
+
+# campos con valor y QC del encabezado (despues de la fecha), en orden
+HEADER_FIELDS = ("slp", "ref_press", "ground_temp", "sst", "sfc_press", "precip", "daily_max_t",
+                 "daily_min_t", "night_min_t", "press_3hr", "press_24hr", "cloud_cover", "ceiling")
+
+# campos con valor y QC de cada nivel, en orden
+DATA_FIELDS = ("press", "height", "temp", "dewpt", "speed", "dir", "u", "v", "rh", "thickness")
+
+
+def _cat(*columns):
+    """Concatenar columnas de texto (arreglos o str que se repiten en todas las filas)"""
+    text = columns[0]
+    for column in columns[1:]:
+        text = np.char.add(text, column)
+    return text
+
+
+def _float_column(table, key, width, size):
+    """Columna de valores con 5 decimales y el QC (0), MISSING si la columna no existe"""
+    if key not in table:
+        return format(MISSING, '.5f').rjust(width) + str(0).rjust(7)
+    values = np.broadcast_to(np.asarray(table[key], dtype=float), (size,))
+    return np.char.add(np.char.mod("%{}.5f".format(width), values), str(0).rjust(7))
+
+
+def _str_column(table, key, width, size, default="", ljust=False, truncate=False):
+    """Columna de texto justificada al ancho (y recortada si truncate)"""
+    values = np.broadcast_to(np.asarray(table.get(key, default)).astype(str), (size,))
+    if truncate:
+        values = values.astype("U{}".format(width))
+    return np.char.ljust(values, width) if ljust else np.char.rjust(values, width)
+
+
+def _size(table):
+    """Cantidad de filas de las columnas de la tabla"""
+    sizes = [np.size(value) for value in table.values() if np.ndim(value)]
+    return max(sizes) if sizes else 1
+
+
+def format_header(header):
+    """
+    Lineas de encabezado (sin salto de linea) de los registros, header es un dict
+    con una columna (o un valor para todos) por campo:
+
+        lat, lon, id, name (se recorta a 40), platform, elevation, valid_fields,
+        date (YYYYmmddHHMMSS), source (""), sequence ("0"), is_sounding ("F") y
+        los campos opcionales de HEADER_FIELDS (MISSING si no estan)
+    """
+    size = _size(header)
+
+    lat = np.broadcast_to(np.asarray(header["lat"], dtype=float), (size,))
+    lon = np.broadcast_to(np.asarray(header["lon"], dtype=float), (size,))
+    elevation = np.broadcast_to(np.asarray(header["elevation"], dtype=float), (size,))
+    valid_fields = np.broadcast_to(np.asarray(header["valid_fields"], dtype=int), (size,))
+
+    return _cat(
+        # lat, lon
+        np.char.mod("%20.5f", lat), np.char.mod("%20.5f", lon),
+        # ID, name, platform, source
+        _str_column(header, "id", 40, size),
+        _str_column(header, "name", 40, size, truncate=True),
+        _str_column(header, "platform", 40, size, ljust=True),
+        _str_column(header, "source", 40, size),
+        # elevation, valid fields
+        np.char.mod("%20.5f", elevation), np.char.mod("%10d", valid_fields),
+        # errors, warnings
+        str(-888888).rjust(10) * 2,
+        # sequence number
+        _str_column(header, "sequence", 10, size, default="0"),
+        # num. duplicates
+        str(-888888).rjust(10),
+        # is sounding?
+        _str_column(header, "is_sounding", 10, size, default="F"),
+        # is bogus?, discard?
+        str("F").rjust(10) * 2,
+        # unix time, julian day
+        str(-888888).rjust(10) * 2,
+        # date
+        _str_column(header, "date", 20, size),
+        # slp, ref pressure, ground temp, SST, SFC pressure, precip, daily max T, daily min T,
+        # night min T, 3hr pres change, 24hr pres change, cloud cover, ceiling (and QC)
+        *[_float_column(header, key, 13, size) for key in HEADER_FIELDS])
+
+
+def format_data(data):
+    """
+    Lineas de datos (sin salto de linea), una por nivel, data es un dict con una
+    columna por campo de DATA_FIELDS (MISSING si no esta)
+    """
+    size = _size(data)
+    return _cat(*[_float_column(data, key, 13, size) for key in DATA_FIELDS])
+
+
+def format_end(levels, valid_fields):
+    """Lineas de fin de registro y de campos validos (dos lineas por registro)"""
+    levels = np.atleast_1d(np.asarray(levels, dtype=float))
+    valid_fields = np.atleast_1d(np.asarray(valid_fields, dtype=int))
+
+    return _cat("-777777.00000      0" * 2, np.char.mod("%13.5f", levels),
+                str(0).rjust(7) + "-888888.00000      0" * 7 + "\n",
+                np.char.mod("%7d", valid_fields), "      0      0")
+
+
+def format_records(header, data, levels=None, end_levels=None, end_valid_fields=None):
+    """
+    Texto little_r de todos los registros.
+
+    header: columnas del encabezado, una fila por registro (ver format_header)
+    data: columnas de los niveles de todos los registros, en el orden de los registros
+    levels: cantidad de niveles de cada registro (default: un nivel por registro)
+    end_levels: niveles reportados en la linea de fin (default: levels)
+    end_valid_fields: campos validos de la ultima linea (default: los del encabezado)
+    """
+    headers = format_header(header)
+    lines = format_data(data) if data else np.array([], dtype=str)
+    n_records = len(headers)
+
+    if levels is None:
+        levels = np.ones(n_records, dtype=int)
+    levels = np.broadcast_to(np.asarray(levels, dtype=int), (n_records,))
+    if end_levels is None:
+        end_levels = levels
+    if end_valid_fields is None:
+        end_valid_fields = header["valid_fields"]
+    ends = format_end(np.broadcast_to(end_levels, (n_records,)),
+                      np.broadcast_to(end_valid_fields, (n_records,)))
+
+    # un nivel por registro: todo el texto por columnas
+    if len(lines) == n_records and np.all(levels == 1):
+        return "".join(_cat(headers, "\n", lines, "\n", ends, "\n").tolist())
+
+    lines = lines.tolist()
+    text = []
+    start = 0
+    for header_line, n_levels, end_lines in zip(headers.tolist(), levels.tolist(), ends.tolist()):
+        text.append(header_line)
+        text.extend(lines[start:start + n_levels])
+        text.append(end_lines)
+        start += n_levels
+    return "\n".join(text) + "\n" if text else ""
+
+
+def write_file(litR_file_path, text):
+    """Escribir el archivo little_r de una vez (reemplaza el archivo anterior),
+    text es el texto o una lista de textos que se unen"""
+    if not os.path.isdir(os.path.dirname(litR_file_path)):
+        os.makedirs(os.path.dirname(litR_file_path))
+    if os.path.isfile(litR_file_path):
+        os.remove(litR_file_path)
+
+    if not isinstance(text, str):
+        text = "".join(text)
+
+    with open(litR_file_path, "w") as litR_file:
+        litR_file.write(text)
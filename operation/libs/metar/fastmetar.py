@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+#
+#  Fast path decoder for the METAR fields converted to little_r (metar2litR)
+#
+#  The report is classified group by group in a single pass using the same
+#  compiled patterns, in the same order, as the handlers of metar.Metar, but
+#  matching at the current position of the code (no re-slicing and no
+#  re-substitution of the remarks), with the current time taken once per batch
+#  and the datatypes objects built only when the attribute is read.
+#
+#  Only the attributes used by metar2litR are decoded:
+#     code, station_id, time, wind_dir, wind_speed, temp, dewpt, press,
+#     press_sea_level
+#
+#  Reports that the fast path can not reproduce exactly (unparsed main-body
+#  groups, groups whose handler would fail, peak wind or wind shift remarks)
+#  are decoded with the full metar.Metar parser.
+#
+#  Differential check of both parsers over METAR files:
+#     python3 -m scripts_op.libs.metar.fastmetar data/metar/metar*
+#
+from __future__ import print_function
+
+import datetime
+import re
+import sys
+import time
+
+from .datatypes import direction, pressure, speed, temperature
+from .metar import Metar, MISSING_RE
+
+
+class _Fallback(Exception):
+    """The report must be decoded with metar.Metar"""
+    pass
+
+
+class _Scratch(object):
+    """Throwaway object to run a metar.Metar handler only to validate a group"""
+    vis = None
+
+
+def _at_position(pattern):
+    """Same pattern but anchored at the position given to match() instead of
+    the beginning of the string"""
+    source = pattern.pattern
+    if source.startswith("^"):
+        source = source[1:]
+    return re.compile(source, pattern.flags)
+
+
+class FastMetar(object):
+    """
+    Decoded METAR report with the attributes of metar.Metar used by metar2litR.
+
+    The datatypes attributes (wind_dir, wind_speed, temp, dewpt, press and
+    press_sea_level) are built the first time they are read, None if the
+    report does not have the group.
+    """
+
+    _lazy_attributes = ("wind_dir", "wind_speed", "temp", "dewpt", "press", "press_sea_level")
+
+    def __init__(self, code, now):
+        self.code = code
+        self.station_id = None
+        self.time = None
+        self._now = now
+        self._trend = False
+        # datatypes class and arguments of each decoded attribute
+        self._args = {}
+
+    def __getattr__(self, name):
+        # only called when the attribute has not been built yet
+        if name not in FastMetar._lazy_attributes:
+            raise AttributeError(name)
+        args = self._args.get(name)
+        value = args[0](*args[1:]) if args else None
+        setattr(self, name, value)
+        return value
+
+    def _handleStation(self, d):
+        self.station_id = d['station']
+
+    def _handleTime(self, d):
+        now = self._now
+        day = int(d['day'])
+        month = now.month
+        if day > now.day:
+            if month == 1:
+                month = 12
+            else:
+                month = month - 1
+        year = now.year
+        if month > now.month:
+            year = year - 1
+        elif month == now.month and day > now.day:
+            year = year - 1
+        try:
+            self.time = datetime.datetime(year, month, day, int(d['hour']), int(d['min']))
+        except ValueError:
+            raise _Fallback
+
+    def _handleWind(self, d):
+        wind_dir = d['dir'].replace('O', '0')
+        if wind_dir != "VRB" and wind_dir != "///" and wind_dir != "MMM":
+            if float(wind_dir) > 360.0:
+                raise _Fallback
+            self._args['wind_dir'] = (direction, wind_dir)
+
+        wind_speed = d['speed'].replace('O', '0')
+        units = d['units']
+        if units == 'KTS' or units == 'K' or units == 'T' or units == 'LT':
+            units = 'KT'
+
+        if wind_speed.startswith("P"):
+            self._args['wind_speed'] = (speed, wind_speed[1:], units, ">")
+        elif not MISSING_RE.match(wind_speed):
+            self._args['wind_speed'] = (speed, wind_speed, units)
+
+        if d['gust'] and d['gust'].startswith("P") and not d['gust'][1:].isdigit():
+            raise _Fallback
+
+        if d['varfrom'] and (float(d['varfrom']) > 360.0 or float(d['varto']) > 360.0):
+            raise _Fallback
+
+    def _handleVisibility(self, d):
+        # only the groups with direction or units can fail
+        if d['dir'] or d['distu']:
+            try:
+                Metar._handleVisibility(_Scratch(), d)
+            except Exception:
+                raise _Fallback
+
+    def _handleTemp(self, d):
+        temp = d['temp']
+        dewpt = d['dewpt']
+        if temp and temp != "//" and temp != "XX" and temp != "MM":
+            self._args['temp'] = (temperature, temp)
+
+        if dewpt and dewpt != "//" and dewpt != "XX" and dewpt != "MM":
+            self._args['dewpt'] = (temperature, dewpt)
+
+    def _handlePressure(self, d):
+        press = d['press']
+        if press != '////':
+            press = float(press.replace('O', '0'))
+
+            if d['unit']:
+                if d['unit'] == 'A' or (d['unit2'] and d['unit2'] == 'INS'):
+                    self._args['press'] = (pressure, press/100, 'IN')
+                elif d['unit'] == 'SLP':
+                    if press < 500:
+                        press = press/10 + 1000
+                    else:
+                        press = press/10 + 900
+                    self._args['press'] = (pressure, press, 'MB')
+                else:
+                    self._args['press'] = (pressure, press, 'MB')
+
+            elif press > 2500:
+                self._args['press'] = (pressure, press/100, 'IN')
+
+            else:
+                self._args['press'] = (pressure, press, 'MB')
+
+    def _handleTrend(self, d):
+        self._trend = True
+
+    def _handleSealvlPressRemark(self, d):
+        value = float(d['press'])/10.0
+        if value < 50:
+            value += 1000
+        else:
+            value += 900
+
+        if 'press' not in self._args:
+            self._args['press'] = (pressure, value, "MB")
+
+        self._args['press_sea_level'] = (pressure, value, "MB")
+
+    def _handleTemp1hrRemark(self, d):
+        value = float(d['temp'])/10.0
+        if d['tsign'] == "1":
+            value = -value
+
+        self._args['temp'] = (temperature, value)
+        if d['dewpt']:
+            value2 = float(d['dewpt'])/10.0
+            if d['dsign'] == "1":
+                value2 = -value2
+
+            self._args['dewpt'] = (temperature, value2)
+
+
+# remark groups left to metar.Metar (their handlers can fail building the time)
+_FALLBACK_REMARKS = ("_handlePeakWindRemark", "_handleWindShiftRemark")
+
+# the handlers of metar.Metar with the FastMetar method of the same name,
+# None for the groups that are not decoded by the fast path
+_HANDLERS = [(_at_position(pattern), getattr(FastMetar, handler.__name__, None), repeatable)
+             for pattern, handler, repeatable in Metar.handlers]
+_TREND_HANDLERS = [(_at_position(pattern), repeatable)
+                   for pattern, handler, repeatable in Metar.trend_handlers]
+_REMARK_HANDLERS = [(_at_position(pattern), getattr(FastMetar, handler.__name__, None),
+                     handler.__name__ in _FALLBACK_REMARKS)
+                    for pattern, handler in Metar.remark_handlers]
+
+
+def _skip_trend(text, pos):
+    """Position after the trend groups (as metar.Metar._do_trend_handlers)"""
+    for pattern, repeatable in _TREND_HANDLERS:
+        m = pattern.match(text, pos)
+        while m:
+            pos = m.end()
+            if not repeatable:
+                break
+            m = pattern.match(text, pos)
+    return pos
+
+
+def decode(code, now=None):
+    """
+    Decode the METAR code with the fast path.
+
+    now is the current UTC time used to complete the month and year of the
+    report (as metar.Metar), pass the same value for all the reports of a
+    batch. Returns a FastMetar, or None if the report must be decoded with
+    metar.Metar.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    obs = FastMetar(code, now)
+    text = code + " "    # (the patterns all expect trailing spaces...)
+    end = len(text)
+    pos = 0
+
+    try:
+        ngroup = len(_HANDLERS)
+        igroup = 0
+        while igroup < ngroup and pos < end:
+            pattern, handler, repeatable = _HANDLERS[igroup]
+            m = pattern.match(text, pos)
+            while m:
+                # the handlers read the groups from the match object
+                # (same names as the groupdict used by metar.Metar)
+                if handler is not None:
+                    handler(obs, m)
+                pos = m.end()
+
+                if obs._trend:
+                    pos = _skip_trend(text, pos)
+
+                if not repeatable:
+                    break
+                m = pattern.match(text, pos)
+
+            igroup += 1
+            if igroup == ngroup and not m:
+                # it's not a main-body group
+                raise _Fallback
+
+        # remark groups (only after the remarks group, the main-body
+        # groups are all parsed at this point)
+        while pos < end:
+            for pattern, handler, fallback in _REMARK_HANDLERS:
+                m = pattern.match(text, pos)
+                if m:
+                    if fallback:
+                        raise _Fallback
+                    if handler is not None:
+                        handler(obs, m)
+                    pos = m.end()
+                    break
+    except _Fallback:
+        return None
+
+    return obs
+
+
+def parse(code, now=None):
+    """
+    Decode the METAR code with the fast path, or with metar.Metar if the fast
+    path can not decode it (raises the same exceptions as metar.Metar).
+    """
+    obs = decode(code, now)
+    if obs is None:
+        obs = Metar(code)
+    return obs
+
+
+def _fields(obs):
+    """Values of the attributes converted by metar2litR"""
+    return {"station_id": obs.station_id,
+            "time": obs.time,
+            "press_sea_level": obs.press_sea_level.value() if obs.press_sea_level else None,
+            "press": obs.press.value("MB") if obs.press else None,
+            "temp": obs.temp.value("K") if obs.temp else None,
+            "dewpt": obs.dewpt.value("K") if obs.dewpt else None,
+            "wind_speed": obs.wind_speed.value("MPS") if obs.wind_speed else None,
+            "wind_dir": obs.wind_dir.value() if obs.wind_dir else None}
+
+
+def compare(code):
+    """
+    Differential check of the fast path against metar.Metar for one report.
+
+    Returns (decoded, differences): decoded is True if the fast path decoded
+    the report, differences is the list of (attribute, fast, full) that are
+    not equal.
+    """
+    obs = decode(code)
+    if obs is None:
+        return False, []
+
+    try:
+        full = Metar(code)
+    except Exception as err:
+        return True, [("error", None, str(err))]
+
+    fast_fields = _fields(obs)
+    full_fields = _fields(full)
+    differences = [(name, fast_fields[name], full_fields[name])
+                   for name in sorted(fast_fields) if fast_fields[name] != full_fields[name]]
+    return True, differences
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python3 -m scripts_op.libs.metar.fastmetar METAR_FILE [METAR_FILE ...]")
+        sys.exit(2)
+
+    codes = []
+    for metar_file in sys.argv[1:]:
+        with open(metar_file) as infile:
+            for line in infile:
+                line = line.strip()
+                if line and line[0].isupper():
+                    codes.append(line.replace("KT(E)", "KT"))
+
+    n_decoded = 0
+    n_differences = 0
+    for code in codes:
+        decoded, differences = compare(code)
+        n_decoded += decoded
+        if differences:
+            n_differences += 1
+            print("DIFF: " + code)
+            for name, fast_value, full_value in differences:
+                print("    {}: fast={} full={}".format(name, fast_value, full_value))
+
+    start = time.time()
+    now = datetime.datetime.utcnow()
+    for code in codes:
+        decode(code, now)
+    fast_time = time.time() - start
+
+    start = time.time()
+    for code in codes:
+        try:
+            Metar(code)
+        except Exception:
+            pass
+    full_time = time.time() - start
+
+    print("reports: {}  fast path: {}  full parser: {}  differences: {}".format(
+        len(codes), n_decoded, len(codes) - n_decoded, n_differences))
+    print("fast path: {:.3f} s  metar.Metar: {:.3f} s".format(fast_time, full_time))
+    sys.exit(1 if n_differences else 0)
@@ -4,8 +4,8 @@
 #
 #  Copyright 2004  Tom Pollard
 
-from pkg_resources import resource_filename
 from .datatypes import position
+from ..stations import get_catalog, NSD_FILE
 
 
 class Station:
@@ -23,16 +23,32 @@ class Station:
       self.name = self.city
 
 
-station_file_name = resource_filename("metar", "nsd_cccc.txt")
-station_file_url = "http://www.noaa.gov/nsd_cccc.txt"
+class StationDict(object):
+  """Stations by ICAO identifier from the shared station catalog (libs/stations.py),
+  the catalog is loaded on first access instead of at import time. A repeated
+  ICAO identifier resolves to its last line in the file, as the original dict."""
+
+  def __getitem__(self, sta_id):
+    info = get_catalog(station_file_name).by_icao(sta_id, last=True)
+    if info is None:
+      raise KeyError(sta_id)
+    f = info.fields
+    return Station(f[0],f[3],f[4],f[5],f[7],f[8])
+
+  def __contains__(self, sta_id):
+    return sta_id in get_catalog(station_file_name)
 
-stations = {}
+  def get(self, sta_id, default=None):
+    try:
+      return self[sta_id]
+    except KeyError:
+      return default
+
+
+station_file_name = NSD_FILE
+station_file_url = "http://www.noaa.gov/nsd_cccc.txt"
 
-fh = open(station_file_name,'r')
-for line in fh:
-  f = line.strip().split(";")
-  stations[f[0]] = Station(f[0],f[3],f[4],f[5],f[7],f[8])
-fh.close()
+stations = StationDict()
 
 if __name__ == "__main__":
   for sta_id in [ 'KEWR', 'KIAD', 'KIWI', 'EKRK' ]:
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Subconjunto de variables de un archivo NetCDF (equivalente a 'ncrcat -O -v')
+#
+# Se copian solo las variables pedidas con sus dimensiones y atributos, y los
+# atributos globales. Los datos se copian por bloques (hiperslabs) de maximo
+# buffer_mb a lo largo de las primeras dimensiones de cada variable, de modo
+# que la memoria usada no depende del tamaño de las variables.
+#
+import os
+import time
+
+import numpy as np
+from netCDF4 import Dataset
+
+# formatos de salida que permiten compresion y chunking
+NETCDF4_FORMATS = ("NETCDF4", "NETCDF4_CLASSIC")
+
+
+def _blocks(shape, itemsize, buffer_bytes):
+    """Hiperslabs (tuplas de slices) que recorren el arreglo de forma shape
+    con bloques de maximo buffer_bytes (o una fila de la ultima dimension)"""
+    if not shape:
+        yield ()
+        return
+
+    # primer eje en el que una posicion (las dimensiones siguientes) cabe en el buffer
+    axis = 0
+    row_bytes = itemsize * int(np.prod(shape[1:]))
+    while row_bytes > buffer_bytes and axis < len(shape) - 1:
+        axis += 1
+        row_bytes //= shape[axis]
+    step = max(1, buffer_bytes // max(row_bytes, 1))
+
+    for index in np.ndindex(*shape[:axis]):
+        for start in range(0, shape[axis], step):
+            yield tuple(slice(i, i + 1) for i in index) + (slice(start, min(start + step, shape[axis])),)
+
+
+def _chunksizes(var_in, chunking, unlimited):
+    """Chunking de la variable de salida segun la opcion:
+    auto (por defecto de la libreria), input (igual a la entrada) o contiguous.
+    Las variables con dimension ilimitada no pueden ser contiguas, en ese caso
+    se usa un chunk por registro (la variable completa de cada tiempo)"""
+    chunks = var_in.chunking() if chunking == "input" else None
+    if chunking == "contiguous" or chunks == "contiguous" or (chunking == "input" and chunks is None):
+        if any(dim in unlimited for dim in var_in.dimensions):
+            return dict(chunksizes=tuple(1 if dim in unlimited else max(size, 1)
+                                         for dim, size in zip(var_in.dimensions, var_in.shape)))
+        return dict(contiguous=True)
+    if chunks:
+        return dict(chunksizes=chunks)
+    return {}
+
+
+def subset(in_file, out_file, variables, complevel=0, shuffle=False, chunking="auto", buffer_mb=256):
+    """
+    Copy the variables (and their dimensions and attributes) of in_file to out_file,
+    like 'ncrcat -O -v'. The data is copied by blocks of maximum buffer_mb.
+
+    complevel: zlib compression level (0 without compression)
+    shuffle: HDF5 shuffle filter (only with compression)
+    chunking: auto, input or contiguous (see _chunksizes)
+
+    Return the seconds, bytes read from the input and size of the output file
+    """
+    start_time = time.time()
+    buffer_bytes = int(float(buffer_mb) * 1024 ** 2)
+    complevel = int(complevel)
+
+    if os.path.isfile(out_file):
+        os.remove(out_file)
+
+    bytes_read = 0
+    with Dataset(in_file, "r") as data_in:
+        # netCDF3 no permite compresion, en ese caso se usa NETCDF4_CLASSIC
+        out_format = data_in.data_model
+        if (complevel or chunking != "auto") and out_format not in NETCDF4_FORMATS:
+            out_format = "NETCDF4_CLASSIC"
+
+        with Dataset(out_file, "w", format=out_format) as data_out:
+            # copia exacta de los valores (sin mascara, escala ni conversion de caracteres)
+            data_in.set_auto_maskandscale(False)
+            data_in.set_auto_chartostring(False)
+            data_out.set_auto_maskandscale(False)
+            data_out.set_auto_chartostring(False)
+
+            # atributos globales
+            data_out.setncatts({k: data_in.getncattr(k) for k in data_in.ncattrs()})
+
+            # dimensiones usadas por las variables (en el orden de la entrada)
+            used_dims = set(dim for var in variables for dim in data_in.variables[var].dimensions)
+            unlimited = set()
+            for name, dim in data_in.dimensions.items():
+                if name in used_dims:
+                    data_out.createDimension(name, None if dim.isunlimited() else dim.size)
+                    if dim.isunlimited():
+                        unlimited.add(name)
+
+            for var in variables:
+                var_in = data_in.variables[var]
+                attrs = {k: var_in.getncattr(k) for k in var_in.ncattrs()}
+                fill_value = attrs.pop("_FillValue", None)
+
+                options = _chunksizes(var_in, chunking, unlimited) if out_format in NETCDF4_FORMATS else {}
+                if complevel and out_format in NETCDF4_FORMATS and not options.get("contiguous"):
+                    options.update(zlib=True, complevel=complevel, shuffle=bool(shuffle))
+
+                var_out = data_out.createVariable(var, var_in.datatype, var_in.dimensions,
+                                                  fill_value=fill_value, **options)
+                var_out.setncatts(attrs)
+
+                # datos por bloques
+                for block in _blocks(var_in.shape, var_in.dtype.itemsize, buffer_bytes):
+                    values = var_in[block]
+                    var_out[block] = values
+                    bytes_read += values.nbytes
+
+    return time.time() - start_time, bytes_read, os.path.getsize(out_file)
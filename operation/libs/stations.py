@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Catalogo de estaciones del archivo NSD de la NOAA (nsd_cccc.txt)
+#
+# El archivo de texto se lee una sola vez y se guarda un indice binario
+# junto al archivo (nsd_cccc.txt.idx) que se reconstruye si el archivo
+# de texto cambia. Permite buscar estaciones por ICAO o por OMM y las
+# estaciones dentro de un area (lat/lon) como el dominio del WRF.
+#
+# Formato de cada linea del archivo NSD (separado por ;):
+#   ICAO;bloque;estacion;nombre;estado;pais;region OMM;lat;lon;lat aire superior;
+#   lon aire superior;elevacion;elevacion aire superior;RBSN
+#
+import logging
+import os
+import pickle
+
+import numpy as np
+
+from scripts_op.libs.utils import dms_parser, dms2dd
+
+NSD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nsd_cccc.txt")
+
+# version del formato del indice binario
+INDEX_VERSION = 1
+
+
+class Station(object):
+    """Estacion del catalogo NSD"""
+    __slots__ = ("icao", "wmo", "name", "state", "country", "lat", "lon", "alt", "fields")
+
+    def __init__(self, fields):
+        # completar las lineas con campos faltantes
+        fields = fields + [""] * (14 - len(fields))
+        self.fields = fields
+        self.icao = fields[0]
+        try:
+            self.wmo = int(fields[1] + fields[2])
+        except ValueError:
+            self.wmo = None
+        self.name = fields[3]
+        self.state = fields[4]
+        self.country = fields[5]
+        self.lat = parse_dms(fields[7])
+        self.lon = parse_dms(fields[8])
+        try:
+            self.alt = float(fields[11])
+        except ValueError:
+            self.alt = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def __repr__(self):
+        return "Station({}, {}, {})".format(self.icao, self.wmo, self.name)
+
+
+def parse_dms(dms_string):
+    """Coordenada NSD (como 04-42N o 081-45-24W) a grados decimales, None si no es valida"""
+    try:
+        return dms2dd(*dms_parser(dms_string))
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class StationCatalog(object):
+    """Catalogo de estaciones con busqueda por ICAO, por OMM y por area"""
+
+    def __init__(self, nsd_file=NSD_FILE):
+        self.nsd_file = nsd_file
+        self.stations = load_stations(nsd_file)
+
+        # indices ICAO y OMM, se conserva la primera estacion de cada codigo
+        # como en la busqueda secuencial sobre el archivo, y la ultima por ICAO
+        # como en el diccionario de libs/metar/station.py
+        self._icao = {}
+        self._icao_last = {}
+        self._wmo = {}
+        for station in self.stations:
+            self._icao.setdefault(station.icao, station)
+            self._icao_last[station.icao] = station
+            if station.wmo is not None:
+                self._wmo.setdefault(station.wmo, station)
+
+        # columnas de coordenadas para la busqueda por area
+        self._lat = np.array([np.nan if s.lat is None else s.lat for s in self.stations], dtype=float)
+        self._lon = np.array([np.nan if s.lon is None else s.lon for s in self.stations], dtype=float)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __contains__(self, icao):
+        return icao in self._icao
+
+    def by_icao(self, icao, last=False):
+        """Estacion con el codigo ICAO (str), None si no existe. Con codigos repetidos
+        retorna la primera, o la ultima con last"""
+        return (self._icao_last if last else self._icao).get(icao)
+
+    def by_wmo(self, wmo):
+        """Estacion con el codigo OMM bloque+estacion (int o str como 80222), None si no existe"""
+        try:
+            return self._wmo.get(int(wmo))
+        except (TypeError, ValueError):
+            return None
+
+    def bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """Estaciones dentro del area lat_min <= lat <= lat_max y lon_min <= lon <= lon_max"""
+        inside = (self._lat >= lat_min) & (self._lat <= lat_max) & (self._lon >= lon_min) & (self._lon <= lon_max)
+        return [self.stations[i] for i in np.flatnonzero(inside)]
+
+
+def load_stations(nsd_file):
+    """Leer las estaciones del indice binario si corresponde al archivo de texto,
+    si no, leer el archivo de texto y guardar el indice"""
+    index_file = nsd_file + ".idx"
+    stat = os.stat(nsd_file)
+    source = (INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+
+    if os.path.isfile(index_file):
+        try:
+            with open(index_file, "rb") as f:
+                index_source, stations = pickle.load(f)
+            if index_source == source:
+                return stations
+        except Exception as err:
+            logging.warning("Indice de estaciones invalido, se reconstruye: " + str(err))
+
+    stations = []
+    with open(nsd_file) as infile:
+        for line in infile:
+            line = line.strip()
+            if line:
+                stations.append(Station(line.split(";")))
+
+    # guardar el indice (si la carpeta no tiene permisos se continua sin indice)
+    try:
+        tmp_file = "{}.{}.tmp".format(index_file, os.getpid())
+        with open(tmp_file, "wb") as f:
+            pickle.dump((source, stations), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, index_file)
+    except OSError as err:
+        logging.warning("No se pudo guardar el indice de estaciones: " + str(err))
+
+    return stations
+
+
+# catalogos ya cargados por archivo
+_catalogs = {}
+
+
+def get_catalog(nsd_file=NSD_FILE):
+    """Catalogo de estaciones del archivo nsd_file, se carga una vez por proceso
+    y se recarga si el archivo de texto cambia"""
+    stat = os.stat(nsd_file)
+    key = os.path.abspath(nsd_file)
+    catalog, source = _catalogs.get(key, (None, None))
+    if catalog is None or source != (stat.st_size, stat.st_mtime_ns):
+        catalog = StationCatalog(nsd_file)
+        _catalogs[key] = (catalog, (stat.st_size, stat.st_mtime_ns))
+    return catalog
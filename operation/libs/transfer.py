@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  (c) Copyright FAC-2016
+#  Authors: Xavier Corredor
+#           Fernando Montana
+#
+#  Estos script y códigos son de uso exclusivo de la
+#  Fuerza Aerea Colombiana (FAC)
+#
+# Copia de archivos a un destino remoto (SSH) o a un directorio local
+#
+# Destino remoto 'usuario@host': todos los comandos ssh y scp comparten una
+# sola conexion SSH multiplexada (ControlMaster), asi solo la primera paga el
+# handshake. Destino local 'local:/ruta': la ruta reemplaza a la raiz '/' de
+# los directorios de destino, para probar sin conexion.
+#
+# Los archivos se encolan (cola acotada, submit se bloquea si esta llena) y se
+# copian con varios hilos (streams). Antes de copiar se compara el md5 con el
+# del destino y si es igual no se copia; la copia se hace a un temporal que
+# solo se renombra al nombre final si el md5 coincide con el local.
+#
+import hashlib
+import logging
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from threading import Lock, Thread
+
+# prefijo de los destinos locales
+LOCAL_PREFIX = "local:"
+
+
+def md5sum(path, block_size=8 * 1024 ** 2):
+    """md5 (hex) del archivo leido por bloques"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class Transfer:
+    """
+    Copia de archivos a target ('usuario@host' o 'local:/ruta') con streams hilos
+    y una cola de maximo queue_size archivos pendientes.
+
+        with Transfer("usuario@host", streams=2) as transfer:
+            transfer.makedirs("/data/run/fcst")
+            transfer.submit("/local/wrfout_d01", "/data/run/fcst")
+            results = transfer.wait()
+
+    Cada resultado es (archivo, estado, segundos, bytes) con estado copied,
+    skipped (igual en el destino) o failed.
+    """
+
+    def __init__(self, target, streams=2, queue_size=8, persist=600):
+        self.target = target
+        self.remote = not target.startswith(LOCAL_PREFIX)
+        self.root = None if self.remote else target[len(LOCAL_PREFIX):]
+        self.results = []
+        self._lock = Lock()
+        self._queue = queue.Queue(maxsize=max(int(queue_size), 1))
+
+        if self.remote:
+            # conexion multiplexada: la primera conexion queda abierta (persist segundos)
+            self._control_dir = tempfile.mkdtemp(prefix="ssh-")
+            self._ssh_options = ["-o", "ControlMaster=auto",
+                                 "-o", "ControlPath=" + os.path.join(self._control_dir, "%r@%h:%p"),
+                                 "-o", "ControlPersist={}".format(int(persist)),
+                                 "-o", "BatchMode=yes"]
+            self.run("true")
+
+        self._threads = [Thread(target=self._worker, name="transfer-{}".format(i), daemon=True)
+                         for i in range(max(int(streams), 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _local_path(self, path):
+        """Ruta en el directorio local del destino"""
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _ssh(self, command):
+        return subprocess.run(["ssh"] + self._ssh_options + [self.target, command],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    def run(self, command):
+        """Ejecutar un comando en el destino remoto (en el local no aplica), retorna el codigo"""
+        if not self.remote:
+            return 0
+        return self._ssh(command).returncode
+
+    def makedirs(self, path):
+        """Crear el directorio (y los padres) en el destino"""
+        if not self.remote:
+            os.makedirs(self._local_path(path), exist_ok=True)
+            return 0
+        return self.run("mkdir -p " + shlex.quote(path))
+
+    def checksum(self, path):
+        """md5 del archivo en el destino, None si no existe"""
+        if not self.remote:
+            local_path = self._local_path(path)
+            return md5sum(local_path) if os.path.isfile(local_path) else None
+        result = self._ssh("test -f {0} && md5sum {0}".format(shlex.quote(path)))
+        return result.stdout.split()[0] if result.returncode == 0 and result.stdout else None
+
+    def _copy(self, local_file, dest_file, md5):
+        """Copiar a un temporal y renombrarlo si el md5 coincide, True si la copia es correcta"""
+        tmp_file = dest_file + ".part"
+        if not self.remote:
+            shutil.copyfile(local_file, self._local_path(tmp_file))
+            if md5sum(self._local_path(tmp_file)) != md5:
+                os.remove(self._local_path(tmp_file))
+                return False
+            os.replace(self._local_path(tmp_file), self._local_path(dest_file))
+            return True
+
+        if subprocess.call(["scp", "-q"] + self._ssh_options + [local_file, self.target + ":" + tmp_file]) != 0:
+            return False
+        check = "test \"$(md5sum < {0} | cut -c1-32)\" = {1} && mv -f {0} {2} || {{ rm -f {0}; false; }}"
+        return self.run(check.format(shlex.quote(tmp_file), md5, shlex.quote(dest_file))) == 0
+
+    def put(self, local_file, dest_dir, attempts=2):
+        """Copiar local_file a dest_dir (sin cola), retorna el resultado"""
+        start_time = time.time()
+        dest_file = os.path.join(dest_dir, os.path.basename(local_file))
+        size = os.path.getsize(local_file)
+        md5 = md5sum(local_file)
+
+        if self.checksum(dest_file) == md5:
+            return local_file, "skipped", time.time() - start_time, size
+
+        for attempt in range(attempts):
+            if self._copy(local_file, dest_file, md5):
+                return local_file, "copied", time.time() - start_time, size
+        return local_file, "failed", time.time() - start_time, size
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                try:
+                    result = self.put(*item)
+                except Exception as err:
+                    logging.error(" ↳ Problemas copiando {}: {}".format(item[0], err))
+                    result = (item[0], "failed", 0.0, 0)
+                self._log(result)
+                with self._lock:
+                    self.results.append(result)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _log(result):
+        local_file, status, seconds, size = result
+        name = os.path.basename(local_file)
+        if status == "copied":
+            logging.info(" ↳ {}: copiado en {:.1f} s ({:.1f} MB/s)".format(
+                name, seconds, size / 1024 ** 2 / max(seconds, 1e-6)))
+        elif status == "skipped":
+            logging.info(" ↳ {}: sin cambios en el destino, no se copia".format(name))
+        else:
+            logging.error(" ↳ {}: problemas con la copia (md5 o conexion)".format(name))
+
+    def submit(self, local_file, dest_dir):
+        """Encolar la copia de local_file a dest_dir, se bloquea si la cola esta llena"""
+        self._queue.put((local_file, dest_dir))
+
+    def wait(self):
+        """Esperar a que terminen las copias encoladas, retorna (y limpia) los resultados"""
+        self._queue.join()
+        with self._lock:
+            results, self.results = self.results, []
+        return results
+
+    def close(self):
+        """Terminar los hilos (despues de las copias pendientes) y la conexion SSH"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.remote:
+            subprocess.call(["ssh"] + self._ssh_options + ["-O", "exit", self.target],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            shutil.rmtree(self._control_dir, ignore_errors=True)
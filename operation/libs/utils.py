@@ -14,12 +14,13 @@ import os
 import shutil
 import signal
 import socket
-import subprocess
 from configparser import ConfigParser
 from datetime import datetime
-from glob import glob
+from threading import Thread
 import re
 
+from scripts_op.libs import diskspace, jobs
+
 
 class SettingsParser(ConfigParser):
     def as_dict(self):
@@ -180,6 +181,49 @@ def check_files(files_path, patterns):
     return False
 
 
+def gfs_manifest_path(settings):
+    """
+    Manifest of the GFS files already downloaded (see p1a_gfs streaming mode)
+    """
+    return os.path.join(settings['globals']['data'], "gfs_manifest.txt")
+
+
+def gfs_manifest_write(manifest, line):
+    """
+    Append a line to the GFS manifest, each line is written complete with a single
+    write so a reader never sees a partial entry:
+        TOTAL <n>           number of files expected
+        <hour> <gfs_path>   forecast hour file downloaded complete
+        END <n>             download finished with n failed files
+    """
+    with open(manifest, "a") as f:
+        f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def gfs_manifest_read(manifest):
+    """
+    Read the GFS manifest, return: (expected files or None, {hour: gfs_path},
+    failed files or None if the download has not finished)
+    """
+    total, files, failed = None, {}, None
+    if not os.path.isfile(manifest):
+        return total, files, failed
+    with open(manifest) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            key, value = line.split(None, 1)
+            if key == "TOTAL":
+                total = int(value)
+            elif key == "END":
+                failed = int(value)
+            else:
+                files[int(key)] = value.strip()
+    return total, files, failed
+
+
 def check_node_up(node_host):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
@@ -192,9 +236,10 @@ def check_node_up(node_host):
     return status
 
 
-def mpiexec(settings, run_in="all"):
+def mpiexec(settings, run_in="all", ppn=None, machinefile="mpd.conf"):
     """
-    Return mpiexec command for run in parallel
+    Return mpiexec command for run in parallel, ppn (default: mpi_ppn) and the
+    machinefile name in the logs dir (one per concurrent run)
 
     :return: mpiexec command
     :rtype: list
@@ -211,17 +256,23 @@ def mpiexec(settings, run_in="all"):
         if check_node_up(node) or node == "master":
             nodes_up.append(node)
     # machinefile
-    machinefile = os.path.join(settings['globals']['run_dir'], "logs", "mpd.conf")
+    machinefile = os.path.join(settings['globals']['run_dir'], "logs", machinefile)
     with open(machinefile, "w+") as mfile:
         [mfile.write(node_up+"\n") for node_up in nodes_up]
 
-    total_process = len(nodes_up) * int(settings['process']['mpi_ppn'])
+    ppn = str(ppn or settings['process']['mpi_ppn']).strip()
+    total_process = len(nodes_up) * int(ppn)
 
     return ["mpiexec.hydra", "-machinefile", machinefile, "-np", str(total_process),
-            "-ppn", settings['process']['mpi_ppn']]
+            "-ppn", ppn]
 
 
-def replace_infile(file_path,settings, domain=None):
+def replace_infile(file_path,settings, domain=None, out_path=None):
+    """
+    Render file_path from file_path.template (simulation date and domain) into
+    out_path (default: file_path)
+    """
+    out_path = out_path or file_path
     current_file=file_path+".template"
     regex=re.compile(r'\$SIMULATION_DATE')
     fecha=settings['globals']['start_date'].strftime("%Y%m%d-%H")
@@ -233,7 +284,7 @@ def replace_infile(file_path,settings, domain=None):
         for line in tfile:
             new_line=regex.sub(fecha, line)
             file_content.append(new_line)
-    with open(file_path,'w') as ofile:
+    with open(out_path,'w') as ofile:
         ofile.writelines(file_content)
     if  domain!=None:
         logging.info("Replacing domain {}".format(domain))
@@ -241,62 +292,76 @@ def replace_infile(file_path,settings, domain=None):
         for line in file_content:
                 new_line=regex2.sub(domain, line)
                 file_content2.append(new_line)
-        with open(file_path,'w') as ofile:
+        with open(out_path,'w') as ofile:
             ofile.writelines(file_content2)
 
     return True
 
 
 
-def slurm_send(settings, type="wrf", domain="01"):
+# scripts de los trabajos de Slurm (settings [globals]) por tipo de trabajo
+SLURM_SCRIPTS = {"metgrid": 'METGRID_SLURM_SCRIPT', "geogrib": 'GEOGRIB_SLURM_SCRIPT', "real": 'REALM_SLURM_SCRIPT',
+                 "wrf": 'WRF_SLURM_SCRIPT', "wrf_obsproc": 'OBSPROC_SLURM_SCRIPT', "wrfda_3dvar": '3DVAR_SLURM_SCRIPT'}
+
+# trabajos enviados en la corrida (ver libs/jobs.py)
+_slurm_jobs = None
+
+
+def slurm_jobs(settings):
+    """Trabajos de la corrida con el planificador de settings (se crea en el primer envio)"""
+    global _slurm_jobs
+    if _slurm_jobs is None:
+        scheduler = jobs.SCHEDULERS[settings['process'].get('scheduler', 'local')]()
+        _slurm_jobs = jobs.Jobs(scheduler, poll=float(settings['process'].get('scheduler_poll', 30)),
+                                cwd=os.path.join(settings['globals']['run_dir'], "logs"),
+                                unknown_timeout=float(settings['process'].get('scheduler_unknown_timeout', 600)))
+    return _slurm_jobs
+
+
+def slurm_job_name(type, domain=None):
+    """Nombre del trabajo en la corrida, p.ej. real o wrfda_3dvar_d01"""
+    return type if type != "wrfda_3dvar" else "{}_d0{}".format(type, domain)
+
+
+def slurm_send(settings, type="wrf", domain="01", after=(), check=None, wait=None):
     """
-   execute bash job using slurm
+    execute bash job using slurm
 
-    :return: sbash result of job submit
+    El trabajo se envia despues de los trabajos after (nombres, ver slurm_job_name),
+    corre si terminan bien (segun su check). Si wait (default: sin slurm_async) se espera a que termine, si no
+    retorna sin esperar y check(codigo) se llama cuando termine (al esperar este u
+    otro trabajo, ver wait_slurm_jobs), check retorna True si el trabajo termino bien
+
+    :return: sbash result of job submit (None sin esperar)
     :rtype: Int
     """
     logging.info("Iniciando ejecucion de Slurm:")
-    if type == "metgrid":
-        metgrid_slurm = settings['globals']['METGRID_SLURM_SCRIPT']
-        replace_infile(metgrid_slurm,settings)
-        result=subprocess.Popen(["/bin/bash",metgrid_slurm])
-        result.wait()
-        logging.info("Resultado de la ejecucion: {}".format(result.returncode))
-    if type == "geogrib":
-        geogrib_slurm = settings['globals']['GEOGRIB_SLURM_SCRIPT']
-        replace_infile(geogrib_slurm,settings)
-        result=subprocess.Popen(["/bin/bash",geogrib_slurm])
-        result.wait()
-        logging.info("Resultado de la ejecucion: {}".format(result.returncode))
-    elif type=="real" :
-        realm_slurm=settings['globals']['REALM_SLURM_SCRIPT']
-        replace_infile(realm_slurm,settings)
-        result=subprocess.Popen(["/bin/bash",realm_slurm])
-        result.wait()
-        logging.info("Resultado de la ejecucion: {}".format(result.returncode))
-    elif type=="wrf" :
-        logging.info("Iniciando Slurm de WRF:")
-        wrf_slurm=settings['globals']['WRF_SLURM_SCRIPT']
-        replace_infile(wrf_slurm,settings)
-        result=subprocess.Popen(["/bin/bash",wrf_slurm])
-        result.wait()
-        logging.info("Resultado de la ejecucion: {}".format(result.returncode))
-    elif type=="wrf_obsproc" :
-        logging.info("Iniciando Slurm de obsproc:")
-        obsproc_slurm=settings['globals']['OBSPROC_SLURM_SCRIPT']
-        replace_infile(obsproc_slurm,settings)
-        result=subprocess.Popen(["/bin/bash",obsproc_slurm])
-        result.wait()
-        logging.info("Resultado de la ejecucion: {}".format(result.returncode))
-    elif type=="wrfda_3dvar":
-        logging.info("Iniciando Slurm de 3dvars:")
-        tdvar_slurm=settings['globals']['3DVAR_SLURM_SCRIPT']
-        replace_infile(tdvar_slurm,settings,domain)
-        result=subprocess.Popen(["/bin/bash",tdvar_slurm])
-        result.wait()
-        logging.info("Resultado de la ejecucion: {}".format(result.returncode))
-    logging.info("Resultado de la ejecucion: {}".format(result.returncode))
-    return result.returncode
+    job_script = settings['globals'][SLURM_SCRIPTS[type]]
+    if type == "wrfda_3dvar":
+        # un script por dominio en los logs de la corrida (RUNDIR y log del dominio),
+        # los trabajos de todos los dominios pueden estar en la cola al mismo tiempo
+        domain_script = os.path.join(settings['globals']['run_dir'], "logs", "{}_d0{}.sh".format(
+            os.path.splitext(os.path.basename(job_script))[0], domain))
+        replace_infile(job_script, settings, domain, out_path=domain_script)
+        job_script = domain_script
+    else:
+        replace_infile(job_script, settings)
+    name = slurm_job_name(type, domain)
+    slurm_jobs(settings).submit(name, job_script, after=after, check=check)
+
+    if wait is None:
+        wait = not settings['process'].get('slurm_async', False)
+    if not wait:
+        return None
+    return_code = slurm_jobs(settings).wait(name)
+    logging.info("Resultado de la ejecucion: {}".format(return_code))
+    return return_code
+
+
+def wait_slurm_jobs(*names):
+    """Esperar a que terminen los trabajos enviados (todos si no se dan nombres)"""
+    if _slurm_jobs is not None:
+        return _slurm_jobs.wait(*names)
 
 
 def send_mail(sender, receiver, subject, body, files_attached=None):
@@ -368,7 +433,18 @@ def email_report(settings, files_attached=None):
     send_mail(os.environ.get('login_smtp_user'), receivers, mail_subject, mail_body, files_attached)
 
 
+# corridas que se mueven al backup en segundo plano (free_space_background)
+_free_spaces_thread = None
+
+
 def free_spaces_before_run(settings):
+    """
+    Liberar espacio antes de la corrida: en backup_destination se eliminan las
+    corridas run y rap mas antiguas, y en original_destination se eliminan los
+    data y se mueven las corridas run y rap al backup. Se revisa una sola vez cada
+    disco y se planean las corridas necesarias (ver libs/diskspace.py)
+    """
+    global _free_spaces_thread
 
     # paths
 #    original_destination = "/wrf4"
@@ -376,69 +452,63 @@ def free_spaces_before_run(settings):
     original_destination = settings['globals']['original_destination']
     backup_destination = settings['globals']['backup_destination']
 
-    ### delete in backup destination
-    # XX Gb minimo de espacio libre
-    min_free_space = 120
-    t, u, f = shutil.disk_usage(backup_destination)
-    free_space = f/1073741824
-    while free_space < min_free_space:
-        old_runs = []
-        for type_run in ["run", "rap"]:
-            date_paths = {}
-            for dir in glob(backup_destination + "/" + type_run + "/*/"):
-                try:
-                    dir_date = datetime.strptime(dir.split("/")[-2], "%Y%m%d-%H")
-                except:
-                    continue
-                date_paths[dir_date] = dir
-            if date_paths:
-                sorted_dates = sorted(date_paths)
-                old_runs.append([sorted_dates[0], date_paths[sorted_dates[0]]])
-        oldest_date = sorted([x[0] for x in old_runs])[0]
-        for _date, _path in old_runs:
-            if _date <= oldest_date:
-                logging.info("Eliminando: " + _path)
-                shutil.rmtree(_path, ignore_errors=True)
-        t, u, f = shutil.disk_usage(backup_destination)
-        free_space = f / 1073741824
+    # espacio libre minimo (GB) en cada disco (default: 120) e hilos para medir,
+    # eliminar y mover las corridas (default: 4)
+    min_free_backup = float(settings['globals'].get('min_free_space_backup', 120)) * diskspace.GB
+    min_free_original = float(settings['globals'].get('min_free_space_original', 120)) * diskspace.GB
+    workers = int(settings['globals'].get('free_space_workers', 4))
+    # liberar lo posible aunque no se alcance el minimo (default: False, no se libera nada)
+    partial = settings['globals'].get('free_space_partial', False)
+
+    # en el mismo disco mover no libera espacio
+    same_disk = os.stat(original_destination).st_dev == os.stat(backup_destination).st_dev
+
+    # nunca se mueve la corrida actual ni la anterior que usa la corrida en caliente
+    keep = [settings['globals']['run_dir']]
+    if settings['globals']['run_type'] == "warm":
+        keep.append(settings['rap']['run_dir'])
 
     ### move (or delete for /arw/data) original_destination to backup destination
-    # XX Gb minimo de espacio libre
-    min_free_space =120 
-    t, u, f = shutil.disk_usage(original_destination)
-    free_space = f / 1073741824
-    while free_space < min_free_space:
-        old_runs = []
-        for type_run in ["run", "rap", "data"]:
-            date_paths = {}
-            for dir in glob(original_destination + "/" + type_run + "/*/"):
-                try:
-                    dir_date = datetime.strptime(dir.split("/")[-2], "%Y%m%d-%H")
-                except:
-                    continue
-                date_paths[dir_date] = dir
-            if date_paths:
-                sorted_dates = sorted(date_paths)
-                old_runs.append([sorted_dates[0], date_paths[sorted_dates[0]]])
-        oldest_date = sorted([x[0] for x in old_runs])[0]
-        for _date, _path in old_runs:
-            if _date <= oldest_date:
-                if _path.startswith(original_destination + "/" + "data"):
-                    logging.info("Eliminando: " + _path)
-                    shutil.rmtree(_path, ignore_errors=True)
-                else:
-                    logging.info("Moviendo: " + _path)
-                    shutil.rmtree(os.path.join(backup_destination, type_run, os.path.basename(_path)),
-                                  ignore_errors=True)
-                    type_run = _path.split("/")[2]
-                    #shutil.move(os.path.dirname(_path), backup_destination + "/" + type_run + "/")
-                    fecha = _path.split("/")[3]
-                    borrarfolder =  backup_destination + "/" + type_run + "/" + fecha
-                    if os.path.exists(borrarfolder):
-                       os.system("rm -rf " + borrarfolder)
-                    shutil.move(os.path.dirname(_path), os.path.join(backup_destination,type_run))
-        t, u, f = shutil.disk_usage(original_destination)
-        free_space = f / 1073741824
+    runs = diskspace.scan_runs(original_destination, ("run", "rap", "data"), workers=workers)
+    free = shutil.disk_usage(original_destination).free
+    selected, freed = diskspace.plan(runs, free, min_free_original,
+                                     frees=lambda run: run.kind == "data" or not same_disk,
+                                     keep=keep, partial=partial)
+    diskspace.log_plan(original_destination, free, min_free_original, selected, freed)
+    deletes = [run for run in selected if run.kind == "data"]
+    moves = [run for run in selected if run.kind != "data"]
+
+    ### delete in backup destination, con espacio para las corridas que se mueven
+    # las corridas del backup que se reemplazan con las movidas no se cuentan
+    replaced = set((run.kind, os.path.basename(run.path)) for run in moves)
+    backup_runs = diskspace.scan_runs(backup_destination, ("run", "rap"), workers=workers)
+    incoming = 0 if same_disk else sum(run.size for run in moves) - \
+        sum(run.size for run in backup_runs if (run.kind, os.path.basename(run.path)) in replaced)
+    backup_runs = [run for run in backup_runs if (run.kind, os.path.basename(run.path)) not in replaced]
+    free = shutil.disk_usage(backup_destination).free
+    backup_selected, backup_freed = diskspace.plan(backup_runs, free, min_free_backup + max(incoming, 0),
+                                                   partial=partial)
+    diskspace.log_plan(backup_destination, free, min_free_backup + max(incoming, 0), backup_selected, backup_freed)
+
+    # eliminar en paralelo
+    diskspace.run_parallel(diskspace.remove, [(run.path,) for run in backup_selected + deletes], workers)
+
+    # mover en paralelo, en segundo plano si free_space_background (default: False)
+    move_args = [(run.path, os.path.join(backup_destination, run.kind)) for run in moves]
+    if move_args and settings['globals'].get('free_space_background', False):
+        logging.info("Moviendo las corridas al backup en segundo plano")
+        _free_spaces_thread = Thread(target=diskspace.run_parallel, args=(diskspace.move, move_args, workers),
+                                     name="free_spaces", daemon=True)
+        _free_spaces_thread.start()
+    else:
+        diskspace.run_parallel(diskspace.move, move_args, workers)
+
+
+def wait_free_spaces():
+    """Esperar a que terminen de moverse las corridas en segundo plano (si existe)"""
+    if _free_spaces_thread is not None and _free_spaces_thread.is_alive():
+        logging.info("Esperando a que terminen de moverse las corridas al backup")
+        _free_spaces_thread.join()
 
 
 def free_spaces_before_post(settings):
@@ -449,36 +519,19 @@ def free_spaces_before_post(settings):
   backup_destination2 = "/disco1/run/" 
   backup_destination3 = "/disco1/antartida/" 
 
+  # espacio libre minimo (GB) en cada destino del post (default: 120)
+  min_free_space = float(settings['globals'].get('min_free_space_post', 120)) * diskspace.GB
+  workers = int(settings['globals'].get('free_space_workers', 4))
+
   for backup_destination in [backup_destination1, backup_destination2,backup_destination3]:
 
     ### delete in backup destination
-    # XX Gb minimo de espacio libre
-    min_free_space = 120
-    t, u, f = shutil.disk_usage(backup_destination)
-    free_space = f/1073741824
-
-    while free_space < min_free_space:
-   #      print (free_space)
-      date_paths = {}
-      old_runs = []
-      for dir in glob(backup_destination+"/*"):
-        try:
-           dir_date = datetime.strptime(dir.split("/")[-1], "%Y%m%d-%H")
-        except:
-           continue
-        date_paths[dir_date] = dir
-      logging.info("julian:" + str(date_paths))
-      if date_paths:
-           sorted_dates = sorted(date_paths)
-           old_runs.append([sorted_dates[0], date_paths[sorted_dates[0]]])
-      oldest_date = sorted([x[0] for x in old_runs])[0]
-      for _date, _path in old_runs:
-        if _date <= oldest_date:
-           #print("Eliminando: " + _path)
-            logging.info("Eliminando: " + _path)
-            shutil.rmtree(_path, ignore_errors=True)
-      t, u, f = shutil.disk_usage(backup_destination)
-      free_space = f / 1073741824
+    runs = diskspace.scan_runs(backup_destination, only_dirs=False, workers=workers)
+    free = shutil.disk_usage(backup_destination).free
+    selected, freed = diskspace.plan(runs, free, min_free_space,
+                                     partial=settings['globals'].get('free_space_partial', False))
+    diskspace.log_plan(backup_destination, free, min_free_space, selected, freed)
+    diskspace.run_parallel(diskspace.remove, [(run.path,) for run in selected], workers)
 
 #def force_symlink(file1, file2):
  #   try:
@@ -11,7 +11,8 @@
 # Script principal de corrida del modelo
 #
 # Llama paso a paso a todos los subprocesos necesarios para la
-# corrida de manera secuencial: p1 > p2 > p3 > p4
+# corrida como un grafo de dependencias, por defecto de manera
+# secuencial: p1 > p2 > p3 > p4 (ver stage_workers en settings.ini)
 #
 # Toda informacion de corrida, errores y advertencias se almacenaran
 # en el archivo log llamado main.log, ningun mensaje sera mostrado
@@ -29,7 +30,9 @@ import logging
 import os
 import sys
 import atexit
+import threading
 from datetime import datetime
+from functools import partial
 from dateutil.relativedelta import relativedelta
 
 project_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -37,7 +40,11 @@ if project_folder not in sys.path:
     sys.path.append(project_folder)
 
 from scripts_op import p1_download, p2_preparation, p3_wps, p4_real, p5_wrfda, p6_fcst, p7_post
-from scripts_op.libs.utils import log_format, SettingsParser, FileLock, email_report, free_spaces_before_run,  free_spaces_before_post
+import namelists_op
+from scripts_op.libs import dag
+from scripts_op.libs.checkpoint import Checkpoint, config_hash
+from scripts_op.libs.utils import log_format, SettingsParser, FileLock, email_report, free_spaces_before_run,  free_spaces_before_post, \
+    wait_free_spaces, wait_slurm_jobs
 
 ###############################################################################
 #  Carga de las variables desde argumentos de corrida
@@ -56,6 +63,9 @@ parser.add_argument('--start-date', type=str, dest='start_date', help='fecha de
 parser.add_argument('--run-time', type=str, dest='run_time', help='hora de la corrida', required=True)
 parser.add_argument('--run-type', type=str, dest='run_type', help='tipo de corrida del modelo (cold or warm)',
                     choices=('warm', 'cold'), required=True)
+parser.add_argument('--resume', action='store_true', dest='resume',
+                    help='continuar una corrida interrumpida: omitir los pasos\n'
+                         'terminados cuyo manifest sigue valido (RUN_DIR/manifests)')
 
 args = parser.parse_args()
 
@@ -152,9 +162,21 @@ settings['globals']['lockfile'] = lockfile
 #
 
 
+class CriticalError(BaseException):
+    """Error critico en un hilo distinto al principal (pasos del grafo en paralelo),
+    hereda de BaseException para que no lo atrape un 'except Exception' del paso"""
+
+
 class ShutdownHandler(logging.Handler):
-    """Exit on critical error"""
+    """Exit on critical error, outside the main thread raise CriticalError and the
+    main thread exits after the graph (see shutdown)"""
     def emit(self, record):
+        if threading.current_thread() is not threading.main_thread():
+            raise CriticalError(record.getMessage())
+        self.shutdown()
+
+    @staticmethod
+    def shutdown():
         email_report(settings=settings,
                      files_attached=[os.path.join(settings['globals']['run_dir'], "logs", "main.log")])
         logging.shutdown()
@@ -185,7 +207,7 @@ main_log = os.path.join(settings['globals']['run_dir'], "logs", "main.log")
 # setting the logging
 logging.basicConfig(filename=main_log, level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s: %(message)s',
-                    datefmt='%Y%m%d%H%M', filemode='w')
+                    datefmt='%Y%m%d%H%M', filemode='a' if args.resume else 'w')
 
 # set exit on critical error
 logging.getLogger().addHandler(ShutdownHandler(level=50))
@@ -198,6 +220,8 @@ logging.info(log_format('INICIO DEL PROCESO', level=1))
 logging.info('CORRIDA PARA EL: {}'.format(args.start_date))
 logging.info('HORA DE CORRIDA: {}'.format(args.run_time.zfill(2)))
 logging.info('TIPO DE CORRIDA: {}'.format(args.run_type))
+if args.resume:
+    logging.info('CONTINUANDO LA CORRIDA (--resume)')
 logging.info('#'*70)
 logging.info('')
 
@@ -218,15 +242,49 @@ atexit.register(exit_handler)
 
 free_spaces_before_run(settings)
 
+###############################################################################
+#  Grafo de pasos de la corrida
+#
+# Los procesos se ejecutan como un grafo de dependencias (ver libs/dag.py), cada
+# paso declara sus entradas y salidas. Con stage_workers > 1 los pasos
+# independientes corren al mismo tiempo: las descargas entre si, los
+# convertidores de observaciones entre si y la preparacion de observaciones
+# junto con WPS y real. Con 1 (default) se ejecutan en el orden p1 > ... > p7
+#
+# Al terminar cada paso se guarda su manifest (ver libs/checkpoint.py), con
+# --resume se omiten los pasos terminados cuyo manifest sigue valido
+
+data_dir = settings['globals']['data']
+run_dir = settings['globals']['run_dir']
+run_litr_dir = os.path.join(run_dir, "wrfda", "obsproc", "litR")
+checkpoint = Checkpoint(os.path.join(run_dir, "manifests"),
+                        config_hash(settings, os.path.dirname(namelists_op.__file__)), resume=args.resume,
+                        quick=settings['process'].get('manifest_hash', 'quick') != 'full', flags=settings['flags'])
+graph = dag.Graph(checkpoint=checkpoint)
+
+
+def stage_title(flag, title, function=None):
+    """Paso con el titulo del proceso (si esta habilitado) y la funcion de preparacion"""
+    def step():
+        if settings['flags'][flag]:
+            logging.info(log_format(title, level=1))
+            if function is not None:
+                function(settings)
+    return step
+
+
 ###############################################################################
 #  Descarga
 #
 # Descarga de los GFS, asimilacion y demas datos necesarios para la corrida
 
-p1_download.download(settings)
+graph.add("p1_download", stage_title('p1_download', 'PROCESO 1: DESCARGA'))
+for name, data_name in (("p1a_gfs", "gfs"), ("p1c_sound", "sound"), ("p1d_synop", "synop"), ("p1e_radar", "radar")):
+    graph.add(name, partial(p1_download.download_step, settings, name),
+              outputs=[os.path.join(data_dir, data_name)], after=["p1_download"], flags=["p1_download", name])
 
 # start lock the process from here
-lockfile.acquire()
+graph.add("lockfile", lockfile.acquire, after=["p1a_gfs", "p1c_sound", "p1d_synop", "p1e_radar"])
 
 ###############################################################################
 #  Preparacion
@@ -234,39 +292,95 @@ lockfile.acquire()
 # Preparacion de datos convirtiendolos a formatos LitR para la entrada de la
 # asimilacion del modelo
 
-p2_preparation.preparation(settings)
+graph.add("p2_preparation", stage_title('p2_preparation', 'PROCESO 2: PREPARACION', p2_preparation.preparation_dirs),
+          after=["lockfile"])
+for name, inputs, outputs in (
+        ("p2a_metar2litR", ["metar"], [os.path.join(run_litr_dir, "metar")]),
+        ("p2b_sound2litR", ["sound"], [os.path.join(run_litr_dir, "sound")]),
+        ("p2c_synop2litR", ["synop"], [os.path.join(run_litr_dir, "synop")]),
+        ("p2d_radiom2litR", ["radiom"], [os.path.join(run_litr_dir, "radiom")]),
+        ("blend_obs_files", [], [os.path.join(run_litr_dir, "obs.{}".format(settings['globals']['start_date'].strftime("%Y%m%d%H")))]),
+        ("p2e_radar2txt", ["radar/RAW"], [os.path.join(data_dir, "radar", "wrfda"), os.path.join(run_dir, "wrfda", "radar")]),
+        ("p2f_goes", ["goes"], [os.path.join(run_dir, "wrfda", "goes")])):
+    # la mezcla de litR usa las salidas de todos los convertidores
+    inputs = [os.path.join(data_dir, i) for i in inputs] if inputs else [run_litr_dir]
+    graph.add(name, partial(p2_preparation.preparation_step, settings, name),
+              inputs=inputs, outputs=outputs, after=["p2_preparation"],
+              flags=["p2_preparation"] + ([name] if name in settings['flags'] else []))
+
 
 ###############################################################################
 #  WPS
 #
 # geogrid, ungrib, metgrid
 
-p3_wps.wps(settings)
+def wps():
+    # esperar las corridas que se mueven al backup en segundo plano (free_space_background)
+    wait_free_spaces()
+
+    p3_wps.wps(settings)
+
+    # esperar la descarga GFS en segundo plano (gfs_streaming) si no termino en WPS
+    p1_download.wait_gfs()
+
+
+graph.add("p3_wps", wps, inputs=[os.path.join(data_dir, "gfs")], outputs=[os.path.join(run_dir, "wps")],
+          after=["lockfile"], flags=["p3_wps", "p3a_geogrid", "p3b_ungrib", "p3c_metgrid"])
 
 ###############################################################################
 #  REAL
 #
 # real.exe
 
-p4_real.real(settings)
+graph.add("p4_real", partial(p4_real.real, settings), inputs=[os.path.join(run_dir, "wps")],
+          outputs=[os.path.join(run_dir, "real")], flags=["p4_real"])
 
 ###############################################################################
 #  WRFDA
 #
 # Corrida obsproc, low_bc, 3dvar, lat_bc
 
-p5_wrfda.wrfda(settings)
+graph.add("p5_wrfda", partial(p5_wrfda.wrfda, settings),
+          inputs=[os.path.join(run_dir, "real"), run_litr_dir, os.path.join(data_dir, "radar", "wrfda"),
+                  os.path.join(run_dir, "wrfda", "goes")],
+          outputs=[os.path.join(run_dir, "wrfda", name) for name in ("obsproc", "latbc", "da_d01", "da_d02", "da_d03")],
+          flags=["p5_wrfda", "p5a_obsproc", "p5b_low_bc", "p5c_3dvar", "p5d_lat_bc", "p5e_radar", "p5f_goes"])
 
 ###############################################################################
 #  Rap
 #
 # Corrida wrf
 
-p6_fcst.fcst(settings)
+def fcst():
+    # publicar los wrfout en el API a medida que WRF los escribe (api_streaming)
+    p7_post.watch_api(settings)
+
+    p6_fcst.fcst(settings)
+
+
+graph.add("p6_fcst", fcst, inputs=[os.path.join(run_dir, "wrfda"), os.path.join(run_dir, "real")],
+          outputs=[os.path.join(run_dir, "fcst")], flags=["p6_fcst", "p6a_wrf", "p5_wrfda", "p5a_obsproc"])
+
 ###############################################################################
 # POST
 #free_spaces_before_post(settings)
-p7_post.post(settings)
+graph.add("p7_post", partial(p7_post.post, settings), inputs=[os.path.join(run_dir, "fcst")],
+          outputs=[settings['globals']['post_dir']], flags=["p7_post", "p7a_arw", "p7b_api"])
+
+###############################################################################
+#  Ejecucion de los pasos
+#
+# pasos en paralelo (default: 1, secuencial)
+
+try:
+    graph.run(workers=int(settings['process'].get('stage_workers', 1)))
+except CriticalError:
+    # error critico en un paso en paralelo: email y salida desde el hilo principal
+    ShutdownHandler.shutdown()
+
+# trabajos de Slurm enviados sin esperar (slurm_async) que aun esten en la cola
+wait_slurm_jobs()
+
 ###############################################################################
 #  Finalizando
 
@@ -1,4 +1,4 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from scripts_op.p1_download.p1_download import download
+from scripts_op.p1_download.p1_download import download, gfs_streaming, wait_gfs
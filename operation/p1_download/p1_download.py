@@ -9,35 +9,99 @@
 #  Fuerza Aerea Colombiana (FAC)
 #
 import logging
+import os
+from threading import Thread
 
-from scripts_op.libs.utils import log_format
+from scripts_op.libs.utils import log_format, gfs_manifest_path, gfs_manifest_read, gfs_manifest_write
 from scripts_op.p1_download import p1c_sound, p1a_gfs, p1d_synop, p1e_radar
 
 
+# descarga GFS en segundo plano (modo gfs_streaming) y si fallo
+_gfs_thread = None
+_gfs_failed = False
+
+
 def download(settings):
 
     if not settings['flags']['p1_download']:
         return
 
     logging.info(log_format('PROCESO 1: DESCARGA', level=1))
-    
-    if settings['flags']['p1a_gfs']:
+
+    for name in ("p1a_gfs", "p1c_sound", "p1d_synop", "p1e_radar"):
+        download_step(settings, name)
+
+
+def download_step(settings, name):
+    """Subproceso de descarga name (su bandera en settings), tambien se ejecuta
+    como paso independiente en el grafo de la corrida (ver main.py)"""
+
+    if not (settings['flags']['p1_download'] and settings['flags'][name]):
+        return
+
+    if name == "p1a_gfs":
         if settings['globals']['run_type'] == "warm":
             logging.warning("La descarga no se realiza para run_type = warm")
             logging.warning("El proceso continua...")
         if settings['globals']['run_type'] == "cold":
             logging.info(log_format('Descargando archivos GFS', level=2))
-            p1a_gfs.gfs(settings)
+            # eliminar el manifest anterior antes de iniciar la descarga, ungrib
+            # (modo gfs_streaming) nunca debe leer los archivos de otra descarga
+            manifest = gfs_manifest_path(settings)
+            if os.path.isfile(manifest):
+                os.remove(manifest)
+            if settings['download'].get('gfs_streaming', False):
+                # descargar en segundo plano mientras continuan los demas procesos,
+                # ungrib procesa los archivos a medida que se publican en el manifest
+                logging.info("Descarga GFS en segundo plano (gfs_streaming)")
+                global _gfs_thread
+                _gfs_thread = Thread(target=gfs_background, args=(settings,), name="gfs", daemon=True)
+                _gfs_thread.start()
+            else:
+                p1a_gfs.gfs(settings)
 
-    if settings['flags']['p1c_sound']:
+    if name == "p1c_sound":
         logging.info(log_format('Descargando archivos Sounding', level=2))
         p1c_sound.sound(settings)
 
-    if settings['flags']['p1d_synop']:
+    if name == "p1d_synop":
         logging.info(log_format('Descargando archivos Synops', level=2))
         p1d_synop.synop(settings)
 
-    if settings['flags']['p1e_radar']:
+    if name == "p1e_radar":
         logging.info(log_format('Descargando archivos de radar', level=2))
         p1e_radar.radar(settings)
 
+
+def gfs_background(settings):
+    """Descarga GFS del modo gfs_streaming, el manifest siempre queda cerrado
+    (END) para que ungrib no espere archivos que no van a llegar. Las fallas se
+    registran como error y el error critico se reporta en wait_gfs"""
+    global _gfs_failed
+    try:
+        _gfs_failed = not p1a_gfs.gfs(settings, background=True)
+    except Exception as err:
+        _gfs_failed = True
+        logging.error("Problemas con la descarga GFS en segundo plano: " + str(err))
+    finally:
+        manifest = gfs_manifest_path(settings)
+        if gfs_manifest_read(manifest)[2] is None:
+            gfs_manifest_write(manifest, "END -1")
+
+
+def gfs_streaming():
+    """True si la descarga GFS se esta realizando en segundo plano"""
+    return _gfs_thread is not None
+
+
+def wait_gfs():
+    """Esperar a que termine la descarga GFS en segundo plano (si existe), error
+    critico si la descarga fallo"""
+    if _gfs_thread is None:
+        return
+    if _gfs_thread.is_alive():
+        logging.info("Esperando a que termine la descarga GFS en segundo plano")
+        _gfs_thread.join()
+    if _gfs_failed:
+        logging.error("Problemas con la descarga GFS en segundo plano")
+        logging.critical("Estos datos son necesarios para la corrida")
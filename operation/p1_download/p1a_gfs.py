@@ -18,15 +18,26 @@
 # Para ver la instalacion y configuracion de esta libreria
 # ver la documentacion.
 
+import hashlib
 import logging
 import os
-from time import sleep
+import shutil
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore, Lock
+from time import sleep, time
+from urllib.parse import urlparse
 
 from scripts_op.libs.gfsdownload import utils
+from scripts_op.libs.utils import gfs_manifest_path, gfs_manifest_write
 
 
-def gfs(settings):
+def gfs(settings, background=False):
+    """Descarga de los GFS, retorna True si se descargaron todos los archivos. En
+    segundo plano (background, modo gfs_streaming) las fallas se registran como
+    error y el error critico lo reporta el hilo principal (ver wait_gfs)"""
     logging.info('#### Descargando los GFS')
+    log_required = logging.error if background else logging.critical
 
     ###########
     # GFS parameter code for download, possibles:
@@ -67,6 +78,11 @@ def gfs(settings):
     if not os.path.isdir(gfs_dir):
         os.makedirs(gfs_dir)
 
+    # manifest de los archivos descargados, cada archivo se publica al terminar
+    # su descarga para que ungrib lo procese sin esperar toda la descarga (el
+    # manifest anterior se elimina antes de iniciar la descarga, ver download_step)
+    manifest = gfs_manifest_path(settings)
+
     ###########
     # revision y asignacion de los parametros
     gfs_code = utils.checkForParams(gfs_code)
@@ -96,39 +112,178 @@ def gfs(settings):
 
         if attempt == int(settings['download']['max_attempts']):
             logging.error("Problemas al descargar")
-            logging.critical("Estos datos son necesarios para la corrida")
-            break
+            log_required("Estos datos son necesarios para la corrida")
+            return False
         attempt += 1
         sleep(150)
 
-    lists_files = []
-
+    # archivos a descargar (url, ruta de salida)
+    downloads = []
     for url in struct[0]:
-        try:
-            namefile = ",".join(gfs_code) + '_' + url.rsplit('.', 1)[1].replace('%2F','') + \
-                       '_' + url.split('&')[0].split('.')[-1] + '.grb'
-            gfs_path = os.path.join(gfs_dir, namefile)
-            
-            logging.info("url rsplit : " + url)
-            logging.info("Descargando: " + namefile)
-            lists_files.append(gfs_path)
-
-            attempt = 1
-            while True:
-                if utils.GFSDownload(url, gfs_path):
-                    logging.info(' ↳ Descarga finalizada')
-                    break
-                else:
-                    logging.error(" ↳ Problema al descargar, intentar de nuevo ({}/{})"
-                                  .format(attempt, settings['download']['max_attempts']))
-                if attempt == int(settings['download']['max_attempts']):
-                    raise Exception("Intentos maximos de descarga")
-                attempt += 1
-                sleep(int(settings['download']['wait_retry'])*60)
-
-        except Exception as err:
+        namefile = ",".join(gfs_code) + '_' + url.rsplit('.', 1)[1].replace('%2F','') + \
+                   '_' + url.split('&')[0].split('.')[-1] + '.grb'
+        gfs_path = os.path.join(gfs_dir, namefile)
+        logging.info("url rsplit : " + url)
+        downloads.append((url, gfs_path))
+    gfs_manifest_write(manifest, "TOTAL {}".format(len(downloads)))
+
+    # descargas simultaneas en total y por servidor
+    workers = max(1, min(int(settings['download'].get('gfs_workers', 1)), len(downloads)))
+    host_connections = int(settings['download'].get('gfs_host_connections', workers))
+
+    # cache local de GFS compartido entre corridas (vacio para deshabilitar)
+    cache_dir = settings['download'].get('gfs_cache', '')
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    download = partial(download_file, host_connections=host_connections, manifest=manifest, cache_dir=cache_dir,
+                       max_attempts=int(settings['download']['max_attempts']),
+                       backoff=float(settings['download'].get('gfs_backoff', 10)),
+                       backoff_max=float(settings['download'].get('gfs_backoff_max', 600)))
+
+    logging.info("Descargando {} archivos GFS con {} descarga(s) simultanea(s)".format(len(downloads), workers))
+    if workers > 1:
+        with ThreadPool(processes=workers) as pool:
+            results = pool.map(download, downloads)
+    else:
+        results = list(map(download, downloads))
+
+    for (url, gfs_path), result in zip(downloads, results):
+        if not result:
             logging.error("Problemas descargando el archivo desde: " + url)
-            logging.error("Error de descarga: " + str(err))
-            logging.critical("Estos datos son necesarios para la corrida")
+            log_required("Estos datos son necesarios para la corrida")
+
+    gfs_manifest_write(manifest, "END {}".format(results.count(False)))
 
+    if cache_dir:
+        cache_evict(cache_dir, float(settings['download'].get('gfs_cache_size', 50))*1024**3)
     logging.info('La descarga de datos GFS termino')
+    return all(results)
+
+
+# un semaforo por servidor para limitar las conexiones simultaneas a cada uno
+_host_semaphores = {}
+_host_semaphores_lock = Lock()
+# escritura de las descargas terminadas en el manifest
+_manifest_lock = Lock()
+
+
+def host_semaphore(url, host_connections):
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = BoundedSemaphore(max(1, host_connections))
+        return _host_semaphores[host]
+
+
+def forecast_hour(url):
+    """Hora de pronostico del archivo GFS de la url (*.f003 -> 3, *.anl -> 0)"""
+    hour = url.split('&')[0].split('.')[-1]
+    return 0 if hour == 'anl' else int(hour[1:])
+
+
+def cache_path(cache_dir, url):
+    """Archivo del cache GFS para la url, la url de NOMADS contiene el ciclo, la hora de
+    pronostico, la rejilla, el area y las variables y niveles del subconjunto"""
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest() + '.grb')
+
+
+def link_or_copy(src, dst):
+    """Enlace duro de src en dst (reemplazando dst), copia si estan en distinto disco"""
+    tmp = dst + '.tmp'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def cache_fetch(cache_dir, url, gfs_path):
+    """Enlazar el archivo del cache en gfs_path si existe y esta completo"""
+    cache_file = cache_path(cache_dir, url)
+    if not os.path.isfile(cache_file):
+        return False
+    if not utils.checkForGrib2(cache_file):
+        logging.warning("Archivo del cache GFS incompleto, se descarta: " + cache_file)
+        os.remove(cache_file)
+        return False
+    link_or_copy(cache_file, gfs_path)
+    # marcar como usado recientemente (LRU)
+    os.utime(cache_file)
+    return True
+
+
+def cache_store(cache_dir, url, gfs_path):
+    """Guardar en el cache el archivo descargado gfs_path"""
+    try:
+        link_or_copy(gfs_path, cache_path(cache_dir, url))
+    except OSError as err:
+        logging.warning("No se pudo guardar en el cache GFS: " + str(err))
+
+
+def cache_evict(cache_dir, max_size):
+    """Borrar los archivos del cache usados hace mas tiempo hasta que el
+    cache ocupe menos de max_size bytes"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.grb'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        os.remove(path)
+        total -= size
+        logging.info("Cache GFS: borrado " + os.path.basename(path))
+
+
+def download_file(download, host_connections=1, max_attempts=1, backoff=10, backoff_max=600, manifest=None,
+                  cache_dir=None):
+    """Descarga un archivo GFS reintentando con espera exponencial (backoff, 2*backoff, ...
+    hasta backoff_max segundos). Los reintentos continuan el archivo parcial .part y al
+    terminar el archivo se publica en el manifest (ver gfs_manifest_write). Si cache_dir
+    esta definido el archivo se toma del cache si existe y las descargas se guardan en el cache
+
+    :param download: tupla (url, ruta del archivo de salida)
+    :return: True si el archivo se descargo completo
+    """
+    url, gfs_path = download
+    namefile = os.path.basename(gfs_path)
+
+    def publish():
+        if manifest:
+            with _manifest_lock:
+                gfs_manifest_write(manifest, "{} {}".format(forecast_hour(url), gfs_path))
+
+    if cache_dir and cache_fetch(cache_dir, url, gfs_path):
+        logging.info(' ↳ Tomado del cache GFS: ' + namefile)
+        publish()
+        return True
+
+    # descartar archivos parciales de corridas anteriores
+    if os.path.isfile(gfs_path + '.part'):
+        os.remove(gfs_path + '.part')
+
+    attempt = 1
+    while True:
+        logging.info("Descargando: " + namefile)
+        start = time()
+        with host_semaphore(url, host_connections):
+            downloaded = utils.GFSDownload(url, gfs_path)
+        if downloaded:
+            size = os.path.getsize(gfs_path)/1024**2
+            logging.info(' ↳ Descarga finalizada {} ({:.1f} MB en {:.1f} s)'.format(namefile, size, time() - start))
+            if cache_dir:
+                cache_store(cache_dir, url, gfs_path)
+            publish()
+            return True
+        logging.error(" ↳ Problema al descargar {}, intentar de nuevo ({}/{})"
+                      .format(namefile, attempt, max_attempts))
+        if attempt >= max_attempts:
+            logging.error("Intentos maximos de descarga: " + namefile)
+            return False
+        sleep(min(backoff * 2**(attempt - 1), backoff_max))
+        attempt += 1
@@ -11,8 +11,10 @@
 
 import os
 import logging
-from time import sleep
-from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import time
+
+import requests
 from bs4 import BeautifulSoup
 
 # lista de paises a descargar synops para Colombia y alrededores
@@ -75,67 +77,110 @@ def synop(settings):
     # ejemplo de URL de descarga
     # http://www.ogimet.com/display_synopsc2.php?estado=Colom&tipo=ALL&ord=REV&nil=SI&fmt=txt&ano=2016&mes=10&day=28&hora=11&anof=2016&mesf=10&dayf=28&horaf=12&enviar=Ver
 
-    # Loop por cada pais de la region a descargar
-    files_paths = []
-    for acrom, country in country_list.items():
-
-        url = "http://www.ogimet.com/display_synopsc2.php?estado="
-        url += acrom
-        url += "&tipo=ALL&ord=REV&nil=SI&fmt=txt"
-
-        tdown = "&ano=" + settings['globals']['start_date'].strftime("%Y") + \
-                "&mes=" + settings['globals']['start_date'].strftime("%m") + \
-                "&day=" + settings['globals']['start_date'].strftime("%d") + \
-                "&hora=" + settings['globals']['run_time'] + \
-                "&anof=" + settings['globals']['start_date'].strftime("%Y") + \
-                "&mesf=" + settings['globals']['start_date'].strftime("%m") + \
-                "&dayf=" + settings['globals']['start_date'].strftime("%d") + \
-                "&horaf=" + str(int(settings['globals']['run_time'])+1).rjust(2).replace(" ","0") + \
-                "&enviar=Ver"
-
-        ## URL de descarga completa
-        url += tdown
-
-        file_path = os.path.join(synop_dir, "synop_{}.txt".format(acrom))
-
-        logging.info('Descargando datos Synop para ' + country)
-
-        attempt = 1
-        while True:
-            try:
-                response = urlopen(url)
-                text = BeautifulSoup(response.read(), "html.parser").find('pre').text.strip()
-                f = open(file_path, 'w')
-                f.write(text)
-                f.close()
-                files_paths.append(file_path)
-                logging.info(' ↳ Descarga finalizada')
-                break
-            except Exception as err:
-                logging.error(" ↳ Problemas descargando el archivo desde: " + url)
-                logging.error(" ↳ Error de descarga: " + str(err))
-                logging.error(" ↳ Problema al descargar, intentar de nuevo ({}/{})"
-                              .format(attempt, settings['download']['max_attempts']))
-
-            if attempt == int(settings['download']['max_attempts']):
-                logging.error(" ↳ Intentos maximos de descarga")
-                logging.warning(" ↳ Continuar sin este archivo")
-                break
-            attempt += 1
-            sleep(int(settings['download']['wait_retry']) * 60)
-
-    ### Mezclar todos los archivos en uno solo
-    logging.info('Mezclando todos los synops...')
-    with open(os.path.join(synop_dir, "synops.txt"), 'w') as outfile:
-        for fname in files_paths:
-            with open(fname) as infile:
-                for num, line in enumerate(infile):
-                    if 0 <= num <= 5:
-                        continue
-                    outfile.write(line)
-                outfile.write("\n")
+    tdown = "&ano=" + settings['globals']['start_date'].strftime("%Y") + \
+            "&mes=" + settings['globals']['start_date'].strftime("%m") + \
+            "&day=" + settings['globals']['start_date'].strftime("%d") + \
+            "&hora=" + settings['globals']['run_time'] + \
+            "&anof=" + settings['globals']['start_date'].strftime("%Y") + \
+            "&mesf=" + settings['globals']['start_date'].strftime("%m") + \
+            "&dayf=" + settings['globals']['start_date'].strftime("%d") + \
+            "&horaf=" + str(int(settings['globals']['run_time'])+1).rjust(2).replace(" ","0") + \
+            "&enviar=Ver"
+
+    max_attempts = int(settings['download']['max_attempts'])
+    wait_retry = int(settings['download']['wait_retry']) * 60
+    # descargas simultaneas de paises (default: 1, secuencial)
+    workers = max(1, int(settings['download'].get('synop_workers', 1)))
+
+    # sesion HTTP compartida por todas las descargas (conexiones reutilizables)
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+
+    countries = list(country_list.items())
+    # resultado por pais en el orden de country_list: ruta del archivo, False si fallo
+    results = [None] * len(countries)
+    # paises pendientes: (hora para intentar, indice del pais, intento)
+    pending = [(0, idx, 1) for idx in range(len(countries))]
+    merged = 0
+
+    ### Descarga por pais en paralelo y mezcla de todos los archivos en uno solo
+    # cada pais se agrega a synops.txt en el orden de country_list apenas se
+    # resuelven los anteriores, los reintentos se programan por pais sin
+    # detener las demas descargas
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(os.path.join(synop_dir, "synops.txt"), 'w') as outfile:
+        running = {}
+        while pending or running:
+            # lanzar los paises listos para (re)intentar
+            now = time()
+            for item in sorted(pending):
+                if item[0] <= now and len(running) < workers:
+                    pending.remove(item)
+                    _, idx, attempt = item
+                    acrom, country = countries[idx]
+                    if attempt == 1:
+                        logging.info('Descargando datos Synop para ' + country)
+                    url = synop_url(acrom) + tdown
+                    file_path = os.path.join(synop_dir, "synop_{}.txt".format(acrom))
+                    running[executor.submit(download_country, session, url, file_path)] = (idx, attempt, url)
+
+            # esperar la siguiente descarga terminada o, si hay cupo para lanzar otro
+            # pais, el siguiente reintento programado (sin cupo solo se espera una descarga)
+            timeout = None
+            if pending and len(running) < workers:
+                timeout = max(0, min(item[0] for item in pending) - time())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, attempt, url = running.pop(future)
+                acrom, country = countries[idx]
+                try:
+                    results[idx] = future.result()
+                    logging.info(' ↳ Descarga finalizada: ' + country)
+                except Exception as err:
+                    logging.error(" ↳ Problemas descargando el archivo desde: " + url)
+                    logging.error(" ↳ Error de descarga: " + str(err))
+                    logging.error(" ↳ Problema al descargar {}, intentar de nuevo ({}/{})"
+                                  .format(country, attempt, max_attempts))
+                    if attempt >= max_attempts:
+                        logging.error(" ↳ Intentos maximos de descarga: " + country)
+                        logging.warning(" ↳ Continuar sin este archivo")
+                        results[idx] = False
+                    else:
+                        pending.append((time() + wait_retry, idx, attempt + 1))
+
+            # mezclar los paises resueltos en orden
+            while merged < len(countries) and results[merged] is not None:
+                if results[merged]:
+                    with open(results[merged]) as infile:
+                        for num, line in enumerate(infile):
+                            if 0 <= num <= 5:
+                                continue
+                            outfile.write(line)
+                        outfile.write("\n")
+                merged += 1
+    session.close()
     logging.info(' ↳ Hecho: synops.txt')
 
     ### Terminando proceso
     logging.info('La descarga de datos Synop termino')
 
+
+def synop_url(acrom):
+    url = "http://www.ogimet.com/display_synopsc2.php?estado="
+    url += acrom
+    url += "&tipo=ALL&ord=REV&nil=SI&fmt=txt"
+    return url
+
+
+def download_country(session, url, file_path, timeout=120):
+    """Descarga los synops de un pais en file_path
+
+    :return: ruta del archivo descargado
+    """
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    text = BeautifulSoup(response.content, "html.parser").find('pre').text.strip()
+    with open(file_path, 'w') as f:
+        f.write(text)
+    return file_path
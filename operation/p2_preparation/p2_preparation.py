@@ -31,46 +31,51 @@ def blend_obs_files(settings):
     logging.info(' ↳ Hecho')
 
 
-def preparation(settings):
+# subprocesos de preparacion en orden de corrida: nombre (bandera), titulo y funcion,
+# la mezcla de los litR no tiene bandera y siempre se realiza
+STEPS = (("p2a_metar2litR", 'Conversion de Metares 2 litR', p2a_metar2litR.metar2litR),
+         ("p2b_sound2litR", 'Conversion de Sondeos 2 litR', p2b_sound2litR.sound2litR),
+         ("p2c_synop2litR", 'Conversion de Synopticos 2 litR', p2c_synop2litR.synop2litR),
+         ("p2d_radiom2litR", 'Conversion de Radiometros 2 litR', p2d_radiom2litR.radiom2litR),
+         ("blend_obs_files", 'Mezclando todos los archivos litR', blend_obs_files),
+         ("p2e_radar2txt", 'Conversion de radar 2 txt', p2e_radar2txt.radar2txt),
+         ("p2f_goes", 'Recorte de archivos GOES', p2f_goes16.goes16cut))
 
-    if not settings['flags']['p2_preparation']:
-        return
 
-    logging.info(log_format('PROCESO 2: PREPARACION', level=1))
+def preparation_dirs(settings):
+    """Directorios de salida de la preparacion: litR (obsproc) y radar"""
 
     settings['globals']['run_litr_dir'] = os.path.join(settings['globals']['run_dir'], "wrfda", "obsproc", "litR")
     
     if not os.path.isdir(settings['globals']['run_litr_dir']):
         os.makedirs(settings['globals']['run_litr_dir'])
 
-    if settings['flags']['p2a_metar2litR']:
-        logging.info(log_format('Conversion de Metares 2 litR', level=2))
-        p2a_metar2litR.metar2litR(settings)
+    settings['globals']['run_radar'] = os.path.join(settings['globals']['run_dir'], "wrfda", "radar")
+    if not os.path.isdir(settings['globals']['run_radar']):
+        os.makedirs(settings['globals']['run_radar'])
+
+
+def preparation(settings):
+
+    if not settings['flags']['p2_preparation']:
+        return
 
-    if settings['flags']['p2b_sound2litR']:
-        logging.info(log_format('Conversion de Sondeos 2 litR', level=2))
-        p2b_sound2litR.sound2litR(settings)
+    logging.info(log_format('PROCESO 2: PREPARACION', level=1))
 
-    if settings['flags']['p2c_synop2litR']:
-        logging.info(log_format('Conversion de Synopticos 2 litR', level=2))
-        p2c_synop2litR.synop2litR(settings)
+    preparation_dirs(settings)
 
-    if settings['flags']['p2d_radiom2litR']:
-        logging.info(log_format('Conversion de Radiometros 2 litR', level=2))
-        p2d_radiom2litR.radiom2litR(settings)
+    for name, title, function in STEPS:
+        preparation_step(settings, name)
 
-    logging.info(log_format('Mezclando todos los archivos litR', level=2))
-    blend_obs_files(settings)
 
-    settings['globals']['run_radar'] = os.path.join(settings['globals']['run_dir'], "wrfda", "radar")
-    if not os.path.isdir(settings['globals']['run_radar']):
-        os.makedirs(settings['globals']['run_radar'])
-    
-    if settings['flags']['p2e_radar2txt']:
-        logging.info(log_format('Conversion de radar 2 txt', level=2))
-        p2e_radar2txt.radar2txt(settings)
+def preparation_step(settings, name):
+    """Subproceso de preparacion name (ver STEPS), tambien se ejecuta como paso
+    independiente en el grafo de la corrida (ver main.py)"""
 
-    if settings['flags']['p2f_goes']:
-        logging.info(log_format('Recorte de archivos GOES', level=2))
-        p2f_goes16.goes16cut(settings)
-    
+    if not settings['flags']['p2_preparation']:
+        return
+
+    for step_name, title, function in STEPS:
+        if step_name == name and (name == "blend_obs_files" or settings['flags'][name]):
+            logging.info(log_format(title, level=2))
+            function(settings)
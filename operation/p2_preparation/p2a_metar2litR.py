@@ -8,12 +8,53 @@
 #  Estos script y códigos son de uso exclusivo de la
 #  Fuerza Aerea Colombiana (FAC)
 #
+import datetime
 import logging
+import multiprocessing as mp
 import os
 import string
-
-from scripts_op.libs.utils import dms_parser, dms2dd
-from scripts_op.libs.metar import metar  # https://github.com/phobson/python-metar.git
+import time
+from contextlib import nullcontext
+from functools import partial
+
+import numpy as np
+
+from scripts_op.libs import litr, stations
+from scripts_op.libs.metar import fastmetar  # https://github.com/phobson/python-metar.git
+
+# columnas de los reportes metar convertidos a little_r
+METAR_DTYPE = np.dtype([("lat", "f8"), ("lon", "f8"), ("ID", "i8"), ("name", "U40"), ("alt", "f8"),
+                       ("n_groups", "i8"), ("date", "U14"), ("slp", "f8"), ("press", "f8"),
+                       ("temp", "f8"), ("dewpt", "f8"), ("wind_speed", "f8"), ("wind_dir", "f8"),
+                       ("valid_fields", "i8")])
+
+
+def decode_metar(line, now):
+    """Decode a single metar line (already fixed) to the values written in little_r,
+    None if the metar can not be decoded"""
+    try:
+        obs = fastmetar.parse(line, now=now)
+    except:
+        return None
+
+    # Sea level pressure - SLP (Pa)
+    slp = obs.press_sea_level.value() * 100 if obs.press_sea_level else litr.MISSING
+    # Pressure (Pa)
+    press = float(obs.press.value("MB")) * 100 if obs.press else litr.MISSING
+    # Temperature (K)
+    temp = obs.temp.value("K") if obs.temp else litr.MISSING
+    # Dew point (K)
+    dewpt = obs.dewpt.value("K") if obs.dewpt else litr.MISSING
+    # Wind speed (m/s)
+    wind_speed = obs.wind_speed.value("MPS") if obs.wind_speed else litr.MISSING
+    # Wind direction (deg)
+    wind_dir = obs.wind_dir.value() if obs.wind_dir else litr.MISSING
+
+    # campos validos: la altura siempre esta y los demas si existen en el reporte
+    valid_fields = 1 + sum(value is not litr.MISSING for value in (press, temp, dewpt, wind_speed, wind_dir))
+
+    return (obs.station_id, len(obs.code.split(" ")[1::]), obs.time.strftime("%Y%m%d%H%M%S"),
+            slp, press, temp, dewpt, wind_speed, wind_dir, valid_fields)
 
 
 def metar2litR(settings):
@@ -23,249 +64,30 @@ def metar2litR(settings):
     http://www2.mmm.ucar.edu/wrf/users/wrfda/OnlineTutorial/Help/littler.html
     """
 
-    def get_station_info(station_id):
+    # catalogo de estaciones nsd_cccc.txt (ver libs/stations.py)
+    nsd_file = os.path.join(settings['globals']['scripts_dir'], "libs", "nsd_cccc.txt")
+    catalog = stations.get_catalog(nsd_file)
 
-        def search_station(station_id):
-            nsd_file = os.path.join(settings['globals']['scripts_dir'], "libs", "nsd_cccc.txt")
-            with open(nsd_file) as search:
-                for line in search:
-                    line = line.strip()
-                    if line.split(";")[0] == station_id:
-                        return line
+    def get_station_info(station_id):
 
-        nsd_station = search_station(station_id)
+        station = catalog.by_icao(station_id)
 
-        if nsd_station is None:
+        if station is None or None in (station.lat, station.lon, station.alt):
             logging.warning(" ↳ No existe la estacion dentro del archivo nsd_cccc.txt")
             return None, None, None, None, None, None
 
-        nsd_parser = nsd_station.split(";")
-
-        try:
-            ID = int(nsd_parser[1]+nsd_parser[2])
-        except:
-            ID = 99
-        location = nsd_parser[3]
-        country = nsd_parser[5]
-        lat = dms2dd(*dms_parser(nsd_parser[7]))
-        lon = dms2dd(*dms_parser(nsd_parser[8]))
-        alt = float(nsd_parser[11])
-
-        return ID, location, country, lat, lon, alt
-
-    def process_station(line):
-        """Decode a single input line."""
-        line = line.strip()
-        if len(line) and line[0] in string.ascii_uppercase:
-            logging.info("Procesando metar: "+line.split(" ")[0])
-
-            #### First fix some input metar string
-            # delete KT(E) in wind to KT
-            line = line.replace("KT(E)", "KT")
-
-            # decodificando el codigo metar
-            try:
-                obs = metar.Metar(line)
-            except:
-                logging.error(" ↳ Problemas decodificando: " + line)
-                logging.warning(" ↳ Continuar sin esta estacion")
-                return
+        ID = station.wmo if station.wmo is not None else 99
 
-            #### station header ####
+        return ID, station.name, station.country, station.lat, station.lon, station.alt
 
-            ID, location, country, lat, lon, alt = get_station_info(obs.station_id)
+    # procesos en paralelo para decodificar los metar (default: 1, secuencial)
+    workers = int(settings['assim'].get('metar_workers', 1))
 
-            if not ID:
-                logging.warning(" ↳ Continuar sin esta estacion")
-                return
-
-            valid_fields = 0
-
-            header_string = ""
-
-            # lat
-            header_string += str(format(lat, '.5f')).rjust(20)
-            # lon
-            header_string += str(format(lon, '.5f')).rjust(20)
-            # ID
-            header_string += str(ID).rjust(40)
-            # name
-            header_string += (location+"/"+country)[:40].rjust(40)
-            # platform
-            header_string += "FM-15 METAR".ljust(40)
-            # source
-            header_string += "".rjust(40)
-            # elevation
-            header_string += str(format(alt, '.5f')).rjust(20)
-            # valid fields
-            header_string += str(len(obs.code.split(" ")[1::])).rjust(10)
-            # errors
-            header_string += str(-888888).rjust(10)
-            # warnings
-            header_string += str(-888888).rjust(10)
-            # Sequence number
-            header_string += str("0").rjust(10)
-            # Num. duplicates
-            header_string += str(-888888).rjust(10)
-            # Is sounding?
-            header_string += str("F").rjust(10)
-            # Is bogus?
-            header_string += str("F").rjust(10)
-            # Discard?
-            header_string += str("F").rjust(10)
-            # Unix time
-            header_string += str(-888888).rjust(10)
-            # Julian day
-            header_string += str(-888888).rjust(10)
-            # Date
-            header_string += obs.time.strftime("%Y%m%d%H%M%S").rjust(20)
-            # Sea level pressure - SLP (Pa)
-            if obs.press_sea_level:
-                header_string += str(format(obs.press_sea_level.value() * 100, '.5f')).rjust(13)
-            else:
-                header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Sea level pressure - SLP (Pa)
-            header_string += str(0).rjust(7)
-            # Ref Pressure (Pa)
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Ref Pressure (Pa)
-            header_string += str(0).rjust(7)
-            # Ground Temp
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Ground Temp
-            header_string += str(0).rjust(7)
-            # SST
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC SST
-            header_string += str(0).rjust(7)
-            # SFC Pressure (Pa)
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC SFC Pressure (Pa)
-            header_string += str(0).rjust(7)
-            # Precip
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Precip
-            header_string += str(0).rjust(7)
-            # Daily Max T
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Daily Max T
-            header_string += str(0).rjust(7)
-            # Daily Min T
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Daily Min T
-            header_string += str(0).rjust(7)
-            # Night Min T
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Night Min T
-            header_string += str(0).rjust(7)
-            # 3hr Pres Change
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC 3hr Pres Change
-            header_string += str(0).rjust(7)
-            # 24hr Pres Change
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC 24hr Pres Change
-            header_string += str(0).rjust(7)
-            # Cloud cover
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Cloud cover
-            header_string += str(0).rjust(7)
-            # Ceiling
-            header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Ceiling
-            header_string += str(0).rjust(7)
-            # Precipitable water
-            #header_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Precipitable water
-            #header_string += str(0).rjust(7)
-
-            litR_file.write(header_string + '\n')
-
-            #### station data ####
-            
-            data_string = ""
-
-            # Pressure (Pa)
-            if obs.press:
-                data_string += str(format(float(obs.press.value("MB")) * 100, '.5f')).rjust(13)
-                valid_fields += 1
-            else:
-                data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Pressure (Pa)
-            data_string += str(0).rjust(7)
-            # Height (m)
-            data_string += str(format(alt, '.5f')).rjust(13)
-            valid_fields += 1
-            # QC Height (m)
-            data_string += str(0).rjust(7)
-            # Temperature (K)
-            if obs.temp:
-                data_string += str(format(obs.temp.value("K"), '.5f')).rjust(13)
-                valid_fields += 1
-            else:
-                data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Temperature (K)
-            data_string += str(0).rjust(7)
-            # Dew point (K)
-            if obs.dewpt:
-                data_string += str(format(obs.dewpt.value("K"), '.5f')).rjust(13)
-                valid_fields += 1
-            else:
-                data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Dew point (K)
-            data_string += str(0).rjust(7)
-            # Wind speed (m/s)
-            if obs.wind_speed:
-                data_string += str(format(obs.wind_speed.value("MPS"), '.5f')).rjust(13)
-                valid_fields += 1
-            else:
-                data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Wind speed (m/s)
-            data_string += str(0).rjust(7)
-            # Wind direction (deg)
-            if obs.wind_dir:
-                data_string += str(format(obs.wind_dir.value(), '.5f')).rjust(13)
-                valid_fields += 1
-            else:
-                data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Wind direction (deg)
-            data_string += str(0).rjust(7)
-            # Wind U (m/s)
-            data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Wind U (m/s)
-            data_string += str(0).rjust(7)
-            # Wind V (m/s)
-            data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Wind V (m/s)
-            data_string += str(0).rjust(7)
-            # Relative humidity (%)
-            data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Relative humidity (%)
-            data_string += str(0).rjust(7)
-            # Thickness (m)
-            data_string += str(format(-888888, '.5f')).rjust(13)
-            # QC Thickness (m)
-            data_string += str(0).rjust(7)
-
-            litR_file.write(data_string + '\n')
-
-            #### ending fields ####
-
-            litR_file.write("-777777.00000      0" * 2 + str(format(1, '.5f')).rjust(13) +
-                            str(0).rjust(7) + "-888888.00000      0" * 7 + '\n')
-
-            litR_file.write(str(valid_fields).rjust(7) + "      0      0" + '\n')
+    # hora actual UTC para completar el mes y año de los reportes
+    now = datetime.datetime.utcnow()
 
-    # output file where save all converted files
-    litR_file_path = os.path.join(settings['globals']['run_litr_dir'], "metar", "metar2litR.txt")
-    if not os.path.isdir(os.path.dirname(litR_file_path)):
-        os.makedirs(os.path.dirname(litR_file_path))
-    if os.path.isfile(litR_file_path):
-        os.remove(litR_file_path)
-
-    litR_file = open(litR_file_path, "w")
-
-    # process file by file
+    # lineas metar de todos los archivos
+    lines = []
     for root, dirs, files in os.walk(os.path.join(settings['globals']['data'], "metar")):
         if len(files) != 0:
             files = [x for x in files if x.startswith('metar') and not x == "metar2litR.txt"]
@@ -274,6 +96,59 @@ def metar2litR(settings):
                 logging.info("Procesando archivo metar: " + file)
                 with open(metar_file) as infile:
                     for line in infile:
-                        process_station(line)
+                        line = line.strip()
+                        if len(line) and line[0] in string.ascii_uppercase:
+                            #### First fix some input metar string
+                            # delete KT(E) in wind to KT
+                            lines.append(line.replace("KT(E)", "KT"))
+
+    start_time = time.time()
+
+    # decodificar todos los metar, en paralelo si workers > 1 (imap conserva el orden)
+    records = []
+    with (mp.Pool(processes=workers) if workers > 1 and len(lines) > 1 else nullcontext()) as pool:
+        decode = partial(decode_metar, now=now)
+        decoded = pool.imap(decode, lines, chunksize=256) if pool else map(decode, lines)
+
+        for line, obs in zip(lines, decoded):
+            logging.info("Procesando metar: " + line.split(" ")[0])
+
+            if obs is None:
+                logging.error(" ↳ Problemas decodificando: " + line)
+                logging.warning(" ↳ Continuar sin esta estacion")
+                continue
+
+            station_id, n_groups, date, slp, press, temp, dewpt, wind_speed, wind_dir, valid_fields = obs
+
+            ID, location, country, lat, lon, alt = get_station_info(station_id)
+
+            if not ID:
+                logging.warning(" ↳ Continuar sin esta estacion")
+                continue
+
+            records.append((lat, lon, ID, (location + "/" + country)[:40], alt, n_groups, date,
+                            slp, press, temp, dewpt, wind_speed, wind_dir, valid_fields))
+
+    decode_time = time.time() - start_time
+
+    # todos los registros little_r formateados por columnas
+    text = ""
+    if records:
+        records = np.array(records, dtype=METAR_DTYPE)
+        header = {"lat": records["lat"], "lon": records["lon"], "id": records["ID"], "name": records["name"],
+                  "platform": "FM-15 METAR", "elevation": records["alt"], "valid_fields": records["n_groups"],
+                  "date": records["date"], "slp": records["slp"]}
+        data = {"press": records["press"], "height": records["alt"], "temp": records["temp"],
+                "dewpt": records["dewpt"], "speed": records["wind_speed"], "dir": records["wind_dir"]}
+        text = litr.format_records(header, data, end_valid_fields=records["valid_fields"])
+
+    # output file where save all converted files
+    litR_file_path = os.path.join(settings['globals']['run_litr_dir'], "metar", "metar2litR.txt")
+    litr.write_file(litR_file_path, text)
+
+    total_time = time.time() - start_time
 
-    litR_file.close()
+    # rendimiento de la conversion (reportes por segundo)
+    logging.info("Metar convertidos a little_r: {} de {} ({:.0f} reportes/s decodificando con {} proceso(s), "
+                 "{:.0f} reportes/s en total)".format(len(records), len(lines), len(lines) / max(decode_time, 1e-6),
+                                                     workers, len(lines) / max(total_time, 1e-6)))
@@ -13,6 +13,7 @@ import os
 import subprocess
 import xmltodict
 
+from scripts_op.libs import litr
 from scripts_op.libs.utils import dms2dd
 
 
@@ -40,9 +41,44 @@ def synop2litR(settings):
 
         return synop_dict['data']['reports']['synop']
 
-    def process_station(station_info, station_synop):
+    def synop_codes2dicts(synop_codes):
+        """Convert a list of synop codes to a list of dicts (in the same order)
+        with a single metaf2xml process, the messages are sent one per line
+        through the standard input
 
-        synop_dict = synop_code2dict(" ".join(station_synop.split(" ")[1:]))
+        http://metaf2xml.sourceforge.net/
+        """
+        pipe = subprocess.run(["perl", os.path.join(settings['globals']['scripts_dir'], "libs", "synop2xml", "metaf2xml.pl"),
+                               "-o-"], input="\n".join(synop_codes).encode("utf-8"), stdout=subprocess.PIPE)
+
+        xml_code = pipe.stdout.decode("utf-8")
+
+        synop_dicts = xmltodict.parse(xml_code, force_list=("synop",))['data']['reports']['synop']
+
+        if len(synop_dicts) != len(synop_codes):
+            raise ValueError("metaf2xml returned {} reports for {} synop codes".format(len(synop_dicts), len(synop_codes)))
+
+        return synop_dicts
+
+    def synop_value(synop_dict, keys, convert=float):
+        """Value of the synop dict in the keys path converted, None if it does not
+        exist or is not valid"""
+        try:
+            value = synop_dict
+            for key in keys:
+                value = value[key]
+            return convert(value["@v"])
+        except:
+            return None
+
+    def to_pa(value):
+        return float(value) * 100
+
+    def to_kelvin(value):
+        return float(value) + 273.15
+
+    def process_station(station_info, station_synop, synop_dict):
+        """Header and data values (little_r) of a station, None if the value is missing"""
 
         #### get/set info stations
         ID = station_synop.split(" ")[3]
@@ -57,222 +93,49 @@ def synop2litR(settings):
 
         #### station header ####
 
-        valid_fields = 0
-        header_string = ""
-
-        # lat
-        header_string += str(format(lat, '.5f')).rjust(20)
-        # lon
-        header_string += str(format(lon, '.5f')).rjust(20)
-        # ID
-        header_string += str(ID).rjust(40)
-        # name
-        header_string += location[:40].rjust(40)
-        # platform
-        header_string += "FM-12 SYNOP".ljust(40)
-        # source
-        header_string += "".rjust(40)
-        # elevation
-        header_string += str(format(alt, '.5f')).rjust(20)
-        # valid fields
-        header_string += "valid_fields"
-        # errors
-        header_string += str(-888888).rjust(10)
-        # warnings
-        header_string += str(-888888).rjust(10)
-        # Sequence number
-        header_string += str("0").rjust(10)
-        # Num. duplicates
-        header_string += str(-888888).rjust(10)
-        # Is sounding?
-        header_string += str("F").rjust(10)
-        # Is bogus?
-        header_string += str("F").rjust(10)
-        # Discard?
-        header_string += str("F").rjust(10)
-        # Unix time
-        header_string += str(-888888).rjust(10)
-        # Julian day
-        header_string += str(-888888).rjust(10)
-        # Date
-        header_string += obs_date.rjust(20)
-        # Sea level pressure - SLP (Pa)
-        try:
-            header_string += str(format(float(synop_dict["SLP"]["pressure"]["@v"]) * 100, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Sea level pressure - SLP (Pa)
-        header_string += str(0).rjust(7)
-        # Ref Pressure (Pa)
-        header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Ref Pressure (Pa)
-        header_string += str(0).rjust(7)
-        # Ground Temp
-        try:
-            header_string += str(format(float(synop_dict["temperature"]["air"]["temp"]["@v"]) + 273.15, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Ground Temp
-        header_string += str(0).rjust(7)
-        # SST
-        header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC SST
-        header_string += str(0).rjust(7)
-        # SFC Pressure (Pa)
-        try:
-            header_string += str(format(float(synop_dict["stationPressure"]["pressure"]["@v"]) * 100, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC SFC Pressure (Pa)
-        header_string += str(0).rjust(7)
-        # Precip
-        try:
-            header_string += str(format(float(synop_dict["precipitation"]["precipAmount"]["@v"]), '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Precip
-        header_string += str(0).rjust(7)
-        # Daily Max T
-        header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Daily Max T
-        header_string += str(0).rjust(7)
-        # Daily Min T
-        try:
-            header_string += str(format(float(synop_dict["synop_section3"]["tempMinGround"]["temp"]["@v"]) + 273.15, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Daily Min T
-        header_string += str(0).rjust(7)
-        # Night Min T
-        try:
-            header_string += str(format(float(synop_dict["synop_section3"]["tempMinNighttime"]["temp"]["@v"]) + 273.15, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Night Min T
-        header_string += str(0).rjust(7)
-        # 3hr Pres Change
-        header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC 3hr Pres Change
-        header_string += str(0).rjust(7)
-        # 24hr Pres Change
-        header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC 24hr Pres Change
-        header_string += str(0).rjust(7)
-        # Cloud cover
-        header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Cloud cover
-        header_string += str(0).rjust(7)
-        # Ceiling
-        header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Ceiling
-        header_string += str(0).rjust(7)
-        # Precipitable water
-        #header_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Precipitable water
-        #header_string += str(0).rjust(7)
+        header = {# Sea level pressure - SLP (Pa)
+                  "slp": synop_value(synop_dict, ("SLP", "pressure"), to_pa),
+                  # Ground Temp
+                  "ground_temp": synop_value(synop_dict, ("temperature", "air", "temp"), to_kelvin),
+                  # SFC Pressure (Pa)
+                  "sfc_press": synop_value(synop_dict, ("stationPressure", "pressure"), to_pa),
+                  # Precip
+                  "precip": synop_value(synop_dict, ("precipitation", "precipAmount")),
+                  # Daily Min T
+                  "daily_min_t": synop_value(synop_dict, ("synop_section3", "tempMinGround", "temp"), to_kelvin),
+                  # Night Min T
+                  "night_min_t": synop_value(synop_dict, ("synop_section3", "tempMinNighttime", "temp"), to_kelvin)}
 
         #### station data ####
 
-        data_string = ""
-
-        # Pressure (Pa)
-        try:
-            data_string += str(format(float(synop_dict["stationPressure"]["pressure"]["@v"]) * 100, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Pressure (Pa)
-        data_string += str(0).rjust(7)
+        data = {# Pressure (Pa)
+                "press": synop_value(synop_dict, ("stationPressure", "pressure"), to_pa),
+                # Temperature (K)
+                "temp": synop_value(synop_dict, ("temperature", "air", "temp"), to_kelvin),
+                # Dew point (K)
+                "dewpt": synop_value(synop_dict, ("temperature", "dewpoint", "temp"), to_kelvin),
+                # Wind speed (m/s)
+                "speed": synop_value(synop_dict, ("sfcWind", "wind", "speed")),
+                # Wind direction (deg)
+                "dir": synop_value(synop_dict, ("sfcWind", "wind", "dir")),
+                # Relative humidity (%)
+                "rh": synop_value(synop_dict, ("temperature", "relHumid1"))}
+
+        # valid fields: values decoded in the header and in the data
+        valid_fields = sum(value is not None for value in list(header.values()) + list(data.values()))
+
+        header.update({"lat": lat, "lon": lon, "id": ID, "name": location[:40], "elevation": alt,
+                       "valid_fields": valid_fields, "date": obs_date})
         # Height (m)
-        data_string += str(format(alt, '.5f')).rjust(13)
-        # QC Height (m)
-        data_string += str(0).rjust(7)
-        # Temperature (K)
-        try:
-            data_string += str(format(float(synop_dict["temperature"]["air"]["temp"]["@v"]) + 273.15, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Temperature (K)
-        data_string += str(0).rjust(7)
-        # Dew point (K)
-        try:
-            data_string += str(format(float(synop_dict["temperature"]["dewpoint"]["temp"]["@v"]) + 273.15, '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Dew point (K)
-        data_string += str(0).rjust(7)
-        # Wind speed (m/s)
-        try:
-            data_string += str(format(float(synop_dict["sfcWind"]["wind"]["speed"]["@v"]), '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Wind speed (m/s)
-        data_string += str(0).rjust(7)
-        # Wind direction (deg)
-        try:
-            data_string += str(format(float(synop_dict["sfcWind"]["wind"]["dir"]["@v"]), '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Wind direction (deg)
-        data_string += str(0).rjust(7)
-        # Wind U (m/s)
-        data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Wind U (m/s)
-        data_string += str(0).rjust(7)
-        # Wind V (m/s)
-        data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Wind V (m/s)
-        data_string += str(0).rjust(7)
-        # Relative humidity (%)
-        try:
-            data_string += str(format(float(synop_dict["temperature"]["relHumid1"]["@v"]), '.5f')).rjust(13)
-            valid_fields += 1
-        except:
-            data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Relative humidity (%)
-        data_string += str(0).rjust(7)
-        # Thickness (m)
-        data_string += str(format(-888888, '.5f')).rjust(13)
-        # QC Thickness (m)
-        data_string += str(0).rjust(7)
-
-        # set valid_fields
-        header_string = header_string.replace("valid_fields", str(valid_fields).rjust(10))
-
-        # write to file
-        litR_file.write(header_string + '\n')
-        litR_file.write(data_string + '\n')
-
-        #### ending fields ####
-
-        litR_file.write("-777777.00000      0"*2 + str(format(1, '.5f')).rjust(13) +
-                        str(0).rjust(7) + "-888888.00000      0"*7 + '\n')
-
-        litR_file.write(str(valid_fields).rjust(7) + "      0      0" + '\n')
+        data["height"] = alt
 
-    # output file where save all converted files
-    litR_file_path = os.path.join(settings['globals']['run_litr_dir'], "synop", "synop2litR.txt")
-    if not os.path.isdir(os.path.dirname(litR_file_path)):
-        os.makedirs(os.path.dirname(litR_file_path))
-    if os.path.isfile(litR_file_path):
-        os.remove(litR_file_path)
-
-    litR_file = open(litR_file_path, "w")
+        return header, data
 
     # input synop file
     synop_file = os.path.join(settings['globals']['data'], "synop", "synops.txt")
     station_info = ""
     station_synop = ""
+    stations = []
     with open(synop_file) as infile:
         for line in infile:
             line = line.strip()
@@ -288,8 +151,34 @@ def synop2litR(settings):
             station_synop += " " + line
 
             if line.endswith("=="):
-                logging.info("Procesando estacion synop: " + ",".join(station_info[0].split(",")[1:]).strip())
-                process_station(station_info, station_synop.strip())
+                stations.append((station_info, station_synop.strip()))
                 station_synop = ""
 
-    litR_file.close()
+    # decode all synops at once
+    synop_codes = [" ".join(station_synop.split(" ")[1:]) for station_info, station_synop in stations]
+    try:
+        synop_dicts = synop_codes2dicts(synop_codes) if synop_codes else []
+    except Exception as err:
+        logging.warning("Problemas decodificando los synops en un solo proceso: " + str(err))
+        logging.warning("Decodificando cada synop por separado")
+        synop_dicts = [synop_code2dict(synop_code) for synop_code in synop_codes]
+
+    headers = []
+    data = []
+    for (station_info, station_synop), synop_dict in zip(stations, synop_dicts):
+        logging.info("Procesando estacion synop: " + ",".join(station_info[0].split(",")[1:]).strip())
+        station_header, station_data = process_station(station_info, station_synop, synop_dict)
+        headers.append(station_header)
+        data.append(station_data)
+
+    # little_r de todas las estaciones por columnas (los valores faltantes a MISSING)
+    text = ""
+    if headers:
+        header = {key: [litr.MISSING if h[key] is None else h[key] for h in headers] for key in headers[0]}
+        header["platform"] = "FM-12 SYNOP"
+        data = {key: [litr.MISSING if d[key] is None else d[key] for d in data] for key in data[0]}
+        text = litr.format_records(header, data)
+
+    # output file where save all converted files
+    litR_file_path = os.path.join(settings['globals']['run_litr_dir'], "synop", "synop2litR.txt")
+    litr.write_file(litR_file_path, text)
@@ -32,16 +32,24 @@ Escribir el archivo obs_radar.txt con las observaciones de reflectividad y veloc
 de los radares de la lista IRIS_fn dentro de la fecha [<datetime>-<timedelta>, <datetime>+<timedelta>]
 '''
 
+import hashlib
 import logging 
 import matplotlib.pyplot as plt
+import multiprocessing as mp
 import numpy as np
 import os
 import wradlib as wrl
 
+from contextlib import nullcontext
 from datetime import datetime, timedelta
+from functools import partial
 from mpl_toolkits import mplot3d
+from multiprocessing.pool import ThreadPool
 from pprint import pprint
 
+# decimales (en grados) de los ángulos usados en el hash de la geometría de barrido (ver calc_geometry_hash)
+GEOMETRY_DECIMALS = 2
+
 def list_dir_dat(dir_path, start_date, end_date):
     ''' Listar los archivos .RAW de un directorio entre la fecha start_date y end_date. 
 
@@ -148,11 +156,12 @@ def calc_sph_3D(radar_dict, var='DB_DBZ'):
 
     return radii, theta, phi
 
-def calc_cart_coordinates(radar_dict, var='DB_DBZ'):
+def calc_cart_coordinates(radar_dict, var='DB_DBZ', decimals=None):
     ''' Calcular las coordenadas cartesianas espaciales de la variable var de todas las barridas.
 
     Input:  var = 'DB_DBZ' o 'DB_VEL' 
             radar_dict = diccionario decodificado de IRIS_fn (ver IRIS_decode)
+            decimals = decimales de los ángulos theta y phi, None para no redondear (int, ver calc_geometry)
 
     Output: lonlatalt[..., 0], lonlatalt[..., 1], lonlatalt[..., 2], respectivamente: londitud, latitud y altura en metros.
     '''
@@ -170,12 +179,83 @@ def calc_cart_coordinates(radar_dict, var='DB_DBZ'):
     site = (lon, lat, site_height + radar_height)
     #extraer y calcular variables esféricas espaciales con unidades físicas
     _radii, _theta, _phi = calc_sph_3D(radar_dict, var)
+    if decimals is not None:
+        _theta, _phi = np.round(_theta, decimals), np.round(_phi, decimals)
     #crear meshgrid de puntos en esféricas
     radii, theta, phi = np.meshgrid(_radii, _theta, _phi, indexing='ij')
     #transformar coordenadas usando georef
     lonlatalt = wrl.georef.spherical_to_proj(radii, theta, phi, site)
     return lonlatalt[..., 0], lonlatalt[..., 1], lonlatalt[..., 2]
 
+def calc_geometry_hash(radar_dict, var='DB_DBZ'):
+    ''' Calcular el hash de la geometría de barrido: sitio del radar, bins en rango, azimuts y elevaciones.
+        Los ángulos se redondean a GEOMETRY_DECIMALS para que barridos repetidos de la misma tarea coincidan.
+
+    Input:  radar_dict = diccionario decodificado de IRIS_fn (ver IRIS_decode)
+            var = 'DB_DBZ' o 'DB_VEL'
+
+    Output: hash hexadecimal (str)
+    '''
+    ingest = radar_dict['ingest_header']['ingest_configuration']
+    site = (ingest['longitude_radar'], ingest['latitude_radar'], ingest['height_site'] + ingest['height_radar'])
+    radii, theta, phi = calc_sph_3D(radar_dict, var)
+
+    #el sitio y los bins en rango son fijos por configuración, los ángulos varían levemente entre barridos
+    sha = hashlib.sha1()
+    #la geometría del cache se calcula con los ángulos redondeados (ver calc_geometry)
+    sha.update(('decimals=%d' % GEOMETRY_DECIMALS).encode())
+    for values in (site, radii, np.round(theta, GEOMETRY_DECIMALS), np.round(phi, GEOMETRY_DECIMALS)):
+        values = np.asarray(values, dtype=np.float64)
+        sha.update(str(values.shape).encode())
+        sha.update(values.tobytes())
+    return sha.hexdigest()[:16]
+
+def calc_geometry(radar_dict, site_name, cache_dir=None, var='DB_DBZ'):
+    ''' Calcular las coordenadas lon, lat, alt y la asignación punto-celda de la rejilla 9kmx9km,
+        leyéndolas del cache en disco cache_dir si ya existen para el sitio y la geometría de barrido.
+        Con cache se calculan con los ángulos redondeados de la llave (ver calc_geometry_hash), así
+        el resultado es el mismo si se lee del cache o si se calcula.
+
+    Input:  radar_dict = diccionario decodificado de IRIS_fn (ver IRIS_decode)
+            site_name = nombre del radar, p.ej. COR, BAR, SAN (str)
+            cache_dir = carpeta del cache de geometría, None o '' para no usar cache (str)
+            var = 'DB_DBZ' o 'DB_VEL'
+
+    Output: lon, lat, alt (ver calc_cart_coordinates) y grid (ver calc_grid_index)
+    '''
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, '%s_%s.npz' % (site_name, calc_geometry_hash(radar_dict, var)))
+        if os.path.isfile(cache_file):
+            try:
+                with np.load(cache_file) as cache:
+                    lon, lat, alt = cache['lon'], cache['lat'], cache['alt']
+                    grid = (cache['new_lon'], cache['new_lat'], cache['cell'])
+                logging.info('Geometría leída del cache %s' % cache_file)
+                return lon, lat, alt, grid
+            except Exception as e:
+                logging.warning('Imposible leer el cache de geometría %s' % cache_file)
+                logging.warning(e)
+
+    lon, lat, alt = calc_cart_coordinates(radar_dict, var=var, decimals=GEOMETRY_DECIMALS if cache_dir else None)
+    grid = calc_grid_index(lon, lat)
+
+    if cache_dir:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, exist_ok=True)
+            # escribir en un temporal y renombrar para que otros procesos nunca lean un cache incompleto
+            tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, lon=lon, lat=lat, alt=alt, new_lon=grid[0], new_lat=grid[1],
+                         cell=grid[2].astype(np.int32))
+            os.replace(tmp_file, cache_file)
+            logging.info('Geometría guardada en el cache %s' % cache_file)
+        except Exception as e:
+            logging.warning('Imposible guardar el cache de geometría %s' % cache_file)
+            logging.warning(e)
+
+    return lon, lat, alt, grid
+
 def calc_err_DBZ(DBZ, i, j, k):
     ''' Calcular el error de la variable DBZ en el punto i, j, k
         basado en la desviación estándar de una rejilla 3x3 sobre el plano i, j.
@@ -216,34 +296,102 @@ def calc_err_VEL(VEL, i, j, k):
     '''
 
     return np.abs(VEL[i, j, k])/10.0
+
+def calc_err_DBZ_3D(DBZ_3D):
+    ''' Calcular el error de DBZ_3D en todos los puntos a la vez, igual a calc_err_DBZ punto a punto:
+        desviación estándar de la rejilla 3x3 sobre el plano i, j (los vecinos i-1, j-1 se toman con
+        índice negativo como en calc_err_DBZ y los vecinos i+1, j+1 se omiten en el último índice).
+        Las sumas se hacen en el mismo orden que np.std sobre la lista de calc_err_DBZ para obtener
+        exactamente los mismos valores.
+
+    Input:  DBZ_3D = arreglo tridimensional de reflectividades MaskedArray (ver interp_data)
+
+    Output: arreglo tridimensional con la desviación estándar de cada punto (nan si no hay datos válidos)
+    '''
+    data = np.ma.getdata(DBZ_3D)
+    valid = ~np.ma.getmaskarray(DBZ_3D)
+
+    def shift(a, di, dj):
+        #a[i+di, j+dj, k] con el índice -1 circular como en calc_err_DBZ
+        return np.roll(np.roll(a, -di, axis=0), -dj, axis=1)
+
+    #vecinos en el orden de calc_err_DBZ
+    offsets = [(0, 0), (0, -1), (-1, -1), (-1, 0), (1, -1), (1, 0), (0, 1), (-1, 1), (1, 1)]
+    vals = [np.where(shift(valid, di, dj), shift(data, di, dj), 0.0) for di, dj in offsets]
+    oks = [shift(valid, di, dj) for di, dj in offsets]
+
+    #vecinos i+1 y j+1 existen solo si i < nx-1 y j < ny-1
+    nx, ny = data.shape[0], data.shape[1]
+    has_i = (np.arange(nx) < nx - 1)[:, np.newaxis, np.newaxis]
+    has_j = (np.arange(ny) < ny - 1)[np.newaxis, :, np.newaxis]
+
+    def ordered_sum(x):
+        #mismo orden de suma que np.add.reduce sobre la lista (pairwise para 9 elementos)
+        s4 = ((x[0] + x[1]) + x[2]) + x[3]
+        s_i = (s4 + x[4]) + x[5]
+        s_j = (s4 + x[6]) + x[7]
+        s_ij = (((x[0] + x[1]) + (x[2] + x[3])) + ((x[4] + x[5]) + (x[6] + x[7]))) + x[8]
+        return np.where(has_i & has_j, s_ij, np.where(has_i, s_i, np.where(has_j, s_j, s4)))
+
+    count = ordered_sum([ok.astype(np.int64) for ok in oks])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = ordered_sum(vals) * 1. / count
+        danom = [np.where(ok, v - mean, 0.0) for v, ok in zip(vals, oks)]
+        return np.sqrt(ordered_sum([d * d for d in danom]) / count)
+
+def calc_err_VEL_3D(VEL_3D):
+    ''' Calcular el error de VEL_3D en todos los puntos a la vez (ver calc_err_VEL).
+
+    Input:  VEL_3D = arreglo tridimensional de velocidades radiales MaskedArray (ver interp_data)
+
+    Output: arreglo tridimensional np.abs(VEL_3D)/10.0
+    '''
+
+    return np.abs(np.ma.getdata(VEL_3D))/10.0
     
-def clean_data_3D(radar_dict):
+def clean_data_3D(radar_dict, threads=1):
     ''' limpiar las variables reflectividad y velocidad radial filtrada usando Gabella e interpolada para todos los barridos.
-        Usando recursivamente clean_data.
+        Usando recursivamente clean_data, cada barrida se escribe en su lugar en los arreglos (r, theta, phi)
+        reservados desde el inicio con number_sweeps_completed.
 
     Input:  radar_dict = diccionario decodificado de IRIS_fn (ver IRIS_decode)
+            threads = hilos para filtrar las barridas de DBZ y VEL en paralelo (int, 1 = secuencial)
 
     Output: MaskedArray DBZ_3D y VEL_3D con forma (radios, theta, phi)
     '''
     
     max_sweep =  radar_dict['ingest_header']['ingest_configuration']['number_sweeps_completed']
-    for sw in np.arange(1, max_sweep + 1):
-        #leer datos filtrados e interpolados de todas las barridas
-        DBZ = clean_data(radar_dict, var='DB_DBZ', sweep=sw)
-        VEL = clean_data(radar_dict, var='DB_VEL', sweep=sw)
-        #transponer de (theta, r) a (r, theta) para luego hacer (r, theta, phi)
-        DBZ = DBZ.transpose()
-        VEL = VEL.transpose()
-        #incrementar dimension del arreglo
-        T1 = DBZ[..., np.newaxis]
-        T2 = VEL[..., np.newaxis]
-        #añadir los archivos de datos de esta barrida al masked numpy array (r, theta, phi)
-        if sw == 1:
-            DBZ_3D = T1
-            VEL_3D = T2
+    #forma (theta, r) de las barridas, se asume igual para todas
+    n_theta, n_r = np.shape(radar_dict['data'][1]['sweep_data']['DB_DBZ']['data'])
+
+    #reservar los arreglos (r, theta, phi) completos
+    DBZ_data = np.empty((n_r, n_theta, max_sweep))
+    DBZ_mask = np.zeros((n_r, n_theta, max_sweep), dtype=bool)
+    VEL_data = np.empty((n_r, n_theta, max_sweep))
+
+    def clean_sweep(task):
+        var, sw = task
+        #leer datos filtrados e interpolados de la barrida sw
+        data = clean_data(radar_dict, var=var, sweep=sw)
+        #transponer de (theta, r) a (r, theta) y copiar en la posición phi de la barrida
+        if var == 'DB_DBZ':
+            DBZ_data[..., sw - 1] = np.ma.getdata(data).transpose()
+            DBZ_mask[..., sw - 1] = np.ma.getmaskarray(data).transpose()
         else:
-            DBZ_3D = np.ma.concatenate([DBZ_3D, T1], axis=2) # el eje 2 es la tercera dimensión
-            VEL_3D = np.ma.concatenate([VEL_3D, T2], axis=2) # el eje 2 es la tercera dimensión
+            VEL_data[..., sw - 1] = np.asarray(data).transpose()
+
+    tasks = [(var, sw) for sw in range(1, max_sweep + 1) for var in ('DB_DBZ', 'DB_VEL')]
+    threads = max(1, min(int(threads), len(tasks)))
+    if threads > 1:
+        #el filtro de Gabella y la interpolación de wradlib/numpy liberan el GIL
+        with ThreadPool(processes=threads) as pool:
+            pool.map(clean_sweep, tasks)
+    else:
+        for task in tasks:
+            clean_sweep(task)
+
+    DBZ_3D = np.ma.array(DBZ_data, mask=DBZ_mask, copy=False)
+    VEL_3D = np.ma.array(VEL_data, copy=False)
     return DBZ_3D, VEL_3D
 
 def count_total_data(DBZ_3D, VEL_3D):
@@ -255,18 +403,29 @@ def count_total_data(DBZ_3D, VEL_3D):
 
     Output: num_reg_tot, el número total de datos posibles para asimilación
     '''
-    
-    num_reg_tot = 0
-    #for k in range(0, 2):
-    for i in np.arange(0, DBZ_3D.shape[0]):
-        #si el dato [i, j, k] en la mask es valido (mask = False) entonces cuéntelo
-        for j in np.arange(0, DBZ_3D.shape[1]): 
-            #contar los puntos i,j que tengan algún nivel k válido
-            if count_levels(DBZ_3D, VEL_3D, i, j) > 0:
-                num_reg_tot += 1
-                   
-    return num_reg_tot
 
+    #contar los puntos i,j que tengan algún nivel k válido
+    return int(np.count_nonzero(count_levels_3D(DBZ_3D, VEL_3D) > 0))
+
+def count_levels_3D(DBZ_3D, VEL_3D):
+    ''' Contar el número de niveles validos de DBZ_3D y VEL_3D para todos los puntos i, j (ver count_levels).
+
+    Input:  DBZ_3D = np.ma.MaskedArray de reflectividades creado por interp_data
+            VEL_3D = np.ma.MaskedArray de velocidades radiales creado por interp_data
+
+    Output: arreglo bidimensional con el número de niveles válidos de cada punto i, j
+    '''
+    return np.count_nonzero(valid_data_3D(DBZ_3D, VEL_3D), axis=2)
+
+def valid_data_3D(DBZ_3D, VEL_3D):
+    ''' Máscara de datos válidos tanto en DBZ_3D como en VEL_3D.
+
+    Input:  DBZ_3D = np.ma.MaskedArray de reflectividades creado por interp_data
+            VEL_3D = np.ma.MaskedArray de velocidades radiales creado por interp_data
+
+    Output: arreglo booleano tridimensional, True si el dato i, j, k es válido
+    '''
+    return ~(np.ma.getmaskarray(DBZ_3D) | np.ma.getmaskarray(VEL_3D))
 
 def count_levels(DBZ_3D, VEL_3D, i, j):
     ''' Contar el número de niveles validos de DBZ_3D y VEL_3D para el punto i ,j.
@@ -374,30 +533,168 @@ def write_data_xy(outfile, date, elv0, lat, lon, elv, rf_data, rv_data, out_dir=
     '''
 
     fmt = '%12s%3s%19s%2s%12.3f%2s%12.3f%2s%8.1f%2s%6i' #(a12,3x,a19,2x,2(f12.3,2x),f8.1,2x,i6)
+    fmt_line = '%3s%12.1f%12.3f%4i%12.3f%2s%12.3f%4i%12.3f%2s' #(3x,f12.1,2(f12.3,i4,f12.3,2x)), ver write_obs_line
     h_sp = ''
     #pasar fecha a string con formato 
     date_s = date.strftime('%Y-%m-%d_%X')
+
+    #datos válidos tanto en DBZ como en VEL y elevaciones válidas por punto horizontal
+    valid = valid_data_3D(rf_data, rv_data)
+    levs = np.count_nonzero(valid, axis=2)
+    #puntos i, j y datos i, j, k válidos en el mismo orden de los ciclos sobre i, j, k
+    ii, jj = np.nonzero(levs > 0)
+    vi, vj, vk = np.nonzero(valid)
+
+    #errores de reflectividad (3x3) y de velocidad radial de todos los datos válidos
+    rf_err = calc_err_DBZ_3D(rf_data)[vi, vj, vk]
+    rv_err = calc_err_VEL_3D(rv_data)[vi, vj, vk]
+
+    #líneas comunes de cada punto xy con datos válidos
+    headers = [fmt % ('FM-128 RADAR', h_sp, date_s, h_sp, y, h_sp, x, h_sp, int(elv0), h_sp, n) + '\n'
+               for y, x, n in zip(np.asarray(lat, dtype=float)[ii, jj].tolist(),
+                                  np.asarray(lon, dtype=float)[ii, jj].tolist(), levs[ii, jj].tolist())]
+    #líneas de medición a cada elevación válida
+    lines = [fmt_line % (h_sp, e, v, 0, ve, h_sp, r, 0, re, h_sp) + '\n'
+             for e, v, ve, r, re in zip(np.ma.getdata(elv)[vi, vj, vk].tolist(),
+                                        np.ma.getdata(rv_data)[vi, vj, vk].tolist(), rv_err.tolist(),
+                                        np.ma.getdata(rf_data)[vi, vj, vk].tolist(), rf_err.tolist())]
+
+    #intercalar cada línea común con sus líneas de medición y escribir el bloque de una sola vez
+    block = []
+    end = np.cumsum(levs[ii, jj]).tolist()
+    start = 0
+    for header, stop in zip(headers, end):
+        block.append(header)
+        block.extend(lines[start:stop])
+        start = stop
     with open(out_dir + outfile, mode='a', encoding='ascii') as f:
-        # ciclo sobre puntos horizontales
-        for i in np.arange(0, rf_data.shape[0]):
-            for j in np.arange(0, rf_data.shape[1]):
-                #contar elevaciones válidas
-                levs = count_levels(rf_data, rv_data, i, j)
-                if levs > 0:    
-                    #escribir en archivo si hay un dato válido tanto en DBZ como en VEL
-                    f.write(fmt % ('FM-128 RADAR', h_sp, date_s, h_sp, float(lat[i, j]), h_sp, float(lon[i, j]), h_sp, int(elv0), h_sp, int(levs)))
-                    f.write('\n')
-                    # ciclo sobre elevaciones verticales
-                    for k in np.arange(0, rf_data.shape[2]): 
-                        #si el punto i,j,k tiene datos numéricos válidos tanto en DBZ como en VEL
-                        if rf_data[i, j, k] is not np.ma.masked and rv_data[i, j, k] is not np.ma.masked:
-                            # Escribir línea de medición a una elevación dada
-                            write_obs_line(f, elv[i,j,k], rf_data[i,j,k], 0, calc_err_DBZ(rf_data,i,j,k), rv_data[i,j,k], 0, calc_err_VEL(rv_data,i,j,k), h_sp=h_sp)
+        f.write(''.join(block))
     return
 
-def interp_data(lon, lat, alt, DBZ_3D, VEL_3D):
+def calc_grid_index(lon, lat):
+    ''' Calcular la rejilla destino de 9kmx9km y el índice de celda destino de cada punto (gate) de lon, lat
+
+    Input: lon = arreglo tridimensional de longitudes (ver calc_cart_coordinates)
+           lat = arreglo tridimensional de latitudes (ver calc_cart_coordinates)
+
+    Output: arreglos de longitud y latitud de la rejilla destino (bidimensionales) y
+            arreglo tridimensional con el índice plano ix*ny + iy de la celda destino de cada punto,
+            -1 para los puntos por fuera de la rejilla
+    '''
+    #promediar la longitud y la latitud sobre el eje z
+    lon_mean = np.mean(lon, axis=2) #el eje 2 es la tercera dimensión
+    lat_mean = np.mean(lat, axis=2) #el eje 2 es la tercera dimensión
+
+    #conversion 
+    #1 grado de latitud son 111,325 Kilometros
+    #1 grado de longitud depende de la latitud = coseno(latitud, en radianes) * 111,325 Kilometros
+
+    #leer longitud mínima, longitud máxima en grados
+    lon_min = np.amin(lon_mean)
+    lon_max = np.amax(lon_mean)
+    #leer latitud mínima, latitud máxima en grados
+    lat_min = np.amin(lat_mean)
+    lat_max = np.amax(lat_mean)
+
+    #9km en longitud son en grados
+    km_lon = 9.0/111.325/np.cos(np.radians(lat_min+lat_max)/2.0)
+    #9km latitud son en grados 
+    km_lat = 9.0/111.325 
+
+    #crear arreglo rectangular destino
+    lon_int = np.arange(lon_min, lon_max, km_lon) 
+    lat_int = np.arange(lat_min, lat_max, km_lat)
+    nx = len(lon_int) - 1
+    ny = len(lat_int) - 1
+
+    #crear plano resultado de longitud y latitud (centro de cada celda)
+    new_lon = np.repeat(((lon_int[:-1] + lon_int[1:])/2.0)[:, np.newaxis], ny, axis=1)
+    new_lat = np.repeat(((lat_int[:-1] + lat_int[1:])/2.0)[np.newaxis, :], nx, axis=0)
+
+    #asignar cada punto a su celda: lon_int[ix] <= lon < lon_int[ix+1] y lat_int[iy] <= lat < lat_int[iy+1]
+    ix = np.digitize(lon, lon_int) - 1
+    iy = np.digitize(lat, lat_int) - 1
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    cell = np.where(inside, ix*ny + iy, -1)
+
+    return new_lon, new_lat, cell
+
+def bin_mean(cell, ncell, data, mask=None):
+    ''' Promediar los valores data no enmascarados que caen en cada celda destino
+
+    Input: cell = arreglo de índices de celda destino, -1 fuera de la rejilla (ver calc_grid_index)
+           ncell = # total de celdas de la rejilla destino (int)
+           data = arreglo de datos con la misma forma de cell
+           mask = arreglo booleano de datos inválidos o None
+
+    Output: arreglos (ncell,) con la cantidad de datos y el promedio por celda (nan si no hay datos)
+    '''
+    valid = cell >= 0
+    if mask is not None:
+        valid &= ~mask
+    count = np.bincount(cell[valid], minlength=ncell)
+    total = np.bincount(cell[valid], weights=data[valid], minlength=ncell)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total/count
+    return count, mean
+
+def interp_data(lon, lat, alt, DBZ_3D, VEL_3D, grid=None):
     ''' Interpolar la longitud, latitud, altura, reflectividad y velocidad radial a la resolución del modelo 9kmx9km
 
+    Cada punto se asigna una sola vez a su celda destino (ver calc_grid_index) y los promedios
+    enmascarados de alt, DBZ y VEL se calculan con np.bincount en una sola pasada por nivel.
+
+    Input: lon = arreglo tridimensional de longitudes (ver calc_cart_coordinates)
+           lat = arreglo tridimensional de latitudes (ver calc_cart_coordinates)
+           alt = arreglo tridimensional de alturas (ver calc_cart_coordinates)
+           DBZ_3D = arreglo tridimensional de reflectividades (ver clean_data_3D)
+           VEL_3D = arreglo tridimensional de velocidades radiales (ver clean_data_3D)
+           grid = resultado precalculado de calc_grid_index(lon, lat) o None
+
+    Output: arreglos interpolados de longitud y latitud (bidimensionales) y 
+            arreglos interpolados de alturas, reflectividades y velocidades radiales (tridimensionales)
+    '''
+    if grid is None:
+        grid = calc_grid_index(lon, lat)
+    new_lon, new_lat, cell = grid
+    nx, ny = new_lon.shape
+    ncell = nx*ny
+
+    DBZ_mask = np.ma.getmaskarray(DBZ_3D)
+    VEL_mask = np.ma.getmaskarray(VEL_3D)
+    DBZ_data = np.ma.getdata(DBZ_3D)
+    VEL_data = np.ma.getdata(VEL_3D)
+
+    #crear arreglos de destino de alturas, reflectividades y velocidades radiales
+    new_alt = np.zeros((nx, ny, alt.shape[2]))
+    new_DBZ = np.zeros((nx, ny, DBZ_3D.shape[2]))
+    new_VEL = np.zeros((nx, ny, VEL_3D.shape[2]))
+    #ciclo sobre elevaciones
+    for k in np.arange(0, alt.shape[2]):
+        cell_k = cell[..., k]
+        # promediar parche de alturas, reflectividades y velocidades radiales
+        n_alt, alt_k = bin_mean(cell_k, ncell, alt[..., k])
+        n_DBZ, DBZ_k = bin_mean(cell_k, ncell, DBZ_data[..., k], DBZ_mask[..., k])
+        n_VEL, VEL_k = bin_mean(cell_k, ncell, VEL_data[..., k], VEL_mask[..., k])
+
+        #condicional sobre celdas con datos válidos tanto en DBZ como en VEL, fillvalue en otro caso
+        valid = (n_alt > 0) & (n_DBZ > 0) & (n_VEL > 0)
+        new_alt[..., k] = np.where(valid, alt_k, 999999).reshape(nx, ny)
+        new_DBZ[..., k] = np.where(valid, DBZ_k, 999999).reshape(nx, ny)
+        new_VEL[..., k] = np.where(valid, VEL_k, 999999).reshape(nx, ny)
+
+    #Transformar a masked array
+    new_alt = np.ma.masked_equal(new_alt, 999999)
+    new_DBZ = np.ma.masked_equal(new_DBZ, 999999)
+    new_VEL = np.ma.masked_equal(new_VEL, 999999)
+
+    return new_lon, new_lat, new_alt, new_DBZ, new_VEL
+
+def interp_data_loop(lon, lat, alt, DBZ_3D, VEL_3D):
+    ''' (developer) implementación original por ciclos de interp_data, usada como referencia en benchmark_interp_data.
+
+    Interpolar la longitud, latitud, altura, reflectividad y velocidad radial a la resolución del modelo 9kmx9km
+
     Input: lon = arreglo tridimensional de longitudes (ver calc_cart_coordinates)
            lat = arreglo tridimensional de latitudes (ver calc_cart_coordinates)
            alt = arreglo tridimensional de alturas (ver calc_cart_coordinates)
@@ -519,6 +816,60 @@ def interp_data(lon, lat, alt, DBZ_3D, VEL_3D):
             
     return new_lon, new_lat, new_alt, new_DBZ, new_VEL
 
+def synthetic_volume(nr=664, naz=360, nel=10, seed=0):
+    ''' (developer) Crear un volumen de radar sintético (r, theta, phi) en coordenadas lon, lat, alt
+        con reflectividades y velocidades radiales enmascaradas, para pruebas y benchmarks.
+
+    Input:  nr = # de bins en rango (int)
+            naz = # de azimuts (int)
+            nel = # de elevaciones (int)
+            seed = semilla del generador aleatorio (int)
+
+    Output: arreglos lon, lat, alt, DBZ_3D y VEL_3D con forma (nr, naz, nel)
+    '''
+    rng = np.random.default_rng(seed)
+    radii = np.arange(nr)*375.0 + 187.5
+    theta = np.radians(np.arange(naz) + 0.5)
+    phi = np.radians(np.linspace(0.5, 15.0, nel))
+    r, t, p = np.meshgrid(radii, theta, phi, indexing='ij')
+    lon = -74.0 + r*np.cos(p)*np.sin(t)/111325.0/np.cos(np.radians(4.7))
+    lat = 4.7 + r*np.cos(p)*np.cos(t)/111325.0
+    alt = 2600.0 + r*np.sin(p)
+    DBZ_3D = np.ma.masked_less(rng.normal(10.0, 15.0, r.shape), 0.0)
+    VEL_3D = np.ma.array(rng.normal(0.0, 8.0, r.shape), mask=rng.random(r.shape) < 0.3)
+    return lon, lat, alt, DBZ_3D, VEL_3D
+
+def benchmark_interp_data(lon=None, lat=None, alt=None, DBZ_3D=None, VEL_3D=None, repeat=1):
+    ''' (developer) Comparar tiempos y resultados de interp_data contra la implementación por ciclos interp_data_loop.
+
+    Input:  lon, lat, alt, DBZ_3D, VEL_3D = arreglos de entrada de interp_data, si son None
+            se usa un volumen sintético (ver synthetic_volume)
+            repeat = # de repeticiones de la versión vectorizada (int)
+
+    Output: diccionario con los tiempos en segundos de cada implementación y si los resultados coinciden
+    '''
+    from time import perf_counter
+
+    if lon is None:
+        lon, lat, alt, DBZ_3D, VEL_3D = synthetic_volume()
+
+    t0 = perf_counter()
+    ref = interp_data_loop(lon, lat, alt, DBZ_3D, VEL_3D)
+    t_loop = perf_counter() - t0
+
+    t0 = perf_counter()
+    for _ in range(repeat):
+        new = interp_data(lon, lat, alt, DBZ_3D, VEL_3D)
+    t_vect = (perf_counter() - t0)/repeat
+
+    equal = all(np.array_equal(np.ma.getmaskarray(a), np.ma.getmaskarray(b)) and
+                np.allclose(np.ma.filled(a, 0), np.ma.filled(b, 0), rtol=1e-12, atol=0, equal_nan=True)
+                for a, b in zip(ref, new))
+
+    logging.info('interp_data: ciclos %.3f s, vectorizado %.3f s (x%.1f), resultados iguales: %s'
+                 % (t_loop, t_vect, t_loop/t_vect, equal))
+    return {'loop': t_loop, 'vectorized': t_vect, 'equal': equal}
+
 def plot_xyz(lon, lat, alt):
     #(developer) funcion para graficar el cono de datos geoespaciales de diversos niveles k
     '''
@@ -571,6 +922,91 @@ def plot_xyz(lon, lat, alt):
     return   
 
 
+def process_radar_file(IRIS_fn, RAW_dir='./', cache_dir=None, filter_threads=1):
+    ''' Decodificar, limpiar, proyectar e interpolar a la rejilla 9kmx9km el archivo IRIS_fn.
+        No escribe en el archivo de salida, puede ejecutarse en un proceso aparte (ver radar2txt).
+
+    Input:  IRIS_fn = nombre del archivo IRIS a procesar (str)
+            RAW_dir = carpeta del archivo IRIS (str)
+            cache_dir = carpeta del cache de geometría, None o '' para no usar cache (str)
+            filter_threads = hilos para filtrar las barridas de DBZ y VEL (int, ver clean_data_3D)
+
+    Output: diccionario con los datos del header del radar y los arreglos interpolados
+            (ver write_radar), o None si el archivo no pudo procesarse
+    '''
+
+    #seleccionar un solo archivo de radar
+    logging.info('Procesando archivo %s' % IRIS_fn)
+
+    #leer diccionario de un archivo RAW
+    try:
+        radar_dict = IRIS_decode(IRIS_fn, IRIS_dir=RAW_dir)
+    except Exception as e: 
+        logging.warning('Imposible decodificar %s' % IRIS_fn)
+        logging.warning(e)
+        return
+
+    #leer reflectividad y velocidad radial filtrada e interpolada para todas las barridas
+    try:
+        logging.info('Limpiando y filtrando (clutter) archivo %s' % IRIS_fn)
+        DBZ_3D, VEL_3D = clean_data_3D(radar_dict, threads=filter_threads)
+    except Exception as e: 
+        logging.warning('Imposible limpiar datos %s' % IRIS_fn)
+        logging.warning(e)
+        return
+
+    #transformar coordenadas esféricas a coordenadas cartesianas ubicadas en el sitio del radar
+    #(o leerlas del cache de geometría si el sitio ya barrió con la misma geometría)
+    try:
+        logging.info('Proyectando a las coordenadas del radar %s' % IRIS_fn)
+        lon, lat, alt, grid = calc_geometry(radar_dict, IRIS_fn[:3], cache_dir=cache_dir, var='DB_DBZ')
+    except Exception as e: 
+        logging.warning('Imposible proyectar coordenadas %s' % IRIS_fn)
+        logging.warning(e)
+        return
+
+    #plot_xyz(lon, lat, alt)
+
+    #Interpolar los arreglos lon, lat, alt, DBZ_3D y VEL_3D a una rejilla 9kmx9km 
+    try:
+        logging.info('Interpolando a la resolución del modelo %s' % IRIS_fn)
+        new_lon, new_lat, alt_3D, new_DBZ_3D, new_VEL_3D = interp_data(lon, lat, alt, DBZ_3D, VEL_3D, grid=grid)
+    except Exception as e: 
+        logging.warning('Imposible interpolar %s' % IRIS_fn)
+        logging.warning(e)
+        return
+
+    # extraer de diccionario las variables de interés para el header
+    site_height = radar_dict['ingest_header']['ingest_configuration']['height_site'] #en metros
+    radar_height = radar_dict['ingest_header']['ingest_configuration']['height_radar'] #en metros
+
+    return {'site_name': IRIS_fn[:3],
+            'lat_rad': radar_dict['ingest_header']['ingest_configuration']['latitude_radar'],
+            'lon_rad': radar_dict['ingest_header']['ingest_configuration']['longitude_radar'],
+            'elv_rad': site_height + radar_height,
+            'file_time': radar_dict['product_hdr']['product_configuration']['sweep_ingest_time'],
+            'lon': new_lon, 'lat': new_lat, 'alt': alt_3D, 'DBZ': new_DBZ_3D, 'VEL': new_VEL_3D}
+
+def write_radar(outfile, radar, out_dir='./'):
+    ''' Escribir el header y los datos de un radar procesado por process_radar_file en el archivo outfile
+
+    Input:  outfile = nombre del archivo de salida (str)
+            radar = diccionario resultado de process_radar_file
+            out_dir = carpeta de destino de archivo de salida txt (str)
+
+    Output: header y datos del radar en el archivo outfile
+    '''
+    #contar número total de registros válidos
+    num_reg_tot = count_total_data(radar['DBZ'], radar['VEL'])
+
+    #escribir header, el cual cambia según el radar
+    write_header(outfile, radar['site_name'], radar['lon_rad'], radar['lat_rad'], radar['elv_rad'],
+                 radar['file_time'], num_reg_tot, radar['DBZ'].shape[2], out_dir=out_dir)
+
+    #escribir datos para el plano xy y las alturas válidas
+    write_data_xy(outfile, radar['file_time'], radar['elv_rad'], radar['lat'], radar['lon'],
+                  radar['alt'], radar['DBZ'], radar['VEL'], out_dir=out_dir)
+
 def radar2txt(settings): 
     
     logging.info('#### Descargando los datos de radar RAW') 
@@ -596,8 +1032,17 @@ def radar2txt(settings):
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir)
 
-    #listar archivos RAW 
-    IRIS_fn = list_dir_dat(RAW_dir, start_date, end_date)
+    #cache de la geometría de barrido por radar (vacío para deshabilitar)
+    cache_dir = settings['assim'].get('radar_geometry_cache', '')
+
+    #procesos en paralelo para decodificar, limpiar e interpolar (1 = secuencial)
+    workers = int(settings['assim'].get('radar_workers', 1))
+
+    #hilos por archivo para filtrar las barridas de DBZ y VEL (1 = secuencial)
+    filter_threads = int(settings['assim'].get('radar_filter_threads', 1))
+
+    #listar archivos RAW, ordenados para que la salida sea determinística
+    IRIS_fn = sorted(list_dir_dat(RAW_dir, start_date, end_date))
     
     #verificar cantidad de archivos a leer
     if len(IRIS_fn) > 0:
@@ -610,77 +1055,27 @@ def radar2txt(settings):
         logging.warning('No hay archivos RAW para traducir en el intervalo %s, %s en el directorio %s' %(start_date, end_date, RAW_dir))
         return
 
+    process_file = partial(process_radar_file, RAW_dir=RAW_dir, cache_dir=cache_dir, filter_threads=filter_threads)
+    workers = max(1, min(workers, len(IRIS_fn)))
+
     #contador para archivos fallidos
     failed_files = 0
-    #por cada archivo de radar válido (ciclo sobre radares)
-    for fn in np.arange(0,len(IRIS_fn)):
-
-        #seleccionar un solo archivo de radar
-        logging.info('Procesando archivo %s' % IRIS_fn[fn])
-
-        #leer diccionario de un archivo RAW
-        try:
-            radar_dict = IRIS_decode(IRIS_fn[fn], IRIS_dir=RAW_dir)
-        except Exception as e: 
-            logging.warning('Imposible decodificar %s' % IRIS_fn[fn])
-            logging.warning(e)
-            failed_files += 1
-            continue
+    #por cada archivo de radar válido (ciclo sobre radares), en paralelo si workers > 1,
+    #imap entrega los resultados en el orden de IRIS_fn y un solo escritor los agrega a obs_radar.txt
+    with (mp.Pool(processes=workers) if workers > 1 else nullcontext()) as pool:
+        logging.info('Procesando %s archivos RAW con %s proceso(s)' % (len(IRIS_fn), workers))
+        radars = pool.imap(process_file, IRIS_fn) if pool else map(process_file, IRIS_fn)
 
-        #leer reflectividad y velocidad radial filtrada e interpolada para todas las barridas
-        try:
-            logging.info('Limpiando y filtrando (clutter) archivo %s' % IRIS_fn[fn])
-            DBZ_3D, VEL_3D = clean_data_3D(radar_dict)
-        except Exception as e: 
-            logging.warning('Imposible limpiar datos %s' % IRIS_fn[fn])
-            logging.warning(e)
-            failed_files += 1
-            continue
+        for fn, radar in zip(IRIS_fn, radars):
+            if radar is None:
+                failed_files += 1
+                continue
 
-        #transformar coordenadas esféricas a coordenadas cartesianas ubicadas en el sitio del radar
-        try:
-            logging.info('Proyectando a las coordenadas del radar %s' % IRIS_fn[fn])
-            lon, lat, alt = calc_cart_coordinates(radar_dict, var='DB_DBZ')
-        except Exception as e: 
-            logging.warning('Imposible proyectar coordenadas %s' % IRIS_fn[fn])
-            logging.warning(e)
-            failed_files += 1
-            continue
+            logging.info('Escribiendo datos al archivo obs_radar.txt')
+            write_radar(out_fn, radar, out_dir=out_dir)
 
-        #plot_xyz(lon, lat, alt)
-
-        #Interpolar los arreglos lon, lat, alt, DBZ_3D y VEL_3D a una rejilla 9kmx9km 
-        try:
-            logging.info('Interpolando a la resolución del modelo %s' % IRIS_fn[fn])
-            new_lon, new_lat, alt_3D, new_DBZ_3D, new_VEL_3D = interp_data(lon, lat, alt, DBZ_3D, VEL_3D)
-        except Exception as e: 
-            logging.warning('Imposible interpolar %s' % IRIS_fn[fn])
-            logging.warning(e)
-            failed_files += 1
-            continue
-        
-        
-        logging.info('Escribiendo datos al archivo obs_radar.txt')
-        # extraer de diccionario las variables de interés para el header
-        site_name = IRIS_fn[fn][:3]
-        lat_rad = radar_dict['ingest_header']['ingest_configuration']['latitude_radar']
-        lon_rad = radar_dict['ingest_header']['ingest_configuration']['longitude_radar']
-        site_height = radar_dict['ingest_header']['ingest_configuration']['height_site'] #en metros
-        radar_height = radar_dict['ingest_header']['ingest_configuration']['height_radar'] #en metros
-        file_time = radar_dict['product_hdr']['product_configuration']['sweep_ingest_time']
-        elv_rad = site_height + radar_height
-
-        #contar número total de registros válidos
-        num_reg_tot = count_total_data(new_DBZ_3D, new_VEL_3D)
-        
-        #escribir header, el cual cambia según el radar
-        write_header(out_fn, site_name, lon_rad, lat_rad, elv_rad, file_time, num_reg_tot, new_DBZ_3D.shape[2], out_dir=out_dir)
-    
-        #escribir datos para el plano xy y las alturas válidas
-        write_data_xy(out_fn, file_time, elv_rad, new_lat, new_lon, alt_3D, new_DBZ_3D, new_VEL_3D, out_dir=out_dir)
-
-        #reportar en log la terminación del proceso
-        logging.info('Terminado de procesar el archivo %s' % IRIS_fn[fn])
+            #reportar en log la terminación del proceso
+            logging.info('Terminado de procesar el archivo %s' % fn)
 
     #verificar que minimo un archivo haya sido traducido y escrito
     if failed_files==len(IRIS_fn):
@@ -705,3 +1100,7 @@ def radar2txt(settings):
     logging.info('La traducción y escritura de datos de radar RAW terminó')
 
     return
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    benchmark_interp_data()
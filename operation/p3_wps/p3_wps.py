@@ -15,6 +15,7 @@ from shutil import copyfile
 from subprocess import call
 
 from scripts_op.libs.utils import log_format, delete_files
+from scripts_op.p1_download import gfs_streaming, wait_gfs
 from scripts_op.p3_wps import p3a_geogrid, p3b_ungrib, p3c_metgrid
 import namelists_op
 
@@ -61,28 +62,27 @@ def wps(settings):
     # generar el namelist para WPS: namelist.wps.template
     namelists_op.wps(settings)
 
-    # link grib
-    logging.info("Enlazando GFS con link_grib:")
-    logging.info("Data is the following {} and {}".format(settings['globals']['run_wps_dir'],settings['globals']['data']))
-    return_code = call(
-        ["/usr/bin/csh", os.path.join(settings['globals']['run_wps_dir'], "link_grib.csh"), os.path.join(settings['globals']['data'], "gfs/")],
-        cwd=settings['globals']['run_wps_dir'],
-    )
-    if return_code == 0:
-        logging.info(" ↳ Hecho")
+    # link grib, en modo gfs_streaming ungrib enlaza cada bloque de archivos al llegar
+    if gfs_streaming():
+        logging.info("Descarga GFS en segundo plano: los GFS se enlazan por bloques en ungrib")
     else:
-        logging.error(" ↳ Problemas enlazando GFS con link_grib")
-        logging.critical(" ↳ Este proceso es necesario para la corrida")
+        link_grib(settings)
 
     #######################################
     # Corrida:
     #   geogrid, ungrib, metgrid
 
     # run geogrid
+    geogrid_cache = p3a_geogrid.cache_path(settings)
     if settings['flags']['p3a_geogrid']:
         logging.info(log_format('GEOGRID', level=2))
         p3a_geogrid.geogrid(settings)
+    elif geogrid_cache is not None and p3a_geogrid.cache_link(settings, geogrid_cache):
+        # geo_em del cache de geogrid para esta configuracion de dominios
+        pass
     else:
+        if geogrid_cache is not None:
+            logging.warning("Sin geo_em en el cache de geogrid, se enlazan los de wps_light sin verificar")
         # copiando los geo_em
         for geo_file in glob(os.path.join(settings['process']['wrf_path'], "wps_light", "geo_em*")):
             logging.info("aqui creaba symlink")
@@ -96,9 +96,28 @@ def wps(settings):
     # run ungrib
     if settings['flags']['p3b_ungrib']:
         logging.info(log_format('UNGRIB', level=2))
-        p3b_ungrib.ungrib(settings)
+        if gfs_streaming():
+            p3b_ungrib.ungrib_streaming(settings)
+        else:
+            p3b_ungrib.ungrib(settings)
+    # metgrid necesita todos los archivos GFS
+    wait_gfs()
 
     # run metgrid
     if settings['flags']['p3c_metgrid']:
         logging.info(log_format('METGRID', level=2))
         p3c_metgrid.metgrid(settings)
+
+
+def link_grib(settings):
+    logging.info("Enlazando GFS con link_grib:")
+    logging.info("Data is the following {} and {}".format(settings['globals']['run_wps_dir'],settings['globals']['data']))
+    return_code = call(
+        ["/usr/bin/csh", os.path.join(settings['globals']['run_wps_dir'], "link_grib.csh"), os.path.join(settings['globals']['data'], "gfs/")],
+        cwd=settings['globals']['run_wps_dir'],
+    )
+    if return_code == 0:
+        logging.info(" ↳ Hecho")
+    else:
+        logging.error(" ↳ Problemas enlazando GFS con link_grib")
+        logging.critical(" ↳ Este proceso es necesario para la corrida")
@@ -8,13 +8,19 @@
 #  Estos script y códigos son de uso exclusivo de la
 #  Fuerza Aerea Colombiana (FAC)
 #
+import hashlib
+import json
 import logging
 import os
+import re
+import shutil
+import time
 from glob import glob
 from shutil import copyfile
 from subprocess import call
 
-from scripts_op.libs.utils import search_error, delete_files, mpiexec,slurm_send
+from scripts_op.libs.checkpoint import file_md5
+from scripts_op.libs.utils import search_error, delete_files, mpiexec,slurm_send, slurm_jobs
 
 
 def geogrid(settings):
@@ -29,6 +35,14 @@ def geogrid(settings):
     delete_files(settings['globals']['run_wps_dir'], ("geo_em*", "geogrid.exe"))
     logging.info(" ↳ Hecho")
 
+    # cache de geogrid: si los geo_em de esta configuracion de dominios ya existen se enlazan
+    cache_dir = cache_path(settings)
+    key = _cache_key_or_none(settings) if cache_dir is not None else None
+    if key is None:
+        cache_dir = None
+    if cache_dir is not None and cache_link(settings, cache_dir, key):
+        return
+
     # Enlaces y archivos para WPS
     logging.info("Enlazando archivos:")
     # geogrid
@@ -46,9 +60,172 @@ def geogrid(settings):
     logging.info("Corriendo geogrid:")
     geogrib_log = os.path.join(settings['globals']['run_dir'], "logs", "geogrid.log")
     logging.info(" ↳ Ver log en: " + os.path.abspath(geogrib_log))
-    return_code=slurm_send(settings,type="geogrib")
-    if return_code == 0 or return_code==1 and not search_error(geogrib_log, "ERROR:"):
+
+    def check(return_code):
+        if return_code == 0 or return_code==1 and not search_error(geogrib_log, "ERROR:"):
+            logging.info(" ↳ Geogrid: Hecho")
+            return True
+        else:
+            logging.error(" ↳ Problemas con la corrida de geogrid")
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+            return False
+
+    if cache_dir is None:
+        # con slurm_async no se espera, ungrib corre mientras geogrid esta en la cola
+        slurm_send(settings, type="geogrib", check=check)
+        return
+
+    # sin geo_em en el cache para esta configuracion: se espera a geogrid (solo la
+    # primera corrida de cada configuracion) y si termino bien se guardan en el cache
+    slurm_send(settings, type="geogrib", check=check, wait=True)
+    if slurm_jobs(settings).succeeded("geogrib"):
+        cache_store(settings, cache_dir, key)
+
+
+###############################################################################
+#  Cache de geogrid
+#
+# Los geo_em solo dependen de la configuracion de los dominios: la seccion
+# &geogrid del namelist.wps (con max_dom e io_form_geogrid de &share), los datos
+# geograficos (geog_data_path), el GEOGRID.TBL y el geogrid.exe. Con el hash de
+# todo eso (la llave) se guardan en geogrid_cache/<llave>/ junto con un manifest
+# (tamaño y md5 de cada geo_em). Si cambia cualquiera de ellos cambia la llave,
+# y un cache con archivos distintos a los del manifest se elimina.
+
+
+def cache_path(settings):
+    """Directorio del cache de geogrid, None si no se usa (geogrid_cache vacio)"""
+    cache_dir = settings['process'].get('geogrid_cache', '').strip()
+    return cache_dir or None
+
+
+def _namelist_section(namelist, name):
+    """Lineas (sin espacios ni vacias) de la seccion &name del namelist"""
+    match = re.search(r"^\s*&{}\b(.*?)^\s*/".format(name), namelist, re.MULTILINE | re.DOTALL | re.IGNORECASE)
+    if match is None:
+        return []
+    return [re.sub(r"\s+", "", line) for line in match.group(1).splitlines() if line.strip()]
+
+
+def _geog_fingerprint(geog_path):
+    """Fecha de modificacion de los directorios de los datos geograficos y de sus index"""
+    md5 = hashlib.md5()
+    for root, dirs, files in os.walk(geog_path):
+        dirs.sort()
+        md5.update("{} {}\n".format(os.path.relpath(root, geog_path), os.stat(root).st_mtime_ns).encode())
+        if "index" in files:
+            stat = os.stat(os.path.join(root, "index"))
+            md5.update("index {} {}\n".format(stat.st_size, stat.st_mtime_ns).encode())
+    return md5.hexdigest()
+
+
+def cache_key(settings):
+    """
+    Llave del cache para el namelist.wps de la corrida, retorna (llave, descripcion)
+    """
+    with open(os.path.join(settings['globals']['run_wps_dir'], "namelist.wps")) as namelist_file:
+        namelist = namelist_file.read()
+
+    geogrid_section = _namelist_section(namelist, "geogrid")
+    share_section = [line for line in _namelist_section(namelist, "share")
+                     if line.lower().startswith(("max_dom=", "io_form_geogrid="))]
+    geog_path = ""
+    for line in geogrid_section:
+        if line.lower().startswith("geog_data_path="):
+            geog_path = os.path.normpath(line.split("=", 1)[1].strip(",'\""))
+
+    wps_light = os.path.join(settings['process']['wrf_path'], "wps_light")
+    geogrid_exe = os.stat(os.path.join(wps_light, "geogrid.exe"))
+    description = {
+        "geogrid": geogrid_section,
+        "share": share_section,
+        "geog_data_path": geog_path,
+        "geog_data": _geog_fingerprint(geog_path),
+        "geogrid_tbl": file_md5(os.path.join(wps_light, "geogrid", "GEOGRID.TBL"), quick=False),
+        "geogrid_exe": [geogrid_exe.st_size, geogrid_exe.st_mtime_ns],
+    }
+    key = hashlib.md5(json.dumps(description, sort_keys=True).encode()).hexdigest()
+    return key, description
+
+
+def _cache_key_or_none(settings):
+    """Llave del cache (ver cache_key), None si no se puede calcular (falta el
+    namelist.wps, el GEOGRID.TBL o el geogrid.exe)"""
+    try:
+        return cache_key(settings)
+    except OSError as err:
+        logging.warning("Cache de geogrid: no se puede calcular la llave, no se usa el cache ({})".format(err))
+        return None
+
+
+def _cache_valid(entry_dir):
+    """True si los geo_em del cache coinciden con su manifest (tamaño y md5)"""
+    try:
+        with open(os.path.join(entry_dir, "manifest.json")) as manifest_file:
+            manifest = json.load(manifest_file)
+        return bool(manifest["files"]) and all(
+            os.path.getsize(os.path.join(entry_dir, name)) == info["size"] and
+            file_md5(os.path.join(entry_dir, name)) == info["md5"]
+            for name, info in manifest["files"].items())
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def cache_link(settings, cache_dir, key=None):
+    """
+    Enlazar los geo_em del cache si existen para esta configuracion (key, de
+    cache_key), True si se enlazaron
+    """
+    key = key or _cache_key_or_none(settings)
+    if key is None:
+        return False
+    key, description = key
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        logging.info("Cache de geogrid: sin geo_em para esta configuracion ({})".format(key))
+        return False
+    if not _cache_valid(entry_dir):
+        logging.warning("Cache de geogrid: los geo_em de {} no coinciden con su manifest, se eliminan".format(key))
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return False
+
+    logging.info("Cache de geogrid: enlazando los geo_em de " + entry_dir)
+    for geo_file in sorted(glob(os.path.join(entry_dir, "geo_em*"))):
+        link = os.path.join(settings['globals']['run_wps_dir'], os.path.basename(geo_file))
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(geo_file, link)
+    logging.info(" ↳ Hecho")
+    return True
+
+
+def cache_store(settings, cache_dir, key=None):
+    """Guardar los geo_em de la corrida en el cache (con su manifest) con la llave key"""
+    key = key or _cache_key_or_none(settings)
+    if key is None:
+        return
+    key, description = key
+    entry_dir = os.path.join(cache_dir, key)
+    geo_files = sorted(glob(os.path.join(settings['globals']['run_wps_dir'], "geo_em*")))
+    if not geo_files or os.path.isdir(entry_dir):
+        return
+
+    logging.info("Cache de geogrid: guardando los geo_em en " + entry_dir)
+    # se copia a un temporal y se renombra, otra corrida nunca ve un cache incompleto
+    tmp_dir = "{}.tmp-{}".format(entry_dir, os.getpid())
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        files = {}
+        for geo_file in geo_files:
+            name = os.path.basename(geo_file)
+            copyfile(geo_file, os.path.join(tmp_dir, name))
+            files[name] = {"size": os.path.getsize(geo_file), "md5": file_md5(os.path.join(tmp_dir, name))}
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as manifest_file:
+            json.dump({"key": key, "time": time.strftime("%Y-%m-%d %H:%M:%S"), "config": description,
+                       "files": files}, manifest_file, indent=1)
+        os.rename(tmp_dir, entry_dir)
         logging.info(" ↳ Hecho")
-    else:
-        logging.error(" ↳ Problemas con la corrida de geogrid")
-        logging.critical(" ↳ Este proceso es necesario para la corrida")
+    except OSError as err:
+        logging.warning(" ↳ No se pudo guardar el cache de geogrid: {}".format(err))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
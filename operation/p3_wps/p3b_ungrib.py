@@ -10,9 +10,12 @@
 #
 import logging
 import os
+from datetime import timedelta
 from subprocess import call
+from time import sleep, time
 
-from scripts_op.libs.utils import search_error, delete_files, check_files
+from scripts_op.libs.utils import search_error, delete_files, check_files, gfs_manifest_path, gfs_manifest_read
+import namelists_op
 
 
 def ungrib(settings):
@@ -44,3 +47,101 @@ def ungrib(settings):
     else:
         logging.error(" ↳ Problemas con la corrida de ungrib")
         logging.critical(" ↳ Este proceso es necesario para la corrida")
+
+
+def run_ungrib(settings, ungrib_log, mode="w+"):
+    run_wps_dir = settings['globals']['run_wps_dir']
+    with open(ungrib_log, mode) as log:
+        return_code = call(
+            'source "/nfs/users/working/wrf4/control/scripts_op/slurm/WRF_env.sh";cd '+run_wps_dir+';./ungrib.exe',shell=True, stdout=log, stderr=log)
+    return return_code == 0 and not search_error(ungrib_log, "ERROR:")
+
+
+def gfs_hours(settings):
+    """Horas de pronostico de los archivos GFS a descargar (ver gfs_forecast_hours)"""
+    forecast_hours = settings['download']['gfs_forecast_hours']
+    if forecast_hours == 'anl':
+        return [0]
+    start, stop, step = [int(x) for x in forecast_hours.split('-')]
+    return list(range(start, stop + 1, step))
+
+
+def ungrib_streaming(settings):
+    """
+    Correr ungrib por bloques de horas de pronostico a medida que p1a_gfs publica los
+    archivos GFS en el manifest (modo gfs_streaming), cada bloque son las siguientes
+    horas consecutivas ya descargadas desde la ultima hora procesada
+    """
+
+    # limpieza
+    run_wps_dir = settings['globals']['run_wps_dir']
+    logging.info("Limpiando viejos archivos:")
+    delete_files(run_wps_dir, ("FILE*", "GRIBFILE*", "ungrib.exe"))
+    logging.info(" ↳ Hecho")
+
+    # ungrib
+    logging.info("Enlazando y copiando archivos:")
+    os.symlink(os.path.join(settings['process']['wrf_path'], "wps_light", "ungrib.exe"),
+               os.path.join(run_wps_dir, "ungrib.exe"))
+    logging.info(" ↳ Hecho")
+
+    manifest = gfs_manifest_path(settings)
+    # horas minimas por bloque, tiempo maximo de espera de la descarga (minutos) y revision del manifest (segundos)
+    chunk_hours = int(settings['download'].get('gfs_streaming_chunk', 4))
+    timeout = float(settings['download'].get('gfs_streaming_timeout', 180))*60
+    poll = float(settings['download'].get('gfs_streaming_poll', 30))
+
+    ungrib_log = os.path.join(settings['globals']['run_dir'], "logs", "ungrib.log")
+    logging.info(" ↳ Ver log en: " + os.path.abspath(ungrib_log))
+
+    pending = gfs_hours(settings)
+    start_wait = time()
+    log_mode = "w+"
+    while pending:
+        total, files, failed = gfs_manifest_read(manifest)
+        finished = failed is not None
+
+        # horas consecutivas disponibles desde la ultima procesada
+        ready = []
+        for hour in pending:
+            if hour not in files:
+                break
+            ready.append(hour)
+
+        if ready and (len(ready) >= chunk_hours or len(ready) == len(pending) or finished):
+            start_date = settings['globals']['start_date'] + timedelta(hours=ready[0])
+            end_date = settings['globals']['start_date'] + timedelta(hours=ready[-1])
+            logging.info("Corriendo ungrib para las horas {} a {} ({} archivos GFS descargados de {})"
+                         .format(ready[0], ready[-1], len(files), total))
+
+            # enlazar solo los archivos del bloque y ajustar las fechas del namelist
+            delete_files(run_wps_dir, "GRIBFILE*")
+            return_code = call(["/usr/bin/csh", os.path.join(run_wps_dir, "link_grib.csh")] + [files[h] for h in ready],
+                               cwd=run_wps_dir)
+            namelists_op.wps(settings, dates=(start_date, end_date))
+
+            if return_code != 0 or not run_ungrib(settings, ungrib_log, log_mode):
+                logging.error(" ↳ Problemas con la corrida de ungrib para las horas {} a {}".format(ready[0], ready[-1]))
+                logging.critical(" ↳ Este proceso es necesario para la corrida")
+            log_mode = "a"
+            pending = pending[len(ready):]
+            continue
+
+        if finished:
+            logging.error(" ↳ Archivos GFS faltantes para ungrib, horas: {}".format(pending))
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+            break
+        if time() - start_wait > timeout:
+            logging.error(" ↳ Tiempo de espera agotado para la descarga GFS, horas faltantes: {}".format(pending))
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+            break
+        sleep(poll)
+
+    # namelist con las fechas de la corrida para metgrid
+    namelists_op.wps(settings)
+
+    if check_files(run_wps_dir, "FILE*"):
+        logging.info(" ↳ Hecho")
+    else:
+        logging.error(" ↳ Problemas con la corrida de ungrib")
+        logging.critical(" ↳ Este proceso es necesario para la corrida")
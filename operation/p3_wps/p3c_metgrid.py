@@ -37,15 +37,18 @@ def metgrid(settings):
     logging.info("Corriendo metgrid:")
     metgrid_log = os.path.join(settings['globals']['run_dir'], "logs", "metgrid.log")
     logging.info(" ↳ Ver log en: " + os.path.abspath(metgrid_log))
-    #with open(metgrid_log, "w+") as log:
-    return_code=slurm_send(settings,type="metgrid")
-    logging.info(" ↳ El resultado de la ejecucion fue {}".format(return_code))
-    #    )
-    if return_code == 0 or return_code==1\
-       and not search_error(metgrid_log, "ERROR:") \
-       and check_files(settings['globals']['run_wps_dir'], "met_em*"):
-        logging.info(" ↳ Hecho")
 
-    else:
-        logging.error(" ↳ Problemas con la corrida de metgrid")
-        logging.critical(" ↳ Este proceso es necesario para la corrida")
+    def check(return_code):
+        logging.info(" ↳ El resultado de la ejecucion de metgrid fue {}".format(return_code))
+        if return_code == 0 or return_code==1\
+           and not search_error(metgrid_log, "ERROR:") \
+           and check_files(settings['globals']['run_wps_dir'], "met_em*"):
+            logging.info(" ↳ Metgrid: Hecho")
+            return True
+        else:
+            logging.error(" ↳ Problemas con la corrida de metgrid")
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+            return False
+
+    # metgrid despues de geogrid (si termina bien), con slurm_async real espera los met_em
+    slurm_send(settings, type="metgrid", after=("geogrib",), check=check)
@@ -13,7 +13,7 @@ import os
 from glob import glob
 from subprocess import call
 
-from scripts_op.libs.utils import log_format, search_error, delete_files, check_files, slurm_send
+from scripts_op.libs.utils import log_format, search_error, delete_files, check_files, slurm_send, wait_slurm_jobs
 import namelists_op
 
 
@@ -56,7 +56,8 @@ def real(settings):
     delete_files(settings['globals']['run_real_dir'], ("wrfinput*", "wrfbdy*", "met_em.d0*", "real.exe"))
     logging.info(" ↳ Hecho")
 
-    # met files
+    # met files, con slurm_async se espera aqui a que termine metgrid
+    wait_slurm_jobs("metgrid")
     for geo_file in glob(os.path.join(settings['globals']['run_dir'], "wps", "met_em.d0*")):
         os.symlink(geo_file, os.path.join(settings['globals']['run_real_dir'], os.path.basename(geo_file)))
 
@@ -68,13 +69,18 @@ def real(settings):
     logging.info("Corriendo real:")
     real_log = os.path.join(settings['globals']['run_dir'], "logs", "real.log")
     logging.info(" ↳ Ver log en: " + os.path.abspath(real_log))
-    return_code = slurm_send(settings,type="real")
-    # with open(real_log, "w+") as log:
-    #return_code = slurm_send(settings,type="real")
-    if return_code == 0 or return_code ==1 \
-       and not search_error(real_log, "ERROR:") \
-       and check_files(settings['globals']['run_real_dir'], ("wrfinput*", "wrfbdy*")):
-        logging.info(" ↳ Hecho")
-    else:
-        logging.error(" ↳ Problemas con la corrida de real")
-        logging.critical(" ↳ Este proceso es necesario para la corrida")
+
+    def check(return_code):
+        if return_code == 0 or return_code ==1 \
+           and not search_error(real_log, "ERROR:") \
+           and check_files(settings['globals']['run_real_dir'], ("wrfinput*", "wrfbdy*")):
+            logging.info(" ↳ Real: Hecho")
+            return True
+        else:
+            logging.error(" ↳ Problemas con la corrida de real")
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+            return False
+
+    # con slurm_async no se espera, obsproc entra a la cola mientras corre real y
+    # 3dvar y wrf se envian despues de real (si termina bien)
+    slurm_send(settings, type="real", check=check)
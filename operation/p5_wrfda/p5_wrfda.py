@@ -47,9 +47,12 @@ def wrfda(settings):
         logging.info(log_format('OBSPROC', level=2))
         p5a_obsproc.obsproc(settings)
 
+    # 3dvar de los dominios al mismo tiempo despues de low_bc (default: False, uno por uno)
+    domains = [str(domain) for domain in range(1, int(settings['process']['wrfda_domains'])+1)]
+    concurrent = settings['flags']['p5c_3dvar'] and settings['process'].get('wrfda_concurrent', False)
+
     # run in all domains
-    for domain in range(1, int(settings['process']['wrfda_domains'])+1):
-        domain = str(domain)
+    for domain in domains:
 
         # run low_bc
         if settings['flags']['p5b_low_bc']:
@@ -57,10 +60,14 @@ def wrfda(settings):
             p5b_low_bc.low_bc(settings, domain)
 
         # run 3dvar
-        if settings['flags']['p5c_3dvar']:
+        if settings['flags']['p5c_3dvar'] and not concurrent:
             logging.info(log_format('3DVAR FOR DOMAIN 0'+domain, level=2))
             p5c_3dvar._3dvar(settings, domain)
 
+    # run 3dvar en todos los dominios, lat_bc espera a que terminen
+    if concurrent:
+        p5c_3dvar._3dvar_domains(settings, domains)
+
 #        ### run draw obs in ncl
 #        logging.info('Creando plot de los datos asimilados')
 #        with open(os.path.join(os.path.dirname(__file__), 'p5e_draw_obs.ncl'), 'r') as infile:
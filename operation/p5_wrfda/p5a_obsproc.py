@@ -58,13 +58,18 @@ def obsproc(settings):
     logging.info("Corriendo obsproc:")
     obsproc_log = os.path.join(settings['globals']['run_dir'], "logs", "obsproc.log")
     logging.info(" ↳ Ver log en: " + os.path.abspath(obsproc_log))
-   # with open(obsproc_log, "w+") as log:
-    return_code =slurm_send(settings,"wrf_obsproc")
-    logging.info("El resultado de la ejecucion es {}".format(return_code))
-    if return_code == 0 or return_code ==1 \
-       and not search_error(obsproc_log, "ERROR:") \
-       and check_files(settings['globals']['run_obsproc_dir'], "obs_gts_{}*".format(settings['globals']['start_date'].strftime("%Y-%m-%d"))):
-        logging.info(" ↳ Hecho")
-    else:
-        logging.error(" ↳ Problemas con la corrida de obsproc")
-        logging.critical(" ↳ Este proceso es necesario para la corrida")
+
+    def check(return_code):
+        logging.info("El resultado de la ejecucion de obsproc es {}".format(return_code))
+        if return_code == 0 or return_code ==1 \
+           and not search_error(obsproc_log, "ERROR:") \
+           and check_files(settings['globals']['run_obsproc_dir'], "obs_gts_{}*".format(settings['globals']['start_date'].strftime("%Y-%m-%d"))):
+            logging.info(" ↳ Obsproc: Hecho")
+            return True
+        else:
+            logging.error(" ↳ Problemas con la corrida de obsproc")
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+            return False
+
+    # con slurm_async no se espera, 3dvar se envia despues de obsproc (si termina bien)
+    slurm_send(settings, "wrf_obsproc", check=check)
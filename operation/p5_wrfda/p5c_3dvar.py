@@ -10,15 +10,24 @@
 #
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copyfile
 from subprocess import call
 import namelists_op
 
-from scripts_op.libs.utils import search_error, delete_files, check_files, mpiexec,slurm_send
+from scripts_op.libs.utils import search_error, delete_files, check_files, mpiexec,slurm_send, log_format, \
+    slurm_jobs, slurm_job_name, wait_slurm_jobs
 
 
 def _3dvar(settings, domain):
 
+    _3dvar_prepare(settings, domain)
+    _3dvar_run(settings, domain)
+
+
+def _3dvar_prepare(settings, domain):
+
     _3dvar_domain_dir = os.path.join(settings['globals']['run_wrfda_dir'], "da_d0"+domain)
     if not os.path.isdir(_3dvar_domain_dir):
         os.makedirs(_3dvar_domain_dir)
@@ -96,17 +105,109 @@ def _3dvar(settings, domain):
 
     logging.info(" ↳ Hecho")
 
+
+def _3dvar_run(settings, domain, wait=True, nodes=None):
+    """
+    Correr 3dvar del dominio (preparado): como trabajo de Slurm, si no wait retorna
+    sin esperar, o con mpiexec local en nodes = (nodos, procesos por nodo). Con
+    mpiexec retorna True si termino bien, el error critico lo reporta el llamador
+    (corre en un hilo de _3dvar_domains)
+    """
+    _3dvar_domain_dir = os.path.join(settings['globals']['run_wrfda_dir'], "da_d0"+domain)
+
     # run _3dvar
-    logging.info("Corriendo 3dvar:")
+    logging.info("Corriendo 3dvar: dominio {}".format(domain))
     _3dvar_log = os.path.join(settings['globals']['run_dir'], "logs", "3dvar_d0{}.log".format(domain))
     logging.info(" ↳ Ver log en: " + os.path.abspath(_3dvar_log))
-    with open(_3dvar_log, "w+") as log:
-        return_code=slurm_send(settings,"wrfda_3dvar",domain)
-    #    )
-    if return_code == 0 \
-       and not search_error(_3dvar_log, "ERROR:") \
-       and check_files(_3dvar_domain_dir, "wrfvar_output"):
-        logging.info(" ↳ Hecho")
+
+    def check(return_code):
+        if return_code == 0 \
+           and not search_error(_3dvar_log, "ERROR:") \
+           and check_files(_3dvar_domain_dir, "wrfvar_output"):
+            logging.info(" ↳ 3dvar dominio {}: Hecho".format(domain))
+            return True
+        logging.error(" ↳ Problemas con la corrida de 3dvar dominio {}".format(domain))
+        if nodes is None:
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+        return False
+
+    if nodes is not None:
+        with open(_3dvar_log, "w+") as log:
+            return_code = call(
+                mpiexec(settings, run_in=nodes[0], ppn=nodes[1], machinefile="mpd_d0{}.conf".format(domain)) +
+                ["./da_wrfvar.exe"], stdout=log, stderr=log, cwd=_3dvar_domain_dir)
+        return check(return_code)
+
+    open(_3dvar_log, "w+").close()
+    # despues de obsproc y real (si terminan bien), lat_bc necesita el resultado: se espera
+    # aqui o en _3dvar_domains
+    slurm_send(settings, "wrfda_3dvar", domain, after=("wrf_obsproc", "real"), check=check, wait=wait)
+
+
+def split_nodes(nodes, parts, ppn):
+    """
+    Repartir los nodos entre parts corridas: grupos contiguos de nodos si alcanzan,
+    si no cada corrida en un nodo repartiendo sus procesos (ppn) entre las corridas
+    que lo comparten. Retorna [(nodos, procesos por nodo)] por corrida
+    """
+    if len(nodes) >= parts:
+        size, extra = divmod(len(nodes), parts)
+        groups, start = [], 0
+        for part in range(parts):
+            end = start + size + (1 if part < extra else 0)
+            groups.append((nodes[start:end], ppn))
+            start = end
+        return groups
+    shared = [len(range(node, parts, len(nodes))) for node in range(len(nodes))]
+    return [([nodes[part % len(nodes)]], max(ppn // shared[part % len(nodes)], 1)) for part in range(parts)]
+
+
+def _3dvar_domains(settings, domains):
+    """
+    3dvar de todos los dominios al mismo tiempo (se preparan uno por uno): trabajos
+    de Slurm en paralelo o corridas locales con mpiexec repartiendo los nodos
+    (wrfda_launcher), retorna cuando terminan todos (antes de lat_bc)
+    """
+    for domain in domains:
+        logging.info(log_format('3DVAR FOR DOMAIN 0'+domain, level=2))
+        _3dvar_prepare(settings, domain)
+
+    logging.info(log_format('3DVAR: DOMINIOS {} AL MISMO TIEMPO'.format(", ".join(domains)), level=2))
+    start_time = time.time()
+
+    if settings['process'].get('wrfda_launcher', 'slurm') == 'mpiexec':
+        nodes = split_nodes(settings['process']['mpi_nodes'].split(","), len(domains),
+                            int(settings['process']['mpi_ppn']))
+        for domain, (run_in, ppn) in zip(domains, nodes):
+            logging.info(" ↳ Dominio 0{}: nodos {} con {} procesos por nodo".format(domain, ",".join(run_in), ppn))
+
+        times = {}
+        results = {}
+
+        def run(domain, run_nodes):
+            domain_start = time.time()
+            try:
+                results[domain] = _3dvar_run(settings, domain, nodes=run_nodes)
+            finally:
+                times[domain] = time.time() - domain_start
+
+        with ThreadPoolExecutor(max_workers=len(domains)) as executor:
+            futures = [executor.submit(run, domain, run_nodes) for domain, run_nodes in zip(domains, nodes)]
+        for domain, (run_in, ppn) in zip(domains, nodes):
+            logging.info(" ↳ 3dvar dominio 0{}: {:.1f} min en los nodos {}".format(
+                domain, times.get(domain, 0) / 60, ",".join(run_in)))
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise errors[0]
+        # error critico desde este hilo, no desde los hilos de mpiexec
+        if not all(results.get(domain) for domain in domains):
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
     else:
-        logging.error(" ↳ Problemas con la corrida de 3dvar")
-        logging.critical(" ↳ Este proceso es necesario para la corrida")
+        names = []
+        for domain in domains:
+            _3dvar_run(settings, domain, wait=False)
+            names.append(slurm_job_name("wrfda_3dvar", domain))
+        wait_slurm_jobs(*names)
+        slurm_jobs(settings).log_report(*names)
+
+    logging.info(" ↳ 3dvar de los dominios en {:.1f} min".format((time.time() - start_time) / 60))
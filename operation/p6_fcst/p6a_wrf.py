@@ -119,11 +119,18 @@ def wrf(settings):
     logging.info("Corriendo wrf:")
     wrf_log = os.path.join(settings['globals']['run_dir'], "logs", "wrf.log")
     logging.info(" ↳ Ver log en: " + os.path.abspath(wrf_log))
-    return_code=slurm_send(settings,"wrf")
-    if return_code == 0 or return_code ==1 \
-       and not search_error(wrf_log, "ERROR:") \
-       and check_files(settings['globals']['run_fcst_dir'], "wrfout_d0*"):
-        logging.info(" ↳ Hecho")
-    else:
-        logging.error(" ↳ Problemas con la corrida de wrf")
-        logging.critical(" ↳ Este proceso es necesario para la corrida")
+
+    def check(return_code):
+        if return_code == 0 or return_code ==1 \
+           and not search_error(wrf_log, "ERROR:") \
+           and check_files(settings['globals']['run_fcst_dir'], "wrfout_d0*"):
+            logging.info(" ↳ WRF: Hecho")
+            return True
+        else:
+            logging.error(" ↳ Problemas con la corrida de wrf")
+            logging.critical(" ↳ Este proceso es necesario para la corrida")
+            return False
+
+    # despues de real (si termina bien, sin asimilacion real puede seguir en la cola), el
+    # post necesita los wrfout: se espera
+    slurm_send(settings, "wrf", after=("real",), check=check, wait=True)
@@ -10,10 +10,71 @@
 #
 import logging
 import os
+from threading import Event, Thread
 
+from scripts_op.libs import backup
 from scripts_op.libs.utils import log_format
 from scripts_op.p7_post import p7a_arw, p7b_api
-from distutils.dir_util import copy_tree
+
+
+# publicacion de los wrfout en el API mientras corre WRF (modo api_streaming)
+_api_thread = None
+_api_stop = Event()
+_api_prepared = Event()
+_api_published = set()
+
+
+def watch_api(settings):
+    """Iniciar en segundo plano la publicacion de cada wrfout en el API a medida
+    que WRF lo escribe (modo api_streaming), se llama antes del forecast"""
+    if not (settings['flags']['p7_post'] and settings['flags']['p7b_api']
+            and settings['post'].get('api_streaming', False)):
+        return
+
+    logging.info("Publicacion de los wrfout en el API en segundo plano (api_streaming)")
+    global _api_thread
+    _api_thread = Thread(target=api_background, args=(settings,), name="api", daemon=True)
+    _api_thread.start()
+
+
+def api_background(settings):
+    """Publicacion del modo api_streaming, los wrfout que no se alcancen a
+    publicar se procesan en nc2api"""
+    try:
+        p7b_api.api_watch(settings, _api_stop, _api_published, prepared=_api_prepared)
+    except Exception as err:
+        logging.error("Problemas con la publicacion del API en segundo plano: " + str(err))
+
+
+def wait_api():
+    """Terminar la publicacion en segundo plano (WRF ya termino), retorna los
+    wrfout publicados o None si no se uso el modo api_streaming o si no se
+    alcanzaron a preparar los directorios del API (nc2api los prepara)"""
+    if _api_thread is None:
+        return None
+    _api_stop.set()
+    if _api_thread.is_alive():
+        logging.info("Esperando a que termine la publicacion del API en segundo plano")
+        _api_thread.join()
+    if not _api_prepared.is_set():
+        logging.warning("La publicacion en segundo plano no preparo los directorios del API, se preparan en nc2api")
+        return None
+    return _api_published
+
+
+def backup_run(settings, out_dir):
+    """Copia incremental del directorio de corrida a out_dir (ver libs/backup.py)"""
+    # hilos de copia, enlazar (hardlink) si es el mismo disco y comparar md5 ademas
+    # de tamaño y fecha (default: 4, False y False)
+    try:
+        report = backup.backup_tree(settings['globals']['run_dir'], out_dir,
+                                    workers=int(settings['post'].get('backup_workers', 4)),
+                                    hardlink=settings['post'].get('backup_hardlink', False),
+                                    checksum=settings['post'].get('backup_checksum', False))
+        backup.log_report(report)
+    except Exception as err:
+        logging.error("Problemas con la copia de las salidas WRF a " + out_dir + ": " + str(err))
+
 
 def post(settings):
 
@@ -25,7 +86,11 @@ def post(settings):
     out_dir=settings['globals']['run_dir'].replace(settings['globals']['base_dir'],settings['globals']['backup_destination'])
     logging.info(log_format('Se copian las salidas WRF desde '+settings['globals']['run_dir']+' a '+out_dir, level=1))
     print('Se copian las salidas WRF desde '+settings['globals']['run_dir']+' a '+out_dir)
-    copy_tree(settings['globals']['run_dir'],out_dir, preserve_symlinks=1)
+    # copia en segundo plano mientras continua el post (default: False), ARWpost la espera
+    backup_thread = Thread(target=backup_run, args=(settings, out_dir), name="backup", daemon=True)
+    backup_thread.start()
+    if not settings['post'].get('backup_background', False):
+        backup_thread.join()
 
     #######################################
     # preparar directorio de corrida
@@ -59,8 +124,13 @@ def post(settings):
 
     if settings['flags']['p7b_api']:
         logging.info(log_format('NC2API', level=2))
-        p7b_api.nc2api(settings)
+        p7b_api.nc2api(settings, published=wait_api())
     
+    # ARWpost lee las salidas copiadas en out_dir
+    if backup_thread.is_alive():
+        logging.info("Esperando a que termine la copia de las salidas WRF")
+    backup_thread.join()
+
     if settings['flags']['p7a_arw']:
         logging.info(log_format('ARWPOST', level=2))
         p7a_arw.arwpost(settings,out_dir)
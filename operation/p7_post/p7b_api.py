@@ -1,45 +1,197 @@
 #!/bin/python3
+import logging
+import multiprocessing as mp
+import glob,os,time
+from functools import partial
+
+from netCDF4 import Dataset
+
+from scripts_op.libs import ncsubset
+from scripts_op.libs.transfer import Transfer
+
 cirrocumulus='julian@172.20.101.160'
 
-def nco_wrfout_min(ncfile,outpath,dest):
-    import os
+# variables del wrfout que se publican en el API
+API_VARS = ("P,PB,PH,PHB,T,T00,QRAIN,QCLOUD,QICE,QGRAUP,QVAPOR,U,V,W,PSFC,TSK,XLAT,XLONG,RAINC,RAINNC,Q2,T2,TH2,U10,V10,ZNU,HGT,CLDFRA,Times,XTIME"
+            ",AFWA_MSLP,AFWA_VIS,AFWA_VIS_DUST,AFWA_CLOUD,AFWA_CLOUD_CEIL,AFWA_CAPE,AFWA_CIN,AFWA_ZLFC,AFWA_PLFC,AFWA_LIDX,AFWA_HAIL,AFWA_LLWS"
+            ",AFWA_FZRA,AFWA_ICE,AFWA_TURB,AFWA_LLTURBLGT,AFWA_LLTURBMDT,AFWA_LLTURBSVR,ICINGBOT,ICINGTOP").split(",")
+
+
+def wrfout_api(ncfile,outpath,options):
+    """Subconjunto de las variables del API de un wrfout (en proceso, sin ncrcat),
+    retorna el archivo del API, el tiempo (s) y los tamaños (bytes)"""
     #outpath=directorio en master: /disco1/api/<fecha>
-    #dest=directorio en cirrocumulus: /data/run/<fecha>
-#    wrfout=ncfile[-30:-6]+'_min'
-    wrfout=ncfile[-30:]
-    apivars='P,PB,PH,PHB,T,T00,QRAIN,QCLOUD,QICE,QGRAUP,QVAPOR,U,V,W,PSFC,TSK,XLAT,XLONG,RAINC,RAINNC,Q2,T2,TH2,U10,V10,ZNU,HGT,CLDFRA,Times,XTIME'
-    apivars=apivars+',AFWA_MSLP,AFWA_VIS,AFWA_VIS_DUST,AFWA_CLOUD,AFWA_CLOUD_CEIL,AFWA_CAPE,AFWA_CIN,AFWA_ZLFC,AFWA_PLFC,AFWA_LIDX,AFWA_HAIL,AFWA_LLWS'
-    apivars=apivars+',AFWA_FZRA,AFWA_ICE,AFWA_TURB,AFWA_LLTURBLGT,AFWA_LLTURBMDT,AFWA_LLTURBSVR,ICINGBOT,ICINGTOP'
-    print('/usr/bin/ncrcat -O -v '+apivars+' '+ncfile+' '+outpath+'/'+wrfout)
-    os.system('/usr/bin/ncrcat -O -v '+apivars+' '+ncfile+' '+outpath+'/'+wrfout)
-    #copiar ultima corrida
-    print('scp -r '+outpath+'/'+wrfout+' '+cirrocumulus+':'+dest )
-    os.system('scp -r '+outpath+'/'+wrfout+' '+cirrocumulus+':'+dest+'/fcst' )
-
-
-def nc2api(settings):
-    import multiprocessing as mp
-    import glob,os
+    wrfout=os.path.join(outpath,os.path.basename(ncfile))
+    subset_time,bytes_read,size=ncsubset.subset(ncfile,wrfout,API_VARS,**options)
+    return ncfile,wrfout,subset_time,bytes_read,size
 
-    path=settings['globals']['run_dir']+'fcst/wrfout*'
+
+def wrfout_complete(ncfile):
+    """True si el encabezado NetCDF del wrfout esta completo: se puede abrir y ya
+    tiene el tiempo escrito"""
+    try:
+        with open(ncfile,'rb') as f:
+            magic=f.read(4)
+        if magic[:3]!=b'CDF' and magic!=b'\x89HDF':
+            return False
+        with Dataset(ncfile,'r') as data:
+            return len(data.dimensions['Time'])>0
+    except Exception:
+        return False
+
+
+def api_paths(settings):
+    """Directorio del API en master (outpath) y en cirrocumulus (dest)"""
     outpath=settings['globals']['run_dir'].replace(settings['globals']['base_dir'],settings['globals']['backup_destination'])
     outpath=outpath.replace('run','api')
-    os.system('rm -r '+"/".join(outpath.split('/')[:-2])+'/*')
-    os.mkdir(outpath)
 #    dest='/data/api'
-    dest=outpath.replace(settings['globals']['backup_destination'],'/data')
-    #borrar corridas viejas en cirrocumulus
-    os.system('ssh '+cirrocumulus+' "cd /data/;./oldruns.sh"')
 #    dest=outpath.replace(settings['globals']['backup_destination'],'/data')
     dest=settings['globals']['run_dir'].replace(settings['globals']['base_dir'],'/data')
-    os.system('ssh '+cirrocumulus+' "mkdir '+dest+';mkdir '+dest+'/fcst"')
-    nn = mp.cpu_count()
-    with mp.Pool(processes=nn) as pr:
-#         df_temp =  pr.starmap(wrfout_min,[(ncfile,) for ncfile in glob.glob(path)])
-         df_temp =  pr.starmap(nco_wrfout_min,[(ncfile,outpath,dest) for ncfile in glob.glob(path)])
-#    os.system('scp -r '+outpath+' '+cirrocumulus+':'+dest )
-    diag=settings['globals']['run_dir']+'fcst/diagnostics_d0*'
-    os.system('scp -r '+diag+' '+cirrocumulus+':'+dest+'/fcst' )
+    return outpath,dest
+
+
+def api_transfer(settings):
+    """Copia de los archivos del API a cirrocumulus con una sola conexion SSH
+    (ver libs/transfer.py)"""
+    # destino: usuario@host o local:/ruta para copiar a un directorio local (default: cirrocumulus)
+    target=settings['post'].get('api_target',cirrocumulus) or cirrocumulus
+    # copias simultaneas y maximo de archivos en cola (default: 2 y 8)
+    return Transfer(target,streams=int(settings['post'].get('api_streams',2)),
+                    queue_size=int(settings['post'].get('api_queue',8)))
+
+
+def api_prepare(settings,transfer):
+    """Limpiar y crear los directorios del API en master y en cirrocumulus"""
+    outpath,dest=api_paths(settings)
+    os.system('rm -r '+"/".join(outpath.split('/')[:-2])+'/*')
+    os.mkdir(outpath)
+    #borrar corridas viejas en cirrocumulus
+    transfer.run('cd /data/;./oldruns.sh')
+    transfer.makedirs(dest+'/fcst')
+    return outpath,dest
+
+
+def api_publish(settings,ncfiles,outpath,dest,transfer):
+    """Subconjunto y copia a cirrocumulus de los wrfout, cada archivo se encola para
+    copiar apenas termina su subconjunto, con los tiempos por archivo. Retorna los
+    wrfout publicados (sin problemas en la copia)"""
+    # archivos simultaneos, limitado por el rendimiento del disco y no por los cores (default: 2)
+    workers=int(settings['post'].get('api_workers',2))
+    # compresion (0 sin compresion), shuffle, chunking (auto, input o contiguous) y
+    # memoria maxima (MB) por bloque de copia de los archivos del API
+    options=dict(complevel=int(settings['post'].get('api_complevel',0)),
+                 shuffle=settings['post'].get('api_shuffle',False),
+                 chunking=settings['post'].get('api_chunking','auto'),
+                 buffer_mb=float(settings['post'].get('api_buffer_mb',256)))
+
+    start_time=time.time()
+    with mp.Pool(processes=max(1,min(workers,len(ncfiles)))) as pr:
+        for ncfile,wrfout,subset_time,bytes_read,size in pr.imap_unordered(partial(wrfout_api,outpath=outpath,options=options),ncfiles):
+            # tiempos por archivo
+            logging.info(" ↳ {}: subconjunto {:.1f} s ({:.0f} MB leidos, {:.0f} MB escritos)"
+                         .format(os.path.basename(ncfile),subset_time,bytes_read/1024**2,size/1024**2))
+            #copiar a cirrocumulus
+            transfer.submit(wrfout,dest+'/fcst')
+    results=transfer.wait()
+
+    failed=[os.path.basename(f) for f,status,seconds,size in results if status=='failed']
+    if failed:
+        logging.error(" ↳ Problemas copiando a "+transfer.target+": "+", ".join(failed))
+    logging.info("Archivos del API: {} en {:.1f} s con {} proceso(s), {} copiados, {} sin cambios"
+                 .format(len(ncfiles),time.time()-start_time,workers,
+                         sum(status=='copied' for f,status,seconds,size in results),
+                         sum(status=='skipped' for f,status,seconds,size in results)))
+    return [ncfile for ncfile in ncfiles if os.path.basename(ncfile) not in failed]
+
+
+def api_watch(settings,stop,published,prepared=None):
+    """
+    Modo api_streaming: revisar el directorio de fcst mientras corre WRF y publicar
+    cada wrfout terminado, es decir con el encabezado NetCDF completo y con un
+    wrfout posterior del mismo dominio o con el tamaño estable por
+    api_streaming_stable segundos. Cuando se activa stop (WRF termino) se publican
+    los que esten completos y termina. Los wrfout publicados se agregan a published
+    y prepared (Event) se activa cuando los directorios del API estan listos.
+    """
+    # intervalo (s) de revision del directorio y tiempo (s) sin cambios para
+    # considerar terminado el ultimo wrfout de cada dominio (default: 30 y 60)
+    poll=float(settings['post'].get('api_streaming_poll',30))
+    stable=float(settings['post'].get('api_streaming_stable',60))
+
+    fcst_dir=os.path.join(settings['globals']['run_dir'],'fcst')
+    path=os.path.join(fcst_dir,'wrfout*')
+
+    def signature(ncfile):
+        stat=os.stat(ncfile)
+        return stat.st_size,stat.st_mtime
+
+    # wrfout de una corrida anterior (WRF los borra al iniciar), no se publican
+    old_files={}
+    for ncfile in glob.glob(path):
+        try:
+            old_files[ncfile]=signature(ncfile)
+        except OSError:
+            pass
+
+    with api_transfer(settings) as transfer:
+        outpath,dest=api_prepare(settings,transfer)
+        if prepared is not None:
+            prepared.set()
+        # tamaño, fecha de modificacion y desde cuando no cambia cada wrfout
+        seen={}
+
+        while True:
+            finished=stop.is_set()
+            ncfiles=sorted(ncfile for ncfile in glob.glob(path) if ncfile not in published)
+            ready=[]
+            for ncfile in ncfiles:
+                try:
+                    sig=signature(ncfile)
+                except OSError:
+                    continue
+                if old_files.get(ncfile)==sig:
+                    continue
+                if ncfile not in seen or seen[ncfile][0]!=sig:
+                    seen[ncfile]=(sig,time.time())
+                # nombre wrfout_d0X_<tiempo>: un wrfout posterior del dominio indica que WRF ya cerro este
+                domain=os.path.basename(ncfile)[:10]
+                newer=any(os.path.basename(other)[:10]==domain and other>ncfile for other in ncfiles)
+                if (finished or newer or time.time()-seen[ncfile][1]>=stable) and wrfout_complete(ncfile):
+                    ready.append(ncfile)
+
+            if ready:
+                logging.info("Publicando en el API (api_streaming): "+", ".join(os.path.basename(f) for f in ready))
+                try:
+                    published.update(api_publish(settings,ready,outpath,dest,transfer))
+                except Exception as err:
+                    logging.error(" ↳ Problemas publicando los wrfout en el API: "+str(err))
+
+            if finished:
+                return published
+            stop.wait(poll)
+
+
+def nc2api(settings,published=None):
+    """Subconjunto de variables de los wrfout y copia a cirrocumulus, published son
+    los wrfout ya publicados en modo api_streaming (los directorios ya existen)"""
+
+    path=settings['globals']['run_dir']+'fcst/wrfout*'
+    with api_transfer(settings) as transfer:
+        if published is None:
+            outpath,dest=api_prepare(settings,transfer)
+            published=set()
+        else:
+            outpath,dest=api_paths(settings)
+
+        ncfiles=sorted(ncfile for ncfile in glob.glob(path) if ncfile not in published)
+        if ncfiles:
+            api_publish(settings,ncfiles,outpath,dest,transfer)
+#        os.system('scp -r '+outpath+' '+cirrocumulus+':'+dest )
+        diag=settings['globals']['run_dir']+'fcst/diagnostics_d0*'
+        for diag_file in sorted(glob.glob(diag)):
+            if os.path.isfile(diag_file):
+                transfer.submit(diag_file,dest+'/fcst')
+        transfer.wait()
 
 if __name__=='__main__':
     main()
@@ -12,24 +12,34 @@ import os
 from dateutil.relativedelta import relativedelta
 
 
-def wps(settings):
+def wps(settings, dates=None):
     """
     Namelist para WPS
+
+    dates: (fecha inicial, fecha final) para todos los dominios en lugar de las
+           fechas de la corrida, usado para correr ungrib por bloques de horas
     """
     # open template
     with open(os.path.join(os.path.dirname(__file__), 'wps.template'), 'r') as infile:
         wps_file = infile.read()
 
+    start_date = settings['globals']['start_date']
+    end_date, end_date_d01, end_date_d02 = \
+        settings['process']['end_date'], settings['process']['end_date_d01'], settings['process']['end_date_d02']
+    if dates is not None:
+        start_date, end_date = dates
+        end_date_d01 = end_date_d02 = end_date
+
     # set the variables inside namelist
     wps_file = wps_file.format(
-        start_date=settings['globals']['start_date'].strftime("%Y-%m-%d"),
-        start_hour=settings['globals']['start_date'].strftime("%H"),
-        end_date=settings['process']['end_date'].strftime("%Y-%m-%d"),
-        end_hour=settings['process']['end_date'].strftime("%H"),
-        end_date_d01=settings['process']['end_date_d01'].strftime("%Y-%m-%d"),
-        end_hour_d01=settings['process']['end_date_d01'].strftime("%H"),
-        end_date_d02=settings['process']['end_date_d02'].strftime("%Y-%m-%d"),
-        end_hour_d02=settings['process']['end_date_d02'].strftime("%H"),
+        start_date=start_date.strftime("%Y-%m-%d"),
+        start_hour=start_date.strftime("%H"),
+        end_date=end_date.strftime("%Y-%m-%d"),
+        end_hour=end_date.strftime("%H"),
+        end_date_d01=end_date_d01.strftime("%Y-%m-%d"),
+        end_hour_d01=end_date_d01.strftime("%H"),
+        end_date_d02=end_date_d02.strftime("%Y-%m-%d"),
+        end_hour_d02=end_date_d02.strftime("%H"),
         wrf_path=settings['process']['wrf_path'],
         domains=settings['process']['domains'],
         interval_seconds=settings['process']['interval_seconds'],
@@ -0,0 +1,15 @@
+#
+# The operation directory is deployed as the scripts_op package (see
+# automation/wrf_execution_control.sh), register it with that name so the
+# tests import the modules as in production.
+#
+import os
+import sys
+import types
+
+OPERATION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "operation")
+
+if "scripts_op" not in sys.modules:
+    scripts_op = types.ModuleType("scripts_op")
+    scripts_op.__path__ = [OPERATION_DIR]
+    sys.modules["scripts_op"] = scripts_op
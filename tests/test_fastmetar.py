@@ -0,0 +1,77 @@
+#
+# Differential tests of the METAR fast path (libs/metar/fastmetar.py) against
+# the full metar.Metar parser over the reports in data/:
+#
+#   metar_fast.txt      reports decoded by the fast path
+#   metar_fallback.txt  reports decoded with metar.Metar (peak wind and wind
+#                       shift remarks, unparsed main-body groups)
+#   metar_error.txt     reports rejected by metar.Metar (ParserError)
+#
+import datetime
+import os
+
+import pytest
+
+from scripts_op.libs.metar import fastmetar
+from scripts_op.libs.metar.metar import Metar, ParserError
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# attributes converted by metar2litR, with the units it uses
+FIELDS = {
+    "station_id": lambda obs: obs.station_id,
+    "time": lambda obs: obs.time,
+    "wind_dir": lambda obs: obs.wind_dir.value() if obs.wind_dir else None,
+    "wind_speed": lambda obs: obs.wind_speed.value("MPS") if obs.wind_speed else None,
+    "temp": lambda obs: obs.temp.value("K") if obs.temp else None,
+    "dewpt": lambda obs: obs.dewpt.value("K") if obs.dewpt else None,
+    "press": lambda obs: obs.press.value("MB") if obs.press else None,
+    "press_sea_level": lambda obs: obs.press_sea_level.value() if obs.press_sea_level else None,
+}
+
+
+def read_corpus(name):
+    with open(os.path.join(DATA_DIR, name)) as corpus:
+        return [line.strip() for line in corpus if line.strip()]
+
+
+FAST = read_corpus("metar_fast.txt")
+FALLBACK = read_corpus("metar_fallback.txt")
+ERROR = read_corpus("metar_error.txt")
+
+
+@pytest.mark.parametrize("field", sorted(FIELDS))
+@pytest.mark.parametrize("code", FAST)
+def test_fast_path_matches_metar(code, field):
+    # same current time for both parsers (month and year of the report)
+    fast = fastmetar.decode(code, now=datetime.datetime.utcnow())
+    full = Metar(code)
+    assert fast is not None
+    assert fast.code == full.code
+    assert FIELDS[field](fast) == FIELDS[field](full)
+
+
+@pytest.mark.parametrize("code", FALLBACK)
+def test_fallback_uses_metar(code):
+    assert fastmetar.decode(code) is None
+    obs = fastmetar.parse(code)
+    full = Metar(code)
+    assert isinstance(obs, Metar)
+    for name, value in FIELDS.items():
+        assert value(obs) == value(full), name
+
+
+@pytest.mark.parametrize("code", ERROR)
+def test_parse_raises_like_metar(code):
+    assert fastmetar.decode(code) is None
+    with pytest.raises(ParserError):
+        Metar(code)
+    with pytest.raises(ParserError):
+        fastmetar.parse(code)
+
+
+@pytest.mark.parametrize("code", FAST + FALLBACK)
+def test_compare_reports_no_differences(code):
+    decoded, differences = fastmetar.compare(code)
+    assert decoded == (code in FAST)
+    assert differences == []